@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Compares the throughput of the JSON codecs behind redash.utils.json_dumpb/json_loads on a
+large query result payload. Only compact output (json_dumpb, or json_dumps with
+`separators=(",", ":")`) goes through orjson; plain json_dumps calls always use the stdlib.
+
+    python bin/benchmarks/json_codec.py [--rows 200000] [--repeat 3]
+"""
+import argparse
+import datetime
+import decimal
+import time
+import uuid
+from unittest.mock import patch
+
+from redash.utils import json_dumpb, json_loads, orjson_enabled
+
+
+def make_result(rows):
+    now = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+    columns = ["id", "name", "amount", "price", "ratio", "created_at", "uuid", "active"]
+    return {
+        "columns": [{"name": c, "friendly_name": c, "type": None} for c in columns],
+        "rows": [
+            {
+                "id": i,
+                "name": "customer name {}".format(i),
+                "amount": decimal.Decimal(i) / 100,
+                "price": i * 1.1,
+                "ratio": float("nan") if i % 100 == 0 else i / 7,
+                "created_at": now + datetime.timedelta(seconds=i),
+                "uuid": uuid.UUID(int=i),
+                "active": i % 2 == 0,
+            }
+            for i in range(rows)
+        ],
+    }
+
+
+def measure(func, repeat):
+    best = None
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - started_at
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    data = make_result(args.rows)
+    codecs = ["json", "orjson"] if orjson_enabled else ["json"]
+
+    print("{} rows, best of {}".format(args.rows, args.repeat))
+    print("{:<8} {:>12} {:>12} {:>12} {:>12}".format("codec", "dumps (s)", "dumps MB/s", "loads (s)", "loads MB/s"))
+    for codec in codecs:
+        with patch("redash.settings.JSON_CODEC", codec):
+            dumps_time, serialized = measure(lambda: json_dumpb(data), args.repeat)
+            loads_time, _ = measure(lambda: json_loads(serialized), args.repeat)
+
+        size = len(serialized) / 1024 / 1024
+        print(
+            "{:<8} {:>12.3f} {:>12.1f} {:>12.3f} {:>12.1f}".format(
+                codec, dumps_time, size / dumps_time, loads_time, size / loads_time
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
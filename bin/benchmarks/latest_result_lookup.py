@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Times the lookup of the latest result of a query (redash.models.QueryResult.get_latest) on a
+table of many results, where a few popular queries have most of them. It compares the old
+lookup (comparing an expression of retrieved_at, with only the query_hash index) with the current
+one (comparing retrieved_at itself, with the (data_source_id, query_hash, retrieved_at DESC)
+index).
+
+    python bin/benchmarks/latest_result_lookup.py [--rows 10000000] [--lookups 200]
+
+It needs the database settings of a Redash installation, and works in a "benchmark" schema that
+it drops when done.
+"""
+import argparse
+import hashlib
+import random
+import time
+
+from sqlalchemy import create_engine, text
+
+from redash import settings
+
+SCHEMA = "benchmark"
+DATA_SOURCES = 20
+HASHES = 100000
+# A tenth of the results belong to these few (popular, often refreshed) queries.
+HOT_HASHES = 10
+
+OLD_LOOKUP = """
+SELECT id FROM {schema}.query_results
+WHERE query_hash = :query_hash AND data_source_id = :data_source_id
+AND timezone('utc', retrieved_at) + make_interval(secs => :max_age) >= timezone('utc', now())
+ORDER BY retrieved_at DESC LIMIT 1
+"""
+
+NEW_LOOKUP = """
+SELECT id FROM {schema}.query_results
+WHERE data_source_id = :data_source_id AND query_hash = :query_hash
+AND retrieved_at >= now() - make_interval(secs => :max_age)
+ORDER BY retrieved_at DESC LIMIT 1
+"""
+
+OLD_INDEX = "CREATE INDEX query_results_query_hash ON {schema}.query_results (query_hash)"
+NEW_INDEX = (
+    "CREATE INDEX query_results_latest ON {schema}.query_results (data_source_id, query_hash, retrieved_at DESC)"
+)
+
+
+def create_table(connection, rows):
+    connection.execute(text("DROP SCHEMA IF EXISTS {schema} CASCADE; CREATE SCHEMA {schema}".format(schema=SCHEMA)))
+    connection.execute(
+        text(
+            "CREATE TABLE {schema}.query_results (id bigserial PRIMARY KEY, data_source_id integer, "
+            "query_hash varchar(32), retrieved_at timestamptz)".format(schema=SCHEMA)
+        )
+    )
+    # Results are spread over the last 90 days; hot queries are those whose hash is below HOT_HASHES.
+    connection.execute(
+        text(
+            "INSERT INTO {schema}.query_results (data_source_id, query_hash, retrieved_at) "
+            "SELECT h % :data_sources + 1, md5(h::text), now() - random() * interval '90 days' "
+            "FROM (SELECT CASE WHEN i % 10 = 0 THEN (i / 10) % :hot_hashes ELSE i % :hashes END AS h "
+            "FROM generate_series(1, :rows) AS i) AS s".format(schema=SCHEMA)
+        ),
+        data_sources=DATA_SOURCES,
+        hot_hashes=HOT_HASHES,
+        hashes=HASHES,
+        rows=rows,
+    )
+    connection.execute(text("ANALYZE {schema}.query_results".format(schema=SCHEMA)))
+
+
+def time_lookups(connection, lookup, lookups, hot):
+    statement = text(lookup.format(schema=SCHEMA))
+    started_at = time.perf_counter()
+    for _ in range(lookups):
+        h = random.randrange(HOT_HASHES) if hot else random.randrange(HOT_HASHES, HASHES)
+        connection.execute(
+            statement,
+            query_hash=hashlib.md5(str(h).encode()).hexdigest(),
+            data_source_id=h % DATA_SOURCES + 1,
+            max_age=86400,
+        ).scalar()
+    return (time.perf_counter() - started_at) / lookups * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10000000)
+    parser.add_argument("--lookups", type=int, default=200)
+    args = parser.parse_args()
+
+    engine = create_engine(settings.SQLALCHEMY_DATABASE_URI)
+    with engine.connect() as connection:
+        connection = connection.execution_options(autocommit=True)
+        try:
+            started_at = time.perf_counter()
+            create_table(connection, args.rows)
+            print("{} results ({:.0f}s to create)".format(args.rows, time.perf_counter() - started_at))
+            print("{:<40} {:>14} {:>14}".format("lookup", "hot (ms)", "other (ms)"))
+
+            for name, index, lookup in [
+                ("expression, query_hash index", OLD_INDEX, OLD_LOOKUP),
+                ("retrieved_at, composite index", NEW_INDEX, NEW_LOOKUP),
+            ]:
+                connection.execute(
+                    text("DROP INDEX IF EXISTS {schema}.query_results_query_hash".format(schema=SCHEMA))
+                )
+                connection.execute(text("DROP INDEX IF EXISTS {schema}.query_results_latest".format(schema=SCHEMA)))
+                connection.execute(text(index.format(schema=SCHEMA)))
+                connection.execute(text("ANALYZE {schema}.query_results".format(schema=SCHEMA)))
+                print(
+                    "{:<40} {:>14.2f} {:>14.2f}".format(
+                        name,
+                        time_lookups(connection, lookup, args.lookups, hot=True),
+                        time_lookups(connection, lookup, args.lookups, hot=False),
+                    )
+                )
+        finally:
+            connection.execute(text("DROP SCHEMA IF EXISTS {schema} CASCADE".format(schema=SCHEMA)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Times the PDF export (redash.serializers.serialize_query_result_to_pdf) of a large query result,
+with and without the row cap. Layout is linear in the number of rows, but FPDF builds the document in
+a single string, so uncapped exports of very large results still get slower per row.
+
+    python bin/benchmarks/pdf_export.py [--rows 50000] [--max-rows 10000]
+"""
+import argparse
+import resource
+import time
+from types import SimpleNamespace
+
+from redash.serializers.query_result import serialize_query_result_to_pdf
+from redash.utils.result_storage import ColumnarResultWriter, ResultPayload
+
+COLUMNS = [
+    {"name": "id", "friendly_name": "id", "type": "integer"},
+    {"name": "name", "friendly_name": "name", "type": "string"},
+    {"name": "description", "friendly_name": "description", "type": "string"},
+    {"name": "amount", "friendly_name": "amount", "type": "float"},
+]
+
+
+def make_result(rows):
+    writer = ColumnarResultWriter(COLUMNS)
+    writer.write_rows(
+        [
+            {
+                "id": i,
+                "name": "customer name {}".format(i),
+                # A mix of values that fit in their cell, wrap, and get truncated.
+                "description": "a description long enough to be wrapped over a few lines " * (i % 4),
+                "amount": i * 1.1,
+            }
+            for i in range(rows)
+        ]
+    )
+    return SimpleNamespace(payload=ResultPayload(writer.close()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=50000)
+    parser.add_argument("--max-rows", type=int, default=10000)
+    args = parser.parse_args()
+
+    query_result = make_result(args.rows)
+
+    print("{} rows".format(args.rows))
+    print("{:<10} {:>10} {:>12} {:>10}".format("max rows", "time (s)", "rows/s", "size (MB)"))
+    for max_rows in [args.max_rows, 0]:
+        started_at = time.perf_counter()
+        content = serialize_query_result_to_pdf(query_result, max_rows=max_rows)
+        elapsed = time.perf_counter() - started_at
+        rendered = min(max_rows, args.rows) if max_rows else args.rows
+        print(
+            "{:<10} {:>10.2f} {:>12.0f} {:>10.1f}".format(
+                max_rows or "all", elapsed, rendered / elapsed, len(content) / 1024 / 1024
+            )
+        )
+
+    print("peak RSS: {:.0f} MB".format(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Compares the SQLite and DuckDB engines of the Query Results data source on a join and a group by
+over two cached results (stored in the columnar layout). Each run loads the results into a new
+database, as an execution does, then runs the query; SQLite indexes the join keys.
+
+    python bin/benchmarks/query_results_engines.py [--rows 500000]
+
+It doesn't need a Redash installation, only its Python dependencies (and duckdb).
+"""
+import argparse
+import datetime
+import random
+import sqlite3
+import time
+
+import duckdb
+
+from redash.query_runner.query_results import (
+    create_duckdb_table,
+    create_indexes,
+    create_table,
+)
+from redash.utils.result_storage import FORMAT_COLUMNAR, ResultPayload
+
+COLUMNS = [
+    {"name": "id", "type": "integer"},
+    {"name": "category", "type": "string"},
+    {"name": "amount", "type": "float"},
+    {"name": "created_at", "type": "datetime"},
+]
+
+WORKLOADS = {
+    "join": "SELECT a.category, b.amount FROM cached_query_1 a JOIN cached_query_2 b ON a.id = b.id",
+    "group by": (
+        "SELECT category, count(*) AS results, sum(amount) AS amount, max(created_at) AS latest "
+        "FROM cached_query_1 GROUP BY category"
+    ),
+}
+
+
+def cached_result(rows):
+    started_at = datetime.datetime(2024, 1, 1)
+    data = {
+        "columns": COLUMNS,
+        "rows": [
+            {
+                "id": i,
+                "category": "category {}".format(random.randrange(1000)),
+                "amount": random.random() * 100,
+                "created_at": started_at + datetime.timedelta(seconds=random.randrange(86400 * 365)),
+            }
+            for i in random.sample(range(rows * 2), rows)
+        ],
+    }
+    # Reading the stored payload back, as the runner does.
+    return ResultPayload(ResultPayload.from_data(data, FORMAT_COLUMNAR).raw)
+
+
+def run_sqlite(payloads, query):
+    connection = sqlite3.connect(":memory:")
+    for i, payload in enumerate(payloads, 1):
+        table_name = "cached_query_{}".format(i)
+        create_table(connection, table_name, ResultPayload(payload.raw).to_dict())
+        create_indexes(connection, table_name, {"id"})
+    loaded_at = time.perf_counter()
+    rows = connection.execute(query).fetchall()
+    connection.close()
+    return loaded_at, len(rows)
+
+
+def run_duckdb(payloads, query):
+    connection = duckdb.connect(":memory:")
+    connection.execute("SET TimeZone = 'UTC'")
+    for i, payload in enumerate(payloads, 1):
+        payload = ResultPayload(payload.raw)
+        create_duckdb_table(connection, "cached_query_{}".format(i), payload.columns, payload.iter_json_columns())
+    loaded_at = time.perf_counter()
+    rows = connection.execute(query).fetchall()
+    connection.close()
+    return loaded_at, len(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=500000)
+    args = parser.parse_args()
+
+    payloads = [cached_result(args.rows), cached_result(args.rows)]
+    print("2 cached results of {} rows".format(args.rows))
+    print(
+        "{:<10} {:<8} {:>10} {:>10} {:>10} {:>10}".format(
+            "workload", "engine", "load (s)", "query (s)", "total", "rows"
+        )
+    )
+
+    for workload, query in WORKLOADS.items():
+        for engine, run in [("sqlite", run_sqlite), ("duckdb", run_duckdb)]:
+            started_at = time.perf_counter()
+            loaded_at, rows = run(payloads if workload == "join" else payloads[:1], query)
+            finished_at = time.perf_counter()
+            print(
+                "{:<10} {:<8} {:>10.2f} {:>10.2f} {:>10.2f} {:>10}".format(
+                    workload, engine, loaded_at - started_at, finished_at - loaded_at, finished_at - started_at, rows
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
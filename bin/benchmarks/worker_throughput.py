@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Compares how many small jobs per second a worker runs when it forks a work horse for each job and
+when it keeps a persistent one (REDASH_WORKER_PERSISTENT_HORSES). Each job runs a small query
+against the given data source or, without one, does nothing, to time the worker's own overhead.
+
+    python bin/benchmarks/worker_throughput.py [--jobs 200] [--data-source-id 1] [--query "SELECT 1"]
+
+It needs the Redis and database settings of a Redash installation, and uses a "benchmark" queue.
+"""
+import argparse
+import time
+from unittest.mock import patch
+
+from redash import rq_redis_connection
+from redash.app import create_app
+from redash.tasks.queries.execution import execute_query
+from redash.tasks.worker import Queue, Worker
+
+
+def enqueue_jobs(queue, jobs, data_source_id, query):
+    for i in range(jobs):
+        if data_source_id is None:
+            queue.enqueue("os.getpid")
+        else:
+            # A different comment every time, so that jobs don't share results.
+            queue.enqueue(
+                execute_query,
+                "{} -- {}".format(query, i),
+                data_source_id,
+                {"Username": "benchmark"},
+                user_id=None,
+                scheduled_query_id=None,
+                is_api_key=False,
+            )
+
+
+def run(persistent, jobs, data_source_id, query):
+    queue = Queue("benchmark", connection=rq_redis_connection)
+    queue.empty()
+    enqueue_jobs(queue, jobs, data_source_id, query)
+
+    with patch("redash.settings.WORKER_PERSISTENT_HORSES", persistent):
+        started_at = time.perf_counter()
+        Worker([queue], connection=rq_redis_connection, log_job_description=False).work(
+            burst=True, logging_level="WARNING"
+        )
+        elapsed = time.perf_counter() - started_at
+
+    failed = queue.failed_job_registry.count
+    queue.failed_job_registry.cleanup()
+    queue.empty()
+    return elapsed, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=200)
+    parser.add_argument("--data-source-id", type=int)
+    parser.add_argument("--query", default="SELECT 1")
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        print("{} jobs ({})".format(args.jobs, args.query if args.data_source_id else "no query"))
+        print("{:<12} {:>10} {:>10} {:>8}".format("work horses", "time (s)", "jobs/s", "failed"))
+        for persistent in [False, True]:
+            elapsed, failed = run(persistent, args.jobs, args.data_source_id, args.query)
+            print(
+                "{:<12} {:>10.2f} {:>10.1f} {:>8}".format(
+                    "persistent" if persistent else "fork", elapsed, args.jobs / elapsed, failed
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Compares the XLSX export (redash.serializers.write_query_result_to_xlsx) with the previous
+cell-by-cell writer on a large query result.
+
+    python bin/benchmarks/xlsx_export.py [--rows 1000000]
+"""
+import argparse
+import datetime
+import resource
+import tempfile
+import time
+from types import SimpleNamespace
+
+import xlsxwriter
+
+from redash.serializers.query_result import write_query_result_to_xlsx
+from redash.utils.result_storage import ColumnarResultWriter, ResultPayload
+
+COLUMNS = [
+    {"name": "id", "friendly_name": "id", "type": "integer"},
+    {"name": "name", "friendly_name": "name", "type": "string"},
+    {"name": "amount", "friendly_name": "amount", "type": "float"},
+    {"name": "created_at", "friendly_name": "created_at", "type": "datetime"},
+    {"name": "day", "friendly_name": "day", "type": "date"},
+    {"name": "active", "friendly_name": "active", "type": "boolean"},
+]
+
+
+def make_result(rows, batch_size=50000):
+    start = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+    writer = ColumnarResultWriter(COLUMNS)
+    for offset in range(0, rows, batch_size):
+        writer.write_rows(
+            [
+                {
+                    "id": i,
+                    "name": "customer name {}".format(i),
+                    "amount": i * 1.1,
+                    "created_at": (start + datetime.timedelta(seconds=i)).isoformat(),
+                    "day": (start + datetime.timedelta(days=i % 3650)).date().isoformat(),
+                    "active": i % 2 == 0,
+                }
+                for i in range(offset, min(offset + batch_size, rows))
+            ]
+        )
+    return SimpleNamespace(payload=ResultPayload(writer.close()))
+
+
+def write_cell_by_cell(query_result, output):
+    # The writer XLSX exports used before: generic dispatch and type checks for every cell.
+    payload = query_result.payload
+    book = xlsxwriter.Workbook(output, {"constant_memory": True})
+    sheet = book.add_worksheet("result")
+
+    column_names = []
+    for c, col in enumerate(payload.columns):
+        sheet.write(0, c, col["name"])
+        column_names.append(col["name"])
+
+    for r, row in enumerate(payload.iter_rows()):
+        for c, name in enumerate(column_names):
+            v = row.get(name)
+            if isinstance(v, (dict, list)):
+                v = str(v)
+            sheet.write(r + 1, c, v)
+
+    book.close()
+
+
+def measure(func, query_result):
+    with tempfile.TemporaryFile() as output:
+        started_at = time.perf_counter()
+        func(query_result, output)
+        return time.perf_counter() - started_at, output.tell()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1000000)
+    args = parser.parse_args()
+
+    query_result = make_result(args.rows)
+
+    print("{} rows".format(args.rows))
+    print("{:<14} {:>10} {:>12} {:>10}".format("writer", "time (s)", "rows/s", "size (MB)"))
+    for name, func in [("cell by cell", write_cell_by_cell), ("per column", write_query_result_to_xlsx)]:
+        elapsed, size = measure(func, query_result)
+        print("{:<14} {:>10.2f} {:>12.0f} {:>10.1f}".format(name, elapsed, args.rows / elapsed, size / 1024 / 1024))
+
+    print("peak RSS: {:.0f} MB".format(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+
+
+if __name__ == "__main__":
+    main()
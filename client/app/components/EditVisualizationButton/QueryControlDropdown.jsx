@@ -6,6 +6,7 @@ import Button from "antd/lib/button";
 import PlainButton from "@/components/PlainButton";
 import { clientConfig } from "@/services/auth";
 import axiosLib from "axios";
+import { waitForExport } from "@/services/export";
 
 import PlusCircleFilledIcon from "@ant-design/icons/PlusCircleFilled";
 import ShareAltOutlinedIcon from "@ant-design/icons/ShareAltOutlined";
@@ -33,11 +34,14 @@ export default function QueryControlDropdown(props) {
       }
       
       // Use axiosLib directly to bypass interceptor that converts to response.data
-      const response = await axiosLib.post(url, { parameters }, {
-        responseType: 'blob',
-        xsrfCookieName: 'csrf_token',
-        xsrfHeaderName: 'X-CSRF-TOKEN',
-      });
+      const response = await waitForExport(
+        await axiosLib.post(url, { parameters }, {
+          responseType: 'blob',
+          xsrfCookieName: 'csrf_token',
+          xsrfHeaderName: 'X-CSRF-TOKEN',
+        }),
+        props.apiKey
+      );
       
       // Create blob and trigger download
       const blob = new Blob([response.data], { 
@@ -68,7 +72,7 @@ export default function QueryControlDropdown(props) {
           error.response.data.text().then(text => {
             try {
               const json = JSON.parse(text);
-              alert(`Download failed: ${json.message || errorMessage}`);
+              alert(`Download failed: ${json.message || json.job?.error || errorMessage}`);
             } catch {
               alert(`Download failed: ${errorMessage}`);
             }
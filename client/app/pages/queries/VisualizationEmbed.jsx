@@ -30,6 +30,7 @@ import { Query } from "@/services/query";
 import location from "@/services/location";
 import routes from "@/services/routes";
 import axiosLib from "axios";
+import { waitForExport } from "@/services/export";
 
 // import logoUrl from "@/assets/images/redash_icon_small.png";
 
@@ -83,11 +84,14 @@ function VisualizationEmbedFooter({
       }
       
       // Use axiosLib directly to bypass interceptor that converts to response.data
-      const response = await axiosLib.post(url, { parameters }, {
-        responseType: 'blob',
-        xsrfCookieName: 'csrf_token',
-        xsrfHeaderName: 'X-CSRF-TOKEN',
-      });
+      const response = await waitForExport(
+        await axiosLib.post(url, { parameters }, {
+          responseType: 'blob',
+          xsrfCookieName: 'csrf_token',
+          xsrfHeaderName: 'X-CSRF-TOKEN',
+        }),
+        apiKey
+      );
       
       // Create blob and trigger download
       const blob = new Blob([response.data], { 
@@ -117,7 +121,7 @@ function VisualizationEmbedFooter({
           error.response.data.text().then(text => {
             try {
               const json = JSON.parse(text);
-              alert(`Download failed: ${json.message || errorMessage}`);
+              alert(`Download failed: ${json.message || json.job?.error || errorMessage}`);
             } catch {
               alert(`Download failed: ${errorMessage}`);
             }
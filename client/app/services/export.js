@@ -0,0 +1,21 @@
+import axiosLib from "axios";
+
+const POLL_INTERVAL = 1000; // ms
+
+function exportUrl(jobId, apiKey) {
+  const url = `api/exports/${jobId}`;
+  return apiKey ? `${url}?api_key=${apiKey}` : url;
+}
+
+// Downloads are rendered by background jobs: requesting one answers with the export job and a 202
+// status instead of the file. Polls the export until the file is ready and returns the response
+// holding it. `response` must have been requested with `responseType: "blob"`.
+export async function waitForExport(response, apiKey) {
+  let current = response;
+  while (current.status === 202) {
+    const { job } = JSON.parse(await current.data.text());
+    await new Promise(resolve => setTimeout(resolve, POLL_INTERVAL));
+    current = await axiosLib.get(exportUrl(job.id, apiKey), { responseType: "blob" });
+  }
+  return current;
+}
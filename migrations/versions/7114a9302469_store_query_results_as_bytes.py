@@ -0,0 +1,39 @@
+"""store query results data as bytes
+
+Revision ID: 7114a9302469
+Revises: db0aca1ebd32
+Create Date: 2026-10-18 10:12:41.301527
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7114a9302469'
+down_revision = 'db0aca1ebd32'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Existing JSON documents are kept as-is (UTF-8 encoded) and are read through the
+    # JSON compatibility path of redash.utils.result_storage.
+    op.alter_column('query_results', 'data',
+        existing_type=sa.Text(),
+        type_=sa.LargeBinary(),
+        existing_nullable=True,
+        postgresql_using="convert_to(data, 'UTF8')",
+        )
+
+
+def downgrade():
+    # Columnar payloads can't be represented as text; they are dropped (query results are
+    # a cache and will be recreated on the next execution).
+    op.execute("UPDATE query_results SET data = NULL WHERE substring(data from 1 for 4) = 'RDC1'::bytea")
+    op.alter_column('query_results', 'data',
+        existing_type=sa.LargeBinary(),
+        type_=sa.Text(),
+        existing_nullable=True,
+        postgresql_using="convert_from(data, 'UTF8')",
+        )
@@ -0,0 +1,26 @@
+"""add query_results.data_size
+
+Revision ID: bd23da8f412a
+Revises: 7114a9302469
+Create Date: 2026-10-18 19:41:07.118243
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'bd23da8f412a'
+down_revision = '7114a9302469'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('query_results', sa.Column('data_size', sa.BigInteger(), nullable=True))
+    # Backfill from the stored payloads; octet_length doesn't need to read their content.
+    op.execute("UPDATE query_results SET data_size = octet_length(data) WHERE data IS NOT NULL")
+
+
+def downgrade():
+    op.drop_column('query_results', 'data_size')
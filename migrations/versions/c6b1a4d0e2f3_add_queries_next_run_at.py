@@ -0,0 +1,32 @@
+"""add queries.next_run_at
+
+Revision ID: c6b1a4d0e2f3
+Revises: bd23da8f412a
+Create Date: 2026-10-18 21:12:44.530871
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c6b1a4d0e2f3'
+down_revision = 'bd23da8f412a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('queries', sa.Column('next_run_at', sa.DateTime(timezone=True), nullable=True))
+    op.create_index(op.f('ix_queries_next_run_at'), 'queries', ['next_run_at'], unique=False)
+    # Mark every scheduled query as due: the first refresh_queries run works out when each one
+    # really is and updates the index for those that aren't yet.
+    op.execute(
+        "UPDATE queries SET next_run_at = to_timestamp(0) "
+        "WHERE schedule IS NOT NULL AND jsonb_typeof(schedule) != 'null'"
+    )
+
+
+def downgrade():
+    op.drop_index(op.f('ix_queries_next_run_at'), table_name='queries')
+    op.drop_column('queries', 'next_run_at')
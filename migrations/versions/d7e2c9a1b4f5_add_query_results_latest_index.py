@@ -0,0 +1,29 @@
+"""add an index for the latest result of a query
+
+Revision ID: d7e2c9a1b4f5
+Revises: c6b1a4d0e2f3
+Create Date: 2026-10-18 23:05:12.417093
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'd7e2c9a1b4f5'
+down_revision = 'c6b1a4d0e2f3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # query_results is usually the largest table: build the index without locking it for writes.
+    with op.get_context().autocommit_block():
+        op.execute(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS query_results_data_source_id_query_hash_retrieved_at "
+            "ON query_results (data_source_id, query_hash, retrieved_at DESC)"
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS query_results_data_source_id_query_hash_retrieved_at")
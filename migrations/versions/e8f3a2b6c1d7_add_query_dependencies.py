@@ -0,0 +1,64 @@
+"""add query_dependencies
+
+Revision ID: e8f3a2b6c1d7
+Revises: d7e2c9a1b4f5
+Create Date: 2026-10-18 23:48:37.205114
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "e8f3a2b6c1d7"
+down_revision = "d7e2c9a1b4f5"
+branch_labels = None
+depends_on = None
+
+
+# The same references Query.upstream_dependencies finds, for the existing queries.
+BACKFILL = r"""
+INSERT INTO query_dependencies (query_id, upstream_query_id, kind)
+SELECT DISTINCT d.query_id, upstream.id, d.kind
+FROM (
+    SELECT q.id AS query_id, (regexp_matches(q.query, '(?:join|from)\s+(?:param_)?query_(\d+)', 'gi'))[1] AS upstream_id,
+           'query' AS kind
+    FROM queries q JOIN data_sources ds ON ds.id = q.data_source_id
+    WHERE ds.type = 'results'
+    UNION ALL
+    SELECT q.id, (regexp_matches(q.query, '(?:join|from)\s+cached_query_(\d+)', 'gi'))[1], 'cached_query'
+    FROM queries q JOIN data_sources ds ON ds.id = q.data_source_id
+    WHERE ds.type = 'results'
+    UNION ALL
+    SELECT q.id, p ->> 'queryId', 'dropdown'
+    FROM queries q,
+         jsonb_array_elements(
+             CASE jsonb_typeof(q.options -> 'parameters') WHEN 'array' THEN q.options -> 'parameters' ELSE '[]' END
+         ) AS p
+    WHERE p ->> 'type' = 'query'
+) d
+JOIN queries q ON q.id = d.query_id
+JOIN queries upstream ON upstream.org_id = q.org_id AND upstream.id::text = d.upstream_id
+WHERE upstream.id <> q.id
+"""
+
+
+def upgrade():
+    op.create_table(
+        "query_dependencies",
+        sa.Column("query_id", sa.Integer(), nullable=False),
+        sa.Column("upstream_query_id", sa.Integer(), nullable=False),
+        sa.Column("kind", sa.String(length=16), nullable=False),
+        sa.ForeignKeyConstraint(["query_id"], ["queries.id"], ondelete="CASCADE"),
+        sa.ForeignKeyConstraint(["upstream_query_id"], ["queries.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("query_id", "upstream_query_id", "kind"),
+    )
+    op.create_index(
+        op.f("ix_query_dependencies_upstream_query_id"), "query_dependencies", ["upstream_query_id"], unique=False
+    )
+    op.execute(BACKFILL)
+
+
+def downgrade():
+    op.drop_index(op.f("ix_query_dependencies_upstream_query_id"), table_name="query_dependencies")
+    op.drop_table("query_dependencies")
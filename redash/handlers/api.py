@@ -59,6 +59,7 @@ from redash.handlers.permissions import (
 from redash.handlers.queries import (
     MyQueriesResource,
     QueryArchiveResource,
+    QueryDependenciesResource,
     QueryFavoriteListResource,
     QueryForkResource,
     QueryListResource,
@@ -70,6 +71,8 @@ from redash.handlers.queries import (
     QueryTagsResource,
 )
 from redash.handlers.query_results import (
+    ExportResource,
+    JobEventsResource,
     JobResource,
     QueryDownloadResource,
     QueryDropdownsResource,
@@ -209,6 +212,7 @@ api.add_org_resource(MyQueriesResource, "/api/queries/my", endpoint="my_queries"
 api.add_org_resource(QueryRefreshResource, "/api/queries/<query_id>/refresh", endpoint="query_refresh")
 api.add_org_resource(QueryResource, "/api/queries/<query_id>", endpoint="query")
 api.add_org_resource(QueryForkResource, "/api/queries/<query_id>/fork", endpoint="query_fork")
+api.add_org_resource(QueryDependenciesResource, "/api/queries/<query_id>/dependencies", endpoint="query_dependencies")
 api.add_org_resource(
     QueryRegenerateApiKeyResource,
     "/api/queries/<query_id>/regenerate_api_key",
@@ -251,6 +255,8 @@ api.add_org_resource(
     "/api/queries/<query_id>/download.<filetype>",
     endpoint="query_download",
 )
+api.add_org_resource(ExportResource, "/api/exports/<export_id>", endpoint="export")
+api.add_org_resource(JobEventsResource, "/api/jobs/events", endpoint="job_events")
 api.add_org_resource(
     JobResource,
     "/api/jobs/<job_id>",
@@ -3,6 +3,7 @@ from flask import jsonify, request, url_for
 from flask_login import login_required
 from flask_restful import abort
 from funcy import partial
+from sqlalchemy.orm import joinedload
 from sqlalchemy.orm.exc import StaleDataError
 
 from redash import models, settings
@@ -20,6 +21,7 @@ from redash.handlers.query_results import run_query
 from redash.models.parameterized_query import ParameterizedQuery
 from redash.permissions import (
     can_modify,
+    has_access,
     not_view_only,
     require_access,
     require_admin_or_owner,
@@ -466,7 +468,78 @@ class QueryRefreshResource(BaseResource):
         parameter_values = collect_parameters_from_request(request.args)
         parameterized_query = ParameterizedQuery(query.query_text, org=self.current_org)
         should_apply_auto_limit = query.options.get("apply_auto_limit", False)
-        return run_query(parameterized_query, parameter_values, query.data_source, query.id, should_apply_auto_limit)
+        return run_query(
+            parameterized_query,
+            parameter_values,
+            query.data_source,
+            query.id,
+            should_apply_auto_limit,
+            priority_class="api",
+        )
+
+
+class QueryDependenciesResource(BaseResource):
+    @require_permission("view_query")
+    def get(self, query_id):
+        """
+        Retrieve the queries a query reads and those that read it, for impact analysis.
+
+        :param query_id: ID of the query
+        :qparam number depth: How many levels of dependencies to follow (all of them by default)
+
+        :>json array upstream: The dependencies of the query, then those of the queries it reads,
+                               and so on: ``query_id``, ``upstream_query_id``, ``kind``
+                               (``query``, ``cached_query`` or ``dropdown``) and ``depth``
+        :>json array downstream: The dependencies on the query, then on the queries reading it,
+                                 and so on
+        :>json array queries: The queries in either list
+        """
+        query = get_object_or_404(models.Query.get_by_id_and_org, query_id, self.current_org)
+        require_access(query, self.current_user, view_only)
+        max_depth = request.args.get("depth", type=int)
+
+        upstream = models.QueryDependency.walk(query.id, max_depth=max_depth)
+        downstream = models.QueryDependency.walk(query.id, downstream=True, max_depth=max_depth)
+
+        query_ids = {d.query_id for d, _ in upstream + downstream} | {
+            d.upstream_query_id for d, _ in upstream + downstream
+        }
+        queries = {
+            q.id: q
+            for q in models.Query.query.options(joinedload(models.Query.latest_query_data).load_only("retrieved_at"))
+            .filter(models.Query.id.in_(query_ids), models.Query.org_id == self.current_org.id)
+            .all()
+            if q.id == query.id or has_access(q, self.current_user, view_only)
+        }
+
+        def serialize_dependencies(dependencies):
+            # Leaves out those of queries the user can't view.
+            return [
+                {
+                    "query_id": d.query_id,
+                    "upstream_query_id": d.upstream_query_id,
+                    "kind": d.kind,
+                    "depth": depth,
+                }
+                for d, depth in dependencies
+                if d.query_id in queries and d.upstream_query_id in queries
+            ]
+
+        return {
+            "upstream": serialize_dependencies(upstream),
+            "downstream": serialize_dependencies(downstream),
+            "queries": [
+                {
+                    "id": q.id,
+                    "name": q.name,
+                    "data_source_id": q.data_source_id,
+                    "is_archived": q.is_archived,
+                    "schedule": q.schedule,
+                    "retrieved_at": q.latest_query_data.retrieved_at if q.latest_query_data else None,
+                }
+                for q in sorted(queries.values(), key=lambda q: q.id)
+            ],
+        }
 
 
 class QueryTagsResource(BaseResource):
@@ -1,15 +1,17 @@
-import time
+import tempfile
 import unicodedata
 from urllib.parse import quote
 
 import regex
 import sqlparse
-from flask import make_response, request
+from flask import current_app, make_response, request
 from flask_login import current_user
 from flask_restful import abort
-from rq.job import JobStatus
+from rq.exceptions import NoSuchJobError
+from werkzeug.wsgi import wrap_file
 
-from redash import models, settings
+from redash import models, rq_redis_connection, settings
+from redash.authentication import get_api_key_from_request
 from redash.handlers.base import BaseResource, get_object_or_404, record_event
 from redash.models.parameterized_query import (
     InvalidParameterError,
@@ -28,17 +30,19 @@ from redash.permissions import (
 from redash.serializers import (
     serialize_job,
     serialize_query_result,
-    serialize_query_result_to_dsv,
-    serialize_query_result_to_xlsx,
-    serialize_query_result_to_pdf,
+    serialize_query_result_to_json,
+    stream_query_result_to_dsv,
+    write_query_result_to_xlsx,
 )
-from redash.tasks import Job
+from redash.tasks import Job, enqueue_export, wait_for_job, watch_jobs
+from redash.tasks.exports import EXPORT_CONTENT_TYPES
 from redash.tasks.queries import enqueue_query
 from redash.utils import (
     collect_parameters_from_request,
     json_dumps,
     to_filename,
 )
+from redash.utils.export_storage import get_export_storage
 import re
 from redash.query_runner import split_sql_statements, combine_sql_statements
 
@@ -88,7 +92,16 @@ error_messages = {
 }
 
 
-def run_query(query, parameters, data_source, query_id, should_apply_auto_limit, max_age=0, remove_limit=False):
+def run_query(
+    query,
+    parameters,
+    data_source,
+    query_id,
+    should_apply_auto_limit,
+    max_age=0,
+    remove_limit=False,
+    priority_class=None,
+):
     if not data_source:
         return error_messages["no_data_source"]
 
@@ -133,6 +146,9 @@ def run_query(query, parameters, data_source, query_id, should_apply_auto_limit,
         },
     )
 
+    if priority_class is None and get_api_key_from_request(request):
+        priority_class = "api"
+
     if query_result:
         return {"query_result": serialize_query_result(query_result, current_user.is_api_user())}
     else:
@@ -145,6 +161,7 @@ def run_query(query, parameters, data_source, query_id, should_apply_auto_limit,
                 "Username": current_user.get_actual_user(),
                 "query_id": query_id,
             },
+            priority_class=priority_class,
         )
         return serialize_job(job)
 
@@ -386,14 +403,31 @@ class QueryResultResource(BaseResource):
 
                 self.record_event(event)
 
+            if filetype == "pdf":
+                job = enqueue_export(
+                    "pdf",
+                    query_result.data_source,
+                    query_result=query_result,
+                    query_id=query.id if query is not None else None,
+                )
+                return self.make_export_response(job)
+
             response_builders = {
                 "json": self.make_json_response,
                 "xlsx": self.make_excel_response,
-                "pdf": self.make_pdf_response,
                 "csv": self.make_csv_response,
                 "tsv": self.make_tsv_response,
             }
-            response = response_builders[filetype](query_result)
+            # JSON responses depend on nothing but the (immutable) query result, so clients can
+            # revalidate them with If-None-Match instead of downloading them again.
+            etag = query_result.etag if filetype == "json" else None
+            if etag is not None and request.if_none_match.contains_weak(etag):
+                response = make_response("", 304)
+            else:
+                response = response_builders[filetype](query_result)
+
+            if etag is not None:
+                response.set_etag(etag)
 
             if len(settings.ACCESS_CONTROL_ALLOW_ORIGIN) > 0:
                 self.add_cors_headers(response.headers)
@@ -413,29 +447,51 @@ class QueryResultResource(BaseResource):
 
     @staticmethod
     def make_json_response(query_result):
-        data = json_dumps({"query_result": query_result.to_dict()})
+        data = serialize_query_result_to_json(query_result)
+        if query_result.payload is None or not query_result.payload.is_columnar:
+            # The stored payload is already a single chunk; send it with a Content-Length.
+            data = b"".join(data)
         headers = {"Content-Type": "application/json"}
         return make_response(data, 200, headers)
 
     @staticmethod
     def make_csv_response(query_result):
         headers = {"Content-Type": "text/csv; charset=UTF-8"}
-        return make_response(serialize_query_result_to_dsv(query_result, ","), 200, headers)
+        return make_response(stream_query_result_to_dsv(query_result, ","), 200, headers)
 
     @staticmethod
     def make_tsv_response(query_result):
         headers = {"Content-Type": "text/tab-separated-values; charset=UTF-8"}
-        return make_response(serialize_query_result_to_dsv(query_result, "\t"), 200, headers)
+        return make_response(stream_query_result_to_dsv(query_result, "\t"), 200, headers)
 
     @staticmethod
     def make_excel_response(query_result):
-        headers = {"Content-Type": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"}
-        return make_response(serialize_query_result_to_xlsx(query_result), 200, headers)
+        # The workbook is built in an anonymous temporary file (removed once the response is
+        # closed) and streamed from there, rather than held in memory.
+        output = tempfile.TemporaryFile()
+        try:
+            write_query_result_to_xlsx(query_result, output)
+        except Exception:
+            output.close()
+            raise
+
+        headers = {
+            "Content-Type": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            "Content-Length": str(output.tell()),
+        }
+        output.seek(0)
+        return make_response(wrap_file(request.environ, output), 200, headers)
 
     @staticmethod
-    def make_pdf_response(query_result):
-        headers = {"Content-Type": "application/pdf"}
-        return make_response(serialize_query_result_to_pdf(query_result), 200, headers)
+    def make_export_response(job):
+        # The file is rendered by a background job rather than in the request: clients poll
+        # /api/exports/<job id> until it's ready.
+        headers = {}
+        if len(settings.ACCESS_CONTROL_ALLOW_ORIGIN) > 0:
+            QueryResultResource.add_cors_headers(headers)
+
+        return serialize_job(job), 202, headers
+
 
 class QueryDownloadResource(BaseResource):
     @require_any_of_permission(("view_query", "execute_query"))
@@ -443,10 +499,10 @@ class QueryDownloadResource(BaseResource):
         """
         Download query results as a file (CSV, TSV, XLSX, PDF).
         Always executes query fresh from data source (no cache).
-        
+
         :param number query_id: The ID of the query to download
         :param string filetype: File format (csv, tsv, xlsx, pdf)
-        
+
         Request body:
         {
             "parameters": {
@@ -454,29 +510,30 @@ class QueryDownloadResource(BaseResource):
                 "param2": "value2"
             }
         }
-        
-        Returns: File download
+
+        Returns the export job (with a 202 status): the query is executed and the file rendered in
+        the background, and fetched from `/api/exports/<job_id>` once it's ready.
         """
-        if filetype not in ["csv", "tsv", "xlsx", "pdf"]:
+        if filetype not in EXPORT_CONTENT_TYPES:
             abort(400, message="Invalid file type. Supported: csv, tsv, xlsx, pdf")
-        
+
         # Get query
         query = get_object_or_404(models.Query.get_by_id_and_org, query_id, self.current_org)
-        
+
         if not query.data_source:
             abort(400, message="Query does not have a data source configured.")
-        
+
         require_access(query.data_source, self.current_user, view_only)
-        
+
         # Get parameters from request body
         params = request.get_json(force=True, silent=True) or {}
         parameter_values = params.get("parameters", {})
-        
+
         # Check permissions
         allow_executing_with_view_only_permissions = query.parameterized.is_safe
         # Remove auto_limit for downloads
         should_apply_auto_limit = False
-        
+
         if not has_access(query, self.current_user, allow_executing_with_view_only_permissions):
             if not query.parameterized.is_safe:
                 if current_user.is_api_user():
@@ -485,7 +542,7 @@ class QueryDownloadResource(BaseResource):
                     abort(403, message="This query contains potentially unsafe parameters and cannot be executed with read-only access to this data source.")
             else:
                 abort(403, message="You do not have permission to run queries with this data source.")
-        
+
         # Execute query via queue (always fresh, max_age=0, remove_limit=True for downloads)
         result = run_query(
             query.parameterized,
@@ -495,79 +552,78 @@ class QueryDownloadResource(BaseResource):
             should_apply_auto_limit,
             max_age=0,  # Always execute fresh
             remove_limit=True,  # Remove LIMIT clauses for downloads
+            priority_class="download",
         )
-        
-        # Check if we got a job (query was enqueued)
+
+        if isinstance(result, tuple):
+            # An error response
+            return result
+
+        # The file is rendered once the query job finishes.
         if "job" in result:
-            job_id = result["job"]["id"]
-            job = Job.fetch(job_id)
-            
-            # Poll job until complete (with timeout)
-            max_wait_time = 300  # 5 minutes max
-            poll_interval = 0.5  # Poll every 500ms
-            start_time = time.time()
-            
-            while True:
-                job.refresh()
-                job_status = job.get_status()
-                
-                # Check timeout
-                if time.time() - start_time > max_wait_time:
-                    abort(408, message="Query execution timed out. Please try again or contact support.")
-                
-                # Check if job is done
-                if job_status == JobStatus.FINISHED:
-                    # Get query_result_id from job result
-                    query_result_id = job.result
-                    if not query_result_id:
-                        abort(500, message="Job completed but no result ID found.")
-                    break
-                elif job_status == JobStatus.FAILED:
-                    error = "Query execution failed."
-                    if isinstance(job.result, Exception):
-                        error = str(job.result)
-                    elif isinstance(job.result, dict) and "error" in job.result:
-                        error = job.result["error"]
-                    abort(500, message=error)
-                elif job.is_cancelled:
-                    abort(400, message="Query execution was cancelled.")
-                
-                # Wait before next poll
-                time.sleep(poll_interval)
-        elif "query_result" in result:
-            # Got cached result (shouldn't happen with max_age=0, but handle it)
-            query_result_id = result["query_result"]["id"]
+            query_job = Job.fetch(result["job"]["id"])
+            job = enqueue_export(filetype, query.data_source, query_job=query_job, query_id=query.id)
         else:
-            abort(500, message="Unexpected response from query execution.")
-        
-        # Load query result from database
+            # Got cached result (shouldn't happen with max_age=0, but handle it)
+            query_result = get_object_or_404(
+                models.QueryResult.get_by_id_and_org,
+                result["query_result"]["id"],
+                self.current_org,
+            )
+            job = enqueue_export(filetype, query.data_source, query_result=query_result, query_id=query.id)
+
+        return QueryResultResource.make_export_response(job)
+
+
+class ExportResource(BaseResource):
+    def get(self, export_id):
+        """
+        Fetch a file rendered by an export job.
+
+        :param string export_id: ID of the export job
+
+        Returns the file once the job has finished (range requests are supported), or the job, as
+        in `/api/jobs/<job_id>`, with a 202 status while it's still running.
+        """
+        try:
+            job = Job.fetch(export_id)
+        except NoSuchJobError:
+            abort(404, message="Export not found.")
+
+        if job.meta.get("org_id") != self.current_org.id or "filetype" not in job.meta:
+            abort(404, message="Export not found.")
+
+        data_source = get_object_or_404(
+            models.DataSource.get_by_id_and_org, job.meta["data_source_id"], self.current_org
+        )
+        require_access(data_source, self.current_user, view_only)
+
+        serialized = serialize_job(job)
+        status = serialized["job"]["status"]
+        if status == 4:
+            serialized["job"]["error"] = serialized["job"]["error"] or "Rendering the file failed."
+            return serialized, 500
+        if status != 3:
+            return serialized, 202
+
+        storage = get_export_storage()
+        if not storage.exists(job.id):
+            abort(404, message="This export has expired.")
+
         query_result = get_object_or_404(
-            models.QueryResult.get_by_id_and_org,
-            query_result_id,
-            self.current_org,
+            models.QueryResult.get_by_id_and_org, job.meta["query_result_id"], self.current_org
         )
-        
-        require_access(query_result.data_source, self.current_user, view_only)
-        
-        # Convert to file format
-        response_builders = {
-            "csv": QueryResultResource.make_csv_response,
-            "tsv": QueryResultResource.make_tsv_response,
-            "xlsx": QueryResultResource.make_excel_response,
-            "pdf": QueryResultResource.make_pdf_response,
-        }
-        
-        response = response_builders[filetype](query_result)
-        
-        # Add CORS headers if needed
+        query = None
+        if job.meta.get("query_id") is not None:
+            query = get_object_or_404(models.Query.get_by_id_and_org, job.meta["query_id"], self.current_org)
+
+        filetype = job.meta["filetype"]
+        filename = get_download_filename(query_result, query, filetype)
+        response = storage.send(job.id, filename, EXPORT_CONTENT_TYPES[filetype])
+
         if len(settings.ACCESS_CONTROL_ALLOW_ORIGIN) > 0:
             QueryResultResource.add_cors_headers(response.headers)
-        
-        # Set download filename
-        filename = get_download_filename(query_result, query, filetype)
-        filenames = content_disposition_filenames(filename)
-        response.headers.add("Content-Disposition", "attachment", **filenames)
-        
+
         return response
 
 
@@ -575,8 +631,17 @@ class JobResource(BaseResource):
     def get(self, job_id, query_id=None):
         """
         Retrieve info about a running query job.
+
+        :qparam number wait: if given, wait for up to this many seconds (and at most
+                             JOB_EVENTS_TIMEOUT) for the job to be done before answering
         """
         job = Job.fetch(job_id)
+        wait = min(request.args.get("wait", 0, type=float), settings.JOB_EVENTS_TIMEOUT)
+        if wait > 0:
+            # Don't hold a database connection while waiting.
+            models.db.session.commit()
+            if wait_for_job(job, wait):
+                job.refresh()
         return serialize_job(job)
 
     def delete(self, job_id):
@@ -584,4 +649,54 @@ class JobResource(BaseResource):
         Cancel a query job in progress.
         """
         job = Job.fetch(job_id)
-        job.cancel()
+        # Exports waiting for the query are run anyway, to report that it was cancelled.
+        job.cancel(enqueue_dependents=True)
+
+
+# How often the job event stream sends a comment when there's no news, so that proxies keep it open.
+JOB_EVENTS_HEARTBEAT = 10
+
+
+class JobEventsResource(BaseResource):
+    def get(self):
+        """
+        Stream updates of query jobs, as server-sent events.
+
+        :qparam string job_ids: comma-separated IDs of the jobs to watch
+
+        Sends a `job` event (with the same payload as the job resource) for each job as it is,
+        then again whenever it starts a new stage or is done. Once all of them are done, sends a
+        `done` event and closes the stream; clients should close theirs then. Otherwise the stream
+        closes after JOB_EVENTS_TIMEOUT seconds, and clients reconnect to keep watching.
+        """
+        job_ids = [job_id for job_id in request.args.get("job_ids", "").split(",") if job_id]
+        if not job_ids:
+            abort(400, message="Pass the IDs of the jobs to watch in job_ids.")
+        if len(job_ids) > settings.JOB_EVENTS_MAX_JOBS:
+            abort(400, message="Can't watch more than {} jobs at once.".format(settings.JOB_EVENTS_MAX_JOBS))
+
+        def events():
+            pending = set()
+            for job in watch_jobs(
+                job_ids, rq_redis_connection, settings.JOB_EVENTS_TIMEOUT, heartbeat=JOB_EVENTS_HEARTBEAT
+            ):
+                if job is None:
+                    yield ": keep-alive\n\n"
+                    continue
+
+                serialized = serialize_job(job)
+                if serialized["job"]["status"] in (3, 4):
+                    pending.discard(job.id)
+                else:
+                    pending.add(job.id)
+                yield "event: job\ndata: {}\n\n".format(json_dumps(serialized))
+
+            if not pending:
+                yield "event: done\ndata: {}\n\n"
+
+        # The stream runs after the request is torn down, so it doesn't hold a database connection.
+        return current_app.response_class(
+            events(),
+            mimetype="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
@@ -6,7 +6,7 @@ import re
 import time
 
 import pytz
-from sqlalchemy import UniqueConstraint, and_, cast, distinct, func, or_
+from sqlalchemy import UniqueConstraint, and_, cast, distinct, func, inspect, or_
 from sqlalchemy.dialects.postgresql import ARRAY, DOUBLE_PRECISION, JSONB
 from sqlalchemy.event import listens_for
 from sqlalchemy.ext.hybrid import hybrid_property
@@ -15,6 +15,7 @@ from sqlalchemy.orm import (
     contains_eager,
     joinedload,
     load_only,
+    make_transient_to_detached,
     subqueryload,
 )
 from sqlalchemy.orm.exc import NoResultFound  # noqa: F401
@@ -49,9 +50,9 @@ from redash.models.parameterized_query import (
 from redash.models.types import (
     Configuration,
     EncryptedConfiguration,
-    JSONText,
     MutableDict,
     MutableList,
+    ResultPayloadType,
     json_cast_property,
 )
 from redash.models.users import (  # noqa
@@ -78,9 +79,11 @@ from redash.utils import (
     json_loads,
     mustache_render,
     mustache_render_escape,
+    result_cache,
     sentry,
 )
 from redash.utils.configuration import ConfigurationContainer
+from redash.utils.result_storage import ResultPayload
 
 logger = logging.getLogger(__name__)
 
@@ -91,8 +94,14 @@ class ScheduledQueriesExecutions:
     def __init__(self):
         self.executions = {}
 
-    def refresh(self):
-        self.executions = redis_connection.hgetall(self.KEY_NAME)
+    def refresh(self, query_ids=None):
+        if query_ids is None:
+            self.executions = redis_connection.hgetall(self.KEY_NAME)
+        elif query_ids:
+            timestamps = redis_connection.hmget(self.KEY_NAME, query_ids)
+            self.executions = {str(query_id): timestamp for query_id, timestamp in zip(query_ids, timestamps)}
+        else:
+            self.executions = {}
 
     def update(self, query_id):
         redis_connection.hset(self.KEY_NAME, mapping={query_id: time.time()})
@@ -104,6 +113,14 @@ class ScheduledQueriesExecutions:
 
         return timestamp
 
+    def fetch(self, query_id):
+        """Like `get`, but reads the current value instead of the one from the last refresh."""
+        timestamp = redis_connection.hget(self.KEY_NAME, query_id)
+        if timestamp:
+            timestamp = utils.dt_from_timestamp(timestamp)
+
+        return timestamp
+
 
 scheduled_queries_executions = ScheduledQueriesExecutions()
 
@@ -249,6 +266,29 @@ class DataSource(BelongsToOrgMixin, db.Model):
     def pause_reason(self):
         return redis_connection.get(self._pause_key)
 
+    @property
+    def execution_limits(self):
+        """The limits on running this data source's queries, from its options (see redash.tasks.fair_queue)."""
+
+        def option(name, default):
+            value = self.options.get(name)
+            return default if value is None or value == "" else value
+
+        return {
+            "max_concurrent": int(option("max_concurrent_queries", 0)),
+            "rate": float(option("max_queries_per_minute", 0)),
+            "weight": float(option("queue_weight", 1)),
+        }
+
+    @classmethod
+    def pause_reasons(cls, data_sources):
+        """Returns the pause reason of each of `data_sources` that is paused, by ID, in a single round trip."""
+        if not data_sources:
+            return {}
+
+        reasons = redis_connection.mget([data_source._pause_key for data_source in data_sources])
+        return {data_source.id: reason for data_source, reason in zip(data_sources, reasons) if reason is not None}
+
     def pause(self, reason=None):
         redis_connection.set(self._pause_key, reason or "")
 
@@ -317,25 +357,113 @@ class QueryResult(db.Model, BelongsToOrgMixin):
     data_source = db.relationship(DataSource, backref=backref("query_results"))
     query_hash = Column(db.String(32), index=True)
     query_text = Column("query", db.Text)
-    data = Column(JSONText, nullable=True)
+    payload = Column("data", ResultPayloadType, nullable=True)
+    # Size in bytes of the stored payload.
+    data_size = Column(db.BigInteger, nullable=True)
     runtime = Column(DOUBLE_PRECISION)
     retrieved_at = Column(db.DateTime(True))
 
     __tablename__ = "query_results"
+    __table_args__ = (
+        # Serves the lookups of the latest result of a query (see `get_latest` and
+        # `Query.update_latest_result_by_query_hash`).
+        db.Index(
+            "query_results_data_source_id_query_hash_retrieved_at",
+            data_source_id,
+            query_hash,
+            retrieved_at.desc(),
+        ),
+    )
 
     def __str__(self):
         return "%d | %s | %s" % (self.id, self.query_hash, self.retrieved_at)
 
-    def to_dict(self):
-        return {
+    @property
+    def data(self):
+        if self.payload is None:
+            return None
+
+        return self.payload.to_dict()
+
+    @data.setter
+    def data(self, value):
+        if value is None or isinstance(value, ResultPayload):
+            self.payload = value
+        else:
+            self.payload = ResultPayload.from_data(value)
+
+        self.data_size = None if self.payload is None else self.payload.size
+
+    def to_dict(self, include_data=True):
+        result = {
             "id": self.id,
             "query_hash": self.query_hash,
             "query": self.query_text,
-            "data": self.data,
             "data_source_id": self.data_source_id,
             "runtime": self.runtime,
             "retrieved_at": self.retrieved_at,
         }
+        if include_data:
+            result["data"] = self.data
+
+        return result
+
+    @property
+    def etag(self):
+        """Query results never change once stored, so their id (and hash) identify the content."""
+        return "{}-{}".format(self.id, self.query_hash)
+
+    @classmethod
+    def get_by_id_and_org(cls, object_id, org, org_cls=None):
+        """Same as `BelongsToOrgMixin.get_by_id_and_org`, through the hot result cache (see
+        `redash.utils.result_cache`)."""
+        query_result = cls._from_cache(object_id)
+        if query_result is not None and query_result.org_id == org.id:
+            return query_result
+
+        query_result = super().get_by_id_and_org(object_id, org, org_cls)
+        query_result._cache()
+        return query_result
+
+    @classmethod
+    def _from_cache(cls, result_id):
+        try:
+            result_id = int(result_id)
+        except (TypeError, ValueError):
+            return None
+
+        # Already loaded in this session.
+        query_result = db.session.identity_map.get(db.session.identity_key(cls, result_id))
+        if query_result is not None:
+            return query_result
+
+        cached = result_cache.get(result_id)
+        if cached is None:
+            return None
+
+        columns, raw = cached
+        columns["retrieved_at"] = columns["retrieved_at"] and datetime.datetime.fromisoformat(columns["retrieved_at"])
+        query_result = cls(payload=ResultPayload(raw), **columns)
+        # Attach it to the session as if it was loaded, so that its relationships load as usual.
+        make_transient_to_detached(query_result)
+        db.session.add(query_result)
+        return query_result
+
+    def _cache(self):
+        if self.payload is None:
+            return
+
+        columns = {
+            "id": self.id,
+            "org_id": self.org_id,
+            "data_source_id": self.data_source_id,
+            "query_hash": self.query_hash,
+            "query_text": self.query_text,
+            "data_size": self.data_size,
+            "runtime": self.runtime,
+            "retrieved_at": self.retrieved_at and self.retrieved_at.isoformat(),
+        }
+        result_cache.put(self.id, columns, self.payload.raw)
 
     @classmethod
     def unused(cls, minutes=10):
@@ -351,17 +479,11 @@ class QueryResult(db.Model, BelongsToOrgMixin):
         if max_age == -1 and settings.QUERY_RESULTS_EXPIRED_TTL_ENABLED:
             max_age = settings.QUERY_RESULTS_EXPIRED_TTL
 
-        if max_age == -1:
-            query = cls.query.filter(cls.query_hash == query_hash, cls.data_source == data_source)
-        else:
-            query = cls.query.filter(
-                cls.query_hash == query_hash,
-                cls.data_source == data_source,
-                (
-                    db.func.timezone("utc", cls.retrieved_at) + datetime.timedelta(seconds=max_age)
-                    >= db.func.timezone("utc", db.func.now())
-                ),
-            )
+        query = cls.query.filter(cls.data_source_id == data_source.id, cls.query_hash == query_hash)
+        if max_age != -1:
+            # Compare retrieved_at itself (rather than an expression of it), so that the lookup
+            # stays within the query_results_data_source_id_query_hash_retrieved_at index.
+            query = query.filter(cls.retrieved_at >= db.func.now() - datetime.timedelta(seconds=max_age))
 
         return query.order_by(cls.retrieved_at.desc()).first()
 
@@ -392,6 +514,14 @@ def should_schedule_next(previous_iteration, now, interval, time=None, day_of_we
     # so we should schedule it immediately
     if previous_iteration is None:
         return True
+
+    next_iteration = get_next_iteration(previous_iteration, interval, time, day_of_week, failures)
+    return next_iteration is not None and now > next_iteration
+
+
+def get_next_iteration(previous_iteration, interval, time=None, day_of_week=None, failures=0):
+    """Returns when a schedule is next due after its run at `previous_iteration`, or None if the
+    backoff for its failures put it out of reach."""
     # if time exists then interval > 23 hours (82800s)
     # if day_of_week exists then interval > 6 days (518400s)
     if time is None:
@@ -423,8 +553,8 @@ def should_schedule_next(previous_iteration, now, interval, time=None, day_of_we
         try:
             next_iteration += datetime.timedelta(minutes=2**failures)
         except OverflowError:
-            return False
-    return now > next_iteration
+            return None
+    return next_iteration
 
 
 @gfk_type
@@ -466,6 +596,8 @@ class Query(ChangeTrackingMixin, TimestampMixin, BelongsToOrgMixin, db.Model):
     schedule = Column(MutableDict.as_mutable(JSONB), nullable=True)
     interval = json_cast_property(db.Integer, "schedule", "interval", default=0)
     schedule_failures = Column(db.Integer, default=0)
+    # When the schedule is next due to run the query, so outdated_queries only has to look at those that are.
+    next_run_at = Column(db.DateTime(True), nullable=True, index=True)
     visualizations = db.relationship("Visualization", cascade="all, delete-orphan")
     options = Column(MutableDict.as_mutable(JSONB), default={})
     search_vector = Column(
@@ -591,47 +723,45 @@ class Query(ChangeTrackingMixin, TimestampMixin, BelongsToOrgMixin, db.Model):
 
     @classmethod
     def outdated_queries(cls):
+        now = utils.utcnow()
         queries = (
-            Query.query.options(joinedload(Query.latest_query_data).load_only("retrieved_at"))
-            .filter(func.jsonb_typeof(Query.schedule) != "null")
+            Query.query.options(
+                joinedload(Query.latest_query_data).load_only("retrieved_at"),
+                # What refresh_queries needs, to enqueue them:
+                joinedload(Query.org),
+                joinedload(Query.data_source),
+                joinedload(Query.user),
+            )
+            .filter(Query.next_run_at < now)
             .order_by(Query.id)
             .all()
         )
 
-        now = utils.utcnow()
         outdated_queries = {}
-        scheduled_queries_executions.refresh()
+        rescheduled = False
+        scheduled_queries_executions.refresh([query.id for query in queries])
 
         for query in queries:
             try:
-                if query.schedule.get("disabled"):
-                    continue
-
-                # Skip queries that have None for all schedule values. It's unclear whether this
-                # something that can happen in practice, but we have a test case for it.
-                if all(value is None for value in query.schedule.values()):
-                    continue
+                retrieved_at = scheduled_queries_executions.get(query.id) or (
+                    query.latest_query_data and query.latest_query_data.retrieved_at
+                )
+                next_run_at = query.next_run_after(retrieved_at)
 
-                if query.schedule["until"]:
+                if next_run_at is not None and query.schedule["until"]:
                     schedule_until = pytz.utc.localize(datetime.datetime.strptime(query.schedule["until"], "%Y-%m-%d"))
 
                     if schedule_until <= now:
-                        continue
+                        next_run_at = None
 
-                retrieved_at = scheduled_queries_executions.get(query.id) or (
-                    query.latest_query_data and query.latest_query_data.retrieved_at
-                )
-
-                if should_schedule_next(
-                    retrieved_at,
-                    now,
-                    query.schedule["interval"],
-                    query.schedule["time"],
-                    query.schedule["day_of_week"],
-                    query.schedule_failures,
-                ):
+                if next_run_at is not None and now > next_run_at:
                     key = "{}:{}".format(query.query_hash, query.data_source_id)
                     outdated_queries[key] = query
+                elif next_run_at != query.next_run_at:
+                    # The index was behind (e.g. the query started running but didn't finish yet).
+                    query.next_run_at = next_run_at
+                    query.skip_updated_at = True
+                    rescheduled = True
             except Exception as e:
                 query.schedule["disabled"] = True
                 db.session.commit()
@@ -643,8 +773,57 @@ class Query(ChangeTrackingMixin, TimestampMixin, BelongsToOrgMixin, db.Model):
                 logging.info(message)
                 sentry.capture_exception(type(e)(message).with_traceback(e.__traceback__))
 
+        if rescheduled:
+            db.session.commit()
+
         return list(outdated_queries.values())
 
+    def next_run_after(self, previous_iteration):
+        """Returns when the query is next due to run on its schedule after its run at
+        `previous_iteration` (None if it never ran), or None if the schedule won't run it again."""
+        schedule = self.schedule
+        if not schedule or schedule.get("disabled"):
+            return None
+
+        # Skip queries that have None for all schedule values. It's unclear whether this
+        # something that can happen in practice, but we have a test case for it.
+        if all(value is None for value in schedule.values()):
+            return None
+
+        if previous_iteration is None:
+            # Never ran: it's due right away.
+            return utils.dt_from_timestamp(0)
+
+        next_iteration = get_next_iteration(
+            previous_iteration,
+            schedule["interval"],
+            schedule["time"],
+            schedule["day_of_week"],
+            self.schedule_failures,
+        )
+
+        if next_iteration is not None and schedule["until"]:
+            schedule_until = pytz.utc.localize(datetime.datetime.strptime(schedule["until"], "%Y-%m-%d"))
+
+            if next_iteration >= schedule_until:
+                return None
+
+        return next_iteration
+
+    def update_next_run_at(self):
+        if not self.schedule:
+            self.next_run_at = None
+            return
+
+        try:
+            previous_iteration = (self.id and scheduled_queries_executions.fetch(self.id)) or (
+                self.latest_query_data and self.latest_query_data.retrieved_at
+            )
+            self.next_run_at = self.next_run_after(previous_iteration)
+        except Exception:
+            # Leave it to outdated_queries, which disables the schedules it can't make sense of.
+            self.next_run_at = utils.dt_from_timestamp(0)
+
     @classmethod
     def _do_multi_byte_search(cls, all_queries, term, limit=None):
         # term examples:
@@ -757,7 +936,7 @@ class Query(ChangeTrackingMixin, TimestampMixin, BelongsToOrgMixin, db.Model):
         query_hash = self.query_hash
         data_source_id = self.data_source_id
         query_result = (
-            QueryResult.query.options(load_only("id"))
+            QueryResult.query.options(load_only("id", "retrieved_at"))
             .filter(
                 QueryResult.query_hash == query_hash,
                 QueryResult.data_source_id == data_source_id,
@@ -766,8 +945,7 @@ class Query(ChangeTrackingMixin, TimestampMixin, BelongsToOrgMixin, db.Model):
             .first()
         )
         if query_result:
-            latest_query_data_id = query_result.id
-            self.latest_query_data_id = latest_query_data_id
+            self.latest_query_data = query_result
             db.session.add(self)
 
     @classmethod
@@ -852,6 +1030,30 @@ class Query(ChangeTrackingMixin, TimestampMixin, BelongsToOrgMixin, db.Model):
     def parameterized(self):
         return ParameterizedQuery(self.query_text, self.parameters, self.org)
 
+    @property
+    def upstream_dependencies(self):
+        """The (query id, kind) of each query this one reads, see QueryDependency."""
+        dependencies = set()
+        if self.data_source is not None and self.data_source.type == "results" and self.query_text:
+            from redash.query_runner.query_results import (
+                extract_cached_query_ids,
+                extract_query_ids,
+                extract_query_params,
+            )
+
+            query_ids = extract_query_ids(self.query_text)
+            query_ids += [int(query_id) for query_id, _ in extract_query_params(self.query_text)]
+            dependencies.update((query_id, QueryDependency.QUERY) for query_id in query_ids)
+            dependencies.update(
+                (query_id, QueryDependency.CACHED_QUERY) for query_id in extract_cached_query_ids(self.query_text)
+            )
+
+        for parameter in self.parameters:
+            if parameter.get("type") == "query" and str(parameter.get("queryId", "")).isdigit():
+                dependencies.add((int(parameter["queryId"]), QueryDependency.DROPDOWN))
+
+        return {(query_id, kind) for query_id, kind in dependencies if query_id != self.id}
+
     @property
     def dashboard_api_keys(self):
         query = """SELECT api_keys.api_key
@@ -890,12 +1092,113 @@ class Query(ChangeTrackingMixin, TimestampMixin, BelongsToOrgMixin, db.Model):
 def receive_before_insert_update(mapper, connection, target):
     target.update_query_hash()
 
+    state = inspect(target)
+    if any(state.attrs[attr].history.has_changes() for attr in ("schedule", "schedule_failures", "latest_query_data")):
+        target.update_next_run_at()
+
 
 @listens_for(Query.user_id, "set")
 def query_last_modified_by(target, val, oldval, initiator):
     target.last_modified_by_id = val
 
 
+@listens_for(Query, "after_insert")
+@listens_for(Query, "after_update")
+def receive_after_insert_update(mapper, connection, target):
+    state = inspect(target)
+    if any(state.attrs[attr].history.has_changes() for attr in ("query_text", "options", "data_source")):
+        QueryDependency.update(connection, target)
+
+
+@generic_repr("query_id", "upstream_query_id", "kind")
+class QueryDependency(db.Model):
+    """
+    A query another one reads: by running it (query_N and param_query_N_{...} tables of the Query
+    Results data source), its latest result (cached_query_N tables) or its latest result's values
+    (dropdown parameters). They're updated when the query is saved.
+    """
+
+    QUERY = "query"
+    CACHED_QUERY = "cached_query"
+    DROPDOWN = "dropdown"
+
+    query_id = Column(key_type("Query"), db.ForeignKey("queries.id", ondelete="CASCADE"), primary_key=True)
+    upstream_query_id = Column(
+        key_type("Query"), db.ForeignKey("queries.id", ondelete="CASCADE"), primary_key=True, index=True
+    )
+    kind = Column(db.String(16), primary_key=True)
+
+    __tablename__ = "query_dependencies"
+
+    @classmethod
+    def update(cls, connection, query):
+        """Replaces the dependencies of `query` with those of its current text and parameters. It
+        runs on the flush's `connection`, as the query is saved."""
+        table = cls.__table__
+        connection.execute(table.delete().where(table.c.query_id == query.id))
+
+        dependencies = query.upstream_dependencies
+        if not dependencies:
+            return
+
+        queries = Query.__table__
+        existing = {
+            row.id
+            for row in connection.execute(
+                db.select([queries.c.id]).where(
+                    and_(
+                        queries.c.id.in_({query_id for query_id, _ in dependencies}), queries.c.org_id == query.org_id
+                    )
+                )
+            )
+        }
+        rows = [
+            {"query_id": query.id, "upstream_query_id": query_id, "kind": kind}
+            for query_id, kind in dependencies
+            if query_id in existing
+        ]
+        if rows:
+            connection.execute(table.insert(), rows)
+
+    @classmethod
+    def upstream_of(cls, query_ids):
+        """Returns the upstream queries of each of `query_ids` that has any, with when their latest
+        result was retrieved (None when they don't have one)."""
+        if not query_ids:
+            return {}
+
+        rows = (
+            db.session.query(cls.query_id, cls.upstream_query_id, QueryResult.retrieved_at)
+            .join(Query, Query.id == cls.upstream_query_id)
+            .outerjoin(QueryResult, QueryResult.id == Query.latest_query_data_id)
+            .filter(cls.query_id.in_(query_ids))
+        )
+        upstream = {}
+        for query_id, upstream_query_id, retrieved_at in rows:
+            upstream.setdefault(query_id, {})[upstream_query_id] = retrieved_at
+        return upstream
+
+    @classmethod
+    def walk(cls, query_id, downstream=False, max_depth=None):
+        """Returns the dependencies reachable from `query_id`, upstream (those it reads, then the
+        ones those read...) or downstream, as (dependency, depth) pairs in breadth-first order."""
+        column = cls.upstream_query_id if downstream else cls.query_id
+        next_column = cls.query_id if downstream else cls.upstream_query_id
+
+        found = []
+        visited = {query_id}
+        frontier = {query_id}
+        depth = 0
+        while frontier and (max_depth is None or depth < max_depth):
+            depth += 1
+            dependencies = cls.query.filter(column.in_(frontier)).order_by(cls.query_id, cls.upstream_query_id).all()
+            found.extend((dependency, depth) for dependency in dependencies)
+
+            frontier = {getattr(dependency, next_column.key) for dependency in dependencies} - visited
+            visited |= frontier
+        return found
+
+
 @generic_repr("id", "object_type", "object_id", "user_id", "org_id")
 class Favorite(TimestampMixin, db.Model):
     id = primary_key("Favorite")
@@ -1013,10 +1316,17 @@ class Alert(TimestampMixin, BelongsToOrgMixin, db.Model):
         return super(Alert, cls).get_by_id_and_org(object_id, org, Query)
 
     def evaluate(self):
-        data = self.query_rel.latest_query_data.data if self.query_rel.latest_query_data else None
+        payload = self.query_rel.latest_query_data.payload if self.query_rel.latest_query_data else None
         new_state = self.UNKNOWN_STATE
 
-        if data and data["rows"] and self.options["column"] in data["rows"][0]:
+        if payload is None or not payload.row_count:
+            return new_state
+
+        # Only the alert's column is decoded from the stored result.
+        column = self.options["column"]
+        first_row = next(payload.iter_rows(columns=[column], stop=1))
+
+        if column in first_row:
             op = OPERATORS.get(self.options["op"], lambda v, t: False)
 
             if "selector" not in self.options:
@@ -1027,16 +1337,16 @@ class Alert(TimestampMixin, BelongsToOrgMixin, db.Model):
             try:
                 if selector == "max":
                     max_val = float("-inf")
-                    for i in range(len(data["rows"])):
-                        max_val = max(max_val, float(data["rows"][i][self.options["column"]]))
+                    for row in payload.iter_rows(columns=[column]):
+                        max_val = max(max_val, float(row[column]))
                     value = max_val
                 elif selector == "min":
                     min_val = float("inf")
-                    for i in range(len(data["rows"])):
-                        min_val = min(min_val, float(data["rows"][i][self.options["column"]]))
+                    for row in payload.iter_rows(columns=[column]):
+                        min_val = min(min_val, float(row[column]))
                     value = min_val
                 else:
-                    value = data["rows"][0][self.options["column"]]
+                    value = first_row[column]
 
             except ValueError:
                 return self.UNKNOWN_STATE
@@ -5,6 +5,7 @@ from sqlalchemy_utils import EncryptedType
 
 from redash.utils import json_dumps, json_loads
 from redash.utils.configuration import ConfigurationContainer
+from redash.utils.result_storage import ResultPayload
 
 from .base import db
 
@@ -45,6 +46,30 @@ class JSONText(TypeDecorator):
         return json_loads(value)
 
 
+class ResultPayloadType(TypeDecorator):
+    """
+    Stores query result payloads as bytes, in the format chosen by `QUERY_RESULTS_STORAGE_FORMAT`
+    (see `redash.utils.result_storage`). Loaded values are `ResultPayload` readers that decode lazily.
+    """
+
+    impl = db.LargeBinary
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return value
+
+        if isinstance(value, ResultPayload):
+            return value.raw
+
+        return ResultPayload.from_data(value).raw
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return value
+
+        return ResultPayload(bytes(value))
+
+
 class MutableDict(Mutable, dict):
     @classmethod
     def coerce(cls, key, value):
@@ -5,6 +5,7 @@ from rq.registry import StartedJobRegistry
 
 from redash import __version__, redis_connection, rq_redis_connection, settings
 from redash.models import Dashboard, Query, QueryResult, Widget, db
+from redash.utils import result_cache
 
 
 def get_redis_status():
@@ -54,6 +55,7 @@ def get_status():
     status["manager"]["queues"] = get_queues_status()
     status["database_metrics"] = {}
     status["database_metrics"]["metrics"] = get_db_sizes()
+    status["query_results_cache"] = result_cache.get_stats()
 
     return status
 
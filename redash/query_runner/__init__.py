@@ -1,6 +1,10 @@
+import hashlib
 import logging
+import os
+import threading
+import time
 from collections import defaultdict
-from contextlib import ExitStack
+from contextlib import ExitStack, contextmanager
 from functools import wraps
 
 import sqlparse
@@ -22,6 +26,13 @@ __all__ = [
     "BaseHTTPQueryRunner",
     "InterruptException",
     "JobTimeoutException",
+    "QueryRunnerError",
+    "ResultBudget",
+    "with_result_limits",
+    "with_execution_limits",
+    "ConnectionPool",
+    "get_connection_pool",
+    "close_connection_pools",
     "BaseSQLQueryRunner",
     "TYPE_DATETIME",
     "TYPE_BOOLEAN",
@@ -113,6 +124,275 @@ class NotSupported(Exception):
     pass
 
 
+class QueryRunnerError(Exception):
+    """Raised by `stream_query` when the query fails; the message is shown to the user."""
+
+    pass
+
+
+def _estimate_size(value):
+    # A rough figure (string length, or 8 bytes for anything else) that's cheap to compute.
+    if isinstance(value, (str, bytes, bytearray)):
+        return len(value)
+    return 8
+
+
+class ResultBudget:
+    """
+    Caps how many rows, and roughly how many bytes, a query result may hold. Rows past
+    either limit are dropped and the budget is marked as `truncated`. A limit of 0 (or None)
+    means unlimited.
+    """
+
+    def __init__(self, max_rows=None, max_bytes=None):
+        self.max_rows = max_rows or None
+        self.max_bytes = max_bytes or None
+        self.rows = 0
+        self.bytes = 0
+        self.truncated = False
+
+    @property
+    def remaining_rows(self):
+        if self.max_rows is None:
+            return None
+        return self.max_rows - self.rows
+
+    def fit(self, rows):
+        """Returns the leading part of `rows` (a list of row dicts) that fits in the budget."""
+        if self.truncated:
+            return []
+
+        if self.max_rows is not None and len(rows) > self.remaining_rows:
+            rows = rows[: self.remaining_rows]
+            self.truncated = True
+
+        if self.max_bytes is not None:
+            for i, row in enumerate(rows):
+                size = sum(_estimate_size(v) for v in row.values())
+                if self.bytes + size > self.max_bytes:
+                    rows = rows[:i]
+                    self.truncated = True
+                    break
+                self.bytes += size
+
+        self.rows += len(rows)
+        return rows
+
+    def metadata(self):
+        """Keys to add to the result when it was truncated."""
+        if not self.truncated:
+            return {}
+        return {"truncated": True, "row_count": self.rows}
+
+
+def with_result_limits(schema):
+    """Adds the data source's own result limits (see `BaseQueryRunner.result_budget`) to a
+    runner's configuration schema, as extra options."""
+    schema["properties"].update(
+        {
+            "result_max_rows": {"type": "number", "minimum": 0, "title": "Max Result Rows (0 for no limit)"},
+            "result_max_bytes": {"type": "number", "minimum": 0, "title": "Max Result Size in Bytes (0 for no limit)"},
+        }
+    )
+    schema["extra_options"] = schema.get("extra_options", []) + ["result_max_rows", "result_max_bytes"]
+    if "order" in schema:
+        schema["order"] = schema["order"] + ["result_max_rows", "result_max_bytes"]
+    return schema
+
+
+EXECUTION_LIMITS_OPTIONS = ["max_concurrent_queries", "max_queries_per_minute", "queue_weight"]
+
+
+def with_execution_limits(schema):
+    """Adds the limits on running the data source's queries (see `DataSource.execution_limits`)
+    to a runner's configuration schema, as extra options. Every data source has them."""
+    if not schema:
+        return schema
+
+    schema = dict(schema, properties=dict(schema.get("properties", {})))
+    schema["properties"].update(
+        {
+            "max_concurrent_queries": {
+                "type": "number",
+                "minimum": 0,
+                "title": "Max Concurrent Queries (0 for no limit)",
+            },
+            "max_queries_per_minute": {
+                "type": "number",
+                "minimum": 0,
+                "title": "Max Queries per Minute (0 for no limit)",
+            },
+            "queue_weight": {
+                "type": "number",
+                "exclusiveMinimum": 0,
+                "title": "Share of Workers When Busy (default 1)",
+            },
+        }
+    )
+    schema["extra_options"] = schema.get("extra_options", []) + EXECUTION_LIMITS_OPTIONS
+    if "order" in schema:
+        schema["order"] = schema["order"] + EXECUTION_LIMITS_OPTIONS
+    return schema
+
+
+class ConnectionPool:
+    """
+    Keeps connections to a data source open between queries, so that they don't have to connect
+    (and go through TLS and authentication) every time. Query runners get theirs with
+    `get_connection_pool`, and pass `acquire` the function that opens a new connection.
+
+    The runner's hooks decide what to do with a connection:
+
+    * is_reusable(connection) -- whether it can run another query, without a round trip (e.g.
+      not closed, or cancelled in the middle of a query).
+    * reset(connection) -- clears what the last query left behind (open transaction, session
+      settings...), before it's kept.
+    * ping(connection) -- checks that the server is still there, before using a connection that
+      was idle for more than PING_AFTER seconds.
+
+    A connection that isn't reusable, or whose hooks raise, is closed. At most `max_size` idle
+    connections are kept, for up to `idle_timeout` seconds: with a `max_size` of 0, connections
+    are closed as soon as they're released.
+    """
+
+    PING_AFTER = 30
+
+    def __init__(self, max_size, idle_timeout, is_reusable=None, reset=None, ping=None):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self._is_reusable = is_reusable or (lambda connection: True)
+        self._reset = reset
+        self._ping = ping
+        # (connection, released at) pairs, the most recently released last.
+        self._idle = []
+        self._in_use = 0
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    @property
+    def is_unused(self):
+        return not self._idle and not self._in_use
+
+    def _close(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            logger.debug("Failed closing a pooled connection.", exc_info=True)
+
+    def _check(self, hook, connection):
+        if hook is None:
+            return True
+        try:
+            hook(connection)
+            return True
+        except Exception:
+            logger.debug("Discarding a pooled connection.", exc_info=True)
+            return False
+
+    def _take_expired(self):
+        if self._pid != os.getpid():
+            # Connections opened before a fork belong to the parent process: don't use (or close) them.
+            self._idle = []
+            self._in_use = 0
+            self._pid = os.getpid()
+
+        expired_at = time.monotonic() - self.idle_timeout
+        expired = [connection for connection, released_at in self._idle if released_at < expired_at]
+        self._idle = [(connection, released_at) for connection, released_at in self._idle if released_at >= expired_at]
+        return expired
+
+    def evict_expired(self):
+        """Closes the connections that were idle for longer than `idle_timeout`."""
+        with self._lock:
+            expired = self._take_expired()
+        for connection in expired:
+            self._close(connection)
+
+    def acquire(self, connect):
+        while True:
+            with self._lock:
+                expired = self._take_expired()
+                connection, released_at = self._idle.pop() if self._idle else (None, None)
+            for expired_connection in expired:
+                self._close(expired_connection)
+
+            if connection is None:
+                connection = connect()
+            elif not self._is_reusable(connection) or (
+                time.monotonic() - released_at >= self.PING_AFTER and not self._check(self._ping, connection)
+            ):
+                self._close(connection)
+                continue
+
+            with self._lock:
+                self._in_use += 1
+            return connection
+
+    def release(self, connection):
+        keep = self.max_size > 0 and self._is_reusable(connection) and self._check(self._reset, connection)
+        with self._lock:
+            self._in_use = max(0, self._in_use - 1)
+            if keep and len(self._idle) < self.max_size:
+                self._idle.append((connection, time.monotonic()))
+                return
+        self._close(connection)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection, _ in idle:
+            self._close(connection)
+
+
+_connection_pools = {}
+_connection_pools_lock = threading.Lock()
+
+
+def _configuration_fingerprint(configuration):
+    configuration = configuration.to_dict() if hasattr(configuration, "to_dict") else configuration
+    return hashlib.sha256(utils.json_dumps(configuration, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def get_connection_pool(query_runner, is_reusable=None, reset=None, ping=None):
+    """
+    Returns the pool of connections to `query_runner`'s data source (see `ConnectionPool`),
+    sized by settings.DATA_SOURCE_POOL_SIZE and settings.DATA_SOURCE_POOL_IDLE_TIMEOUT.
+
+    Pools are per runner type and configuration, so connections opened with the options a data
+    source had before they changed are never used again. They're closed once they expire.
+    """
+    key = (query_runner.type(), _configuration_fingerprint(query_runner.configuration))
+    with _connection_pools_lock:
+        pool = _connection_pools.get(key)
+        if pool is None:
+            pool = _connection_pools[key] = ConnectionPool(
+                settings.DATA_SOURCE_POOL_SIZE,
+                settings.DATA_SOURCE_POOL_IDLE_TIMEOUT,
+                is_reusable=is_reusable,
+                reset=reset,
+                ping=ping,
+            )
+        others = [(other_key, other) for other_key, other in _connection_pools.items() if other_key != key]
+
+    for other_key, other in others:
+        other.evict_expired()
+        if other.is_unused:
+            with _connection_pools_lock:
+                if _connection_pools.get(other_key) is other and other.is_unused:
+                    del _connection_pools[other_key]
+
+    return pool
+
+
+def close_connection_pools():
+    """Closes every pooled connection, e.g. before the process exits."""
+    with _connection_pools_lock:
+        pools = list(_connection_pools.values())
+        _connection_pools.clear()
+    for pool in pools:
+        pool.close()
+
+
 class BaseQueryRunner:
     deprecated = False
     should_annotate_query = True
@@ -120,6 +400,7 @@ class BaseQueryRunner:
     limit_query = " LIMIT 1000"
     limit_keywords = ["LIMIT", "OFFSET"]
     limit_after_select = False
+    supports_streaming = False
 
     def __init__(self, configuration):
         self.syntax = "sql"
@@ -212,6 +493,72 @@ class BaseQueryRunner:
     def run_query(self, query, user):
         raise NotImplementedError()
 
+    def stream_query(self, query, user):
+        """Runs the query and yields its results incrementally: first the list of columns (as
+        returned by `fetch_columns`), then batches (lists) of row dicts. The generator may
+        return a dict of other top-level keys for the result (e.g. `truncated`). Failures are
+        raised as `QueryRunnerError`.
+
+        Runners that can fetch results incrementally set `supports_streaming` and override
+        this; the default implementation runs the whole query with `run_query`.
+        """
+        data, error = self.run_query(query, user)
+        if error is not None:
+            raise QueryRunnerError(error)
+
+        yield data["columns"]
+        yield data["rows"]
+        # E.g. the `truncated` flag and `row_count` set by `fetch_rows`.
+        return {key: value for key, value in data.items() if key not in ("columns", "rows")}
+
+    def result_budget(self):
+        """The result limits for this data source: its `result_max_rows`/`result_max_bytes`
+        options (see `with_result_limits`) if set, otherwise the global
+        REDASH_QUERY_RESULTS_MAX_* settings."""
+
+        def limit(option, default):
+            value = self.configuration.get(option)
+            return default if value is None or value == "" else int(value)
+
+        return ResultBudget(
+            max_rows=limit("result_max_rows", settings.QUERY_RESULTS_MAX_ROWS),
+            max_bytes=limit("result_max_bytes", settings.QUERY_RESULTS_MAX_BYTES),
+        )
+
+    def fetch_batches(self, cursor, columns, batch_size=None, budget=None):
+        """Yields batches of row dicts from a DB-API cursor, `batch_size` rows at a time.
+        With a `budget`, fetching stops as soon as it's used up."""
+        batch_size = batch_size or settings.QUERY_RESULTS_STREAM_BATCH_SIZE
+        column_names = [column["name"] for column in columns]
+
+        while True:
+            size = batch_size
+            if budget is not None and budget.remaining_rows is not None:
+                # One row past the limit tells whether the result was actually cut short.
+                size = min(size, budget.remaining_rows + 1)
+
+            rows = cursor.fetchmany(size)
+            if not rows:
+                break
+
+            batch = [dict(zip(column_names, row)) for row in rows]
+            if budget is not None:
+                batch = budget.fit(batch)
+            if batch:
+                yield batch
+            if budget is not None and budget.truncated:
+                break
+
+    def fetch_rows(self, cursor, columns):
+        """Fetches the rows of a DB-API cursor within the data source's result budget. Returns
+        the rows and the metadata to add to the result (see `ResultBudget.metadata`)."""
+        budget = self.result_budget()
+        rows = []
+        for batch in self.fetch_batches(cursor, columns, budget=budget):
+            rows.extend(batch)
+
+        return rows, budget.metadata()
+
     def fetch_columns(self, columns):
         column_names = set()
         duplicates_counters = defaultdict(int)
@@ -250,7 +597,7 @@ class BaseQueryRunner:
         return {
             "name": cls.name(),
             "type": cls.type(),
-            "configuration_schema": cls.configuration_schema(),
+            "configuration_schema": with_execution_limits(cls.configuration_schema()),
             **({"deprecated": True} if cls.deprecated else {}),
         }
 
@@ -441,7 +788,7 @@ def get_configuration_schema_for_query_runner_type(query_runner_type):
     if query_runner_class is None:
         return None
 
-    return query_runner_class.configuration_schema()
+    return with_execution_limits(query_runner_class.configuration_schema())
 
 
 def import_query_runners(query_runner_imports):
@@ -489,37 +836,51 @@ def guess_type_from_string(string_value):
 
 
 def with_ssh_tunnel(query_runner, details):
+    @contextmanager
+    def ssh_tunnel():
+        try:
+            remote_host, remote_port = query_runner.host, query_runner.port
+        except NotImplementedError:
+            raise NotImplementedError("SSH tunneling is not implemented for this query runner yet.")
+
+        stack = ExitStack()
+        try:
+            bastion_address = (details["ssh_host"], details.get("ssh_port", 22))
+            remote_address = (remote_host, remote_port)
+            auth = {
+                "ssh_username": details["ssh_username"],
+                **settings.dynamic_settings.ssh_tunnel_auth(),
+            }
+            server = stack.enter_context(open_tunnel(bastion_address, remote_bind_address=remote_address, **auth))
+        except Exception as error:
+            raise type(error)("SSH tunnel: {}".format(str(error)))
+
+        with stack:
+            try:
+                query_runner.host, query_runner.port = server.local_bind_address
+                yield
+            finally:
+                query_runner.host, query_runner.port = remote_host, remote_port
+
     def tunnel(f):
         @wraps(f)
         def wrapper(*args, **kwargs):
-            try:
-                remote_host, remote_port = query_runner.host, query_runner.port
-            except NotImplementedError:
-                raise NotImplementedError("SSH tunneling is not implemented for this query runner yet.")
+            with ssh_tunnel():
+                return f(*args, **kwargs)
 
-            stack = ExitStack()
-            try:
-                bastion_address = (details["ssh_host"], details.get("ssh_port", 22))
-                remote_address = (remote_host, remote_port)
-                auth = {
-                    "ssh_username": details["ssh_username"],
-                    **settings.dynamic_settings.ssh_tunnel_auth(),
-                }
-                server = stack.enter_context(open_tunnel(bastion_address, remote_bind_address=remote_address, **auth))
-            except Exception as error:
-                raise type(error)("SSH tunnel: {}".format(str(error)))
-
-            with stack:
-                try:
-                    query_runner.host, query_runner.port = server.local_bind_address
-                    result = f(*args, **kwargs)
-                finally:
-                    query_runner.host, query_runner.port = remote_host, remote_port
-
-                return result
+        return wrapper
+
+    def stream_tunnel(f):
+        # The tunnel has to stay open until the generator is exhausted (or closed).
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            with ssh_tunnel():
+                return (yield from f(*args, **kwargs))
 
         return wrapper
 
     query_runner.run_query = tunnel(query_runner.run_query)
+    if query_runner.supports_streaming:
+        query_runner.stream_query = stream_tunnel(query_runner.stream_query)
 
     return query_runner
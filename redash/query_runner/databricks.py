@@ -94,6 +94,12 @@ class Databricks(BaseSQLQueryRunner):
         connection = pyodbc.connect(connection_string, autocommit=True)
         return connection.cursor()
 
+    def result_budget(self):
+        budget = super().result_budget()
+        if budget.max_rows is None or budget.max_rows > ROW_LIMIT:
+            budget.max_rows = ROW_LIMIT
+        return budget
+
     def run_query(self, query, user):
         try:
             cursor = self._get_cursor()
@@ -103,17 +109,14 @@ class Databricks(BaseSQLQueryRunner):
                 cursor.execute(stmt)
 
             if cursor.description is not None:
-                result_set = cursor.fetchmany(ROW_LIMIT)
                 columns = self.fetch_columns([(i[0], TYPES_MAP.get(i[1], TYPE_STRING)) for i in cursor.description])
+                rows, metadata = self.fetch_rows(cursor, columns)
 
-                rows = [dict(zip((column["name"] for column in columns), row)) for row in result_set]
-
-                data = {"columns": columns, "rows": rows}
+                data = {"columns": columns, "rows": rows, **metadata}
 
-                if len(result_set) >= ROW_LIMIT and cursor.fetchone() is not None:
+                if metadata.get("truncated"):
                     logger.warning("Truncated result set.")
                     statsd_client.incr("redash.query_runner.databricks.truncated")
-                    data["truncated"] = True
                 error = None
             else:
                 error = None
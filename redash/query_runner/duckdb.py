@@ -9,7 +9,9 @@ from redash.query_runner import (
     TYPE_STRING,
     BaseSQLQueryRunner,
     InterruptException,
+    QueryRunnerError,
     register,
+    with_result_limits,
 )
 
 logger = logging.getLogger(__name__)
@@ -49,6 +51,7 @@ TYPES_MAP = {
 
 class DuckDB(BaseSQLQueryRunner):
     noop_query = "SELECT 1"
+    supports_streaming = True
 
     def __init__(self, configuration):
         super().__init__(configuration)
@@ -59,7 +62,7 @@ class DuckDB(BaseSQLQueryRunner):
 
     @classmethod
     def configuration_schema(cls):
-        return {
+        schema = {
             "type": "object",
             "properties": {
                 "dbpath": {
@@ -73,6 +76,8 @@ class DuckDB(BaseSQLQueryRunner):
             "required": ["dbpath"],
         }
 
+        return with_result_limits(schema)
+
     @classmethod
     def enabled(cls) -> bool:
         return enabled
@@ -101,8 +106,8 @@ class DuckDB(BaseSQLQueryRunner):
             columns = self.fetch_columns(
                 [(d[0], TYPES_MAP.get(d[1].upper(), TYPE_STRING)) for d in cursor.description]
             )
-            rows = [dict(zip((col["name"] for col in columns), row)) for row in cursor.fetchall()]
-            data = {"columns": columns, "rows": rows}
+            rows, metadata = self.fetch_rows(cursor, columns)
+            data = {"columns": columns, "rows": rows, **metadata}
             return data, None
         except duckdb.InterruptException:
             raise InterruptException("Query cancelled by user.")
@@ -110,6 +115,24 @@ class DuckDB(BaseSQLQueryRunner):
             logger.exception("Error running query: %s", e)
             return None, str(e)
 
+    def stream_query(self, query, user):
+        try:
+            cursor = self.con.cursor()
+            cursor.execute(query)
+            if cursor.description is None:
+                raise QueryRunnerError("Query completed but it returned no data.")
+
+            columns = self.fetch_columns(
+                [(d[0], TYPES_MAP.get(str(d[1]).upper(), TYPE_STRING)) for d in cursor.description]
+            )
+            yield columns
+            yield from self.fetch_batches(cursor, columns)
+        except duckdb.InterruptException:
+            raise InterruptException("Query cancelled by user.")
+        except duckdb.Error as e:
+            logger.exception("Error running query: %s", e)
+            raise QueryRunnerError(str(e))
+
     def get_schema(self, get_stats=False) -> list:
         tables_query = """
             SELECT table_schema, table_name FROM information_schema.tables
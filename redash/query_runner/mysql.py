@@ -1,5 +1,6 @@
 import logging
 import os
+import queue
 import threading
 
 from redash.query_runner import (
@@ -11,7 +12,10 @@ from redash.query_runner import (
     BaseSQLQueryRunner,
     InterruptException,
     JobTimeoutException,
+    QueryRunnerError,
     register,
+    split_sql_statements,
+    with_result_limits,
 )
 from redash.settings import parse_boolean
 
@@ -43,6 +47,14 @@ types_map = {
 }
 
 
+_END_OF_STREAM = object()
+
+
+def _error_message(e):
+    # MySQLdb errors are (code, message) pairs, except for some client side ones.
+    return e.args[1] if len(e.args) > 1 else str(e)
+
+
 class Result:
     def __init__(self):
         pass
@@ -50,6 +62,7 @@ class Result:
 
 class Mysql(BaseSQLQueryRunner):
     noop_query = "SELECT 1"
+    supports_streaming = True
 
     @classmethod
     def configuration_schema(cls):
@@ -114,7 +127,7 @@ class Mysql(BaseSQLQueryRunner):
                 }
             )
 
-        return schema
+        return with_result_limits(schema)
 
     @classmethod
     def name(cls):
@@ -232,20 +245,15 @@ class Mysql(BaseSQLQueryRunner):
             logger.debug("MySQL running query: %s", query)
             cursor.execute(query)
 
-            data = cursor.fetchall()
-            desc = cursor.description
+            data = None
+            if cursor.description is not None:
+                data = self._fetch_result_set(cursor)
 
             while cursor.nextset():
                 if cursor.description is not None:
-                    data = cursor.fetchall()
-                    desc = cursor.description
+                    data = self._fetch_result_set(cursor)
 
-            # TODO - very similar to pg.py
-            if desc is not None:
-                columns = self.fetch_columns([(i[0], types_map.get(i[1], None)) for i in desc])
-                rows = [dict(zip((column["name"] for column in columns), row)) for row in data]
-
-                data = {"columns": columns, "rows": rows}
+            if data is not None:
                 r.data = data
                 r.error = None
             else:
@@ -263,6 +271,91 @@ class Mysql(BaseSQLQueryRunner):
             if connection:
                 connection.close()
 
+    def _fetch_result_set(self, cursor):
+        # TODO - very similar to pg.py
+        columns = self.fetch_columns([(i[0], types_map.get(i[1], None)) for i in cursor.description])
+        rows, metadata = self.fetch_rows(cursor, columns)
+
+        return {"columns": columns, "rows": rows, **metadata}
+
+    def stream_query(self, query, user):
+        if len(split_sql_statements(query)) > 1:
+            # Only the last result set of a multi-statement query is returned, and it can't
+            # be told apart from the others until they've all been read.
+            return (yield from super().stream_query(query, user))
+
+        stopped = threading.Event()
+        batches = queue.Queue(maxsize=2)
+        thread_id = ""
+        t = None
+
+        try:
+            connection = self._connection()
+            thread_id = connection.thread_id()
+            t = threading.Thread(target=self._stream_query, args=(query, connection, batches, stopped))
+            t.start()
+
+            while True:
+                try:
+                    item = batches.get(timeout=1)
+                except queue.Empty:
+                    if not t.is_alive() and batches.empty():
+                        raise QueryRunnerError("The query stopped without returning its results.")
+                    continue
+
+                if item is _END_OF_STREAM:
+                    t.join()
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            # Also reached when the consumer stops early or the job is interrupted.
+            stopped.set()
+            if t is not None and t.is_alive():
+                self._cancel(thread_id)
+                t.join()
+
+    def _stream_query(self, query, connection, batches, stopped):
+        def put(item):
+            while not stopped.is_set():
+                try:
+                    batches.put(item, timeout=1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        cursor = None
+        try:
+            # An unbuffered cursor, so rows are read from the server as they're consumed.
+            cursor = connection.cursor(MySQLdb.cursors.SSCursor)
+            logger.debug("MySQL streaming query: %s", query)
+            cursor.execute(query)
+
+            if cursor.description is None:
+                put(QueryRunnerError("No data was returned."))
+                return
+
+            columns = self.fetch_columns([(i[0], types_map.get(i[1], None)) for i in cursor.description])
+            if not put(columns):
+                return
+
+            for batch in self.fetch_batches(cursor, columns):
+                if not put(batch):
+                    return
+
+            put(_END_OF_STREAM)
+        except MySQLdb.Error as e:
+            put(QueryRunnerError(_error_message(e)))
+        except Exception as e:
+            # Anything else is raised as is by the consumer, which would otherwise wait forever.
+            put(e)
+        finally:
+            if cursor and not stopped.is_set():
+                cursor.close()
+            connection.close()
+
     def _get_ssl_parameters(self):
         if not self.configuration.get("use_ssl"):
             return None
@@ -311,7 +404,7 @@ class RDSMySQL(Mysql):
 
     @classmethod
     def configuration_schema(cls):
-        return {
+        schema = {
             "type": "object",
             "properties": {
                 "host": {"type": "string"},
@@ -326,6 +419,8 @@ class RDSMySQL(Mysql):
             "secret": ["passwd"],
         }
 
+        return with_result_limits(schema)
+
     def _get_ssl_parameters(self):
         if self.configuration.get("use_ssl"):
             ca_path = os.path.join(os.path.dirname(__file__), "./files/rds-combined-ca-bundle.pem")
@@ -6,6 +6,7 @@ from tempfile import NamedTemporaryFile
 from uuid import uuid4
 
 import psycopg2
+import sqlparse
 from psycopg2.extras import Range
 
 from redash.query_runner import (
@@ -18,7 +19,11 @@ from redash.query_runner import (
     BaseSQLQueryRunner,
     InterruptException,
     JobTimeoutException,
+    QueryRunnerError,
+    get_connection_pool,
     register,
+    split_sql_statements,
+    with_result_limits,
 )
 
 logger = logging.getLogger(__name__)
@@ -71,6 +76,65 @@ def _wait(conn, timeout=None):
             raise psycopg2.OperationalError("select.error received")
 
 
+def _execute(conn, statement):
+    cursor = conn.cursor()
+    cursor.execute(statement)
+    _wait(conn, timeout=10)
+    cursor.close()
+
+
+def _is_reusable(conn):
+    # Not closed, nor in the middle of a query (e.g. cancelled).
+    return conn.closed == 0 and conn.get_transaction_status() in (
+        psycopg2.extensions.TRANSACTION_STATUS_IDLE,
+        psycopg2.extensions.TRANSACTION_STATUS_INTRANS,
+        psycopg2.extensions.TRANSACTION_STATUS_INERROR,
+    )
+
+
+class _ServerSideCursor:
+    """
+    Reads a SELECT through a server-side cursor, so its rows stay on the server until they're
+    fetched. psycopg2's named cursors don't work on async connections, so the cursor is
+    DECLAREd (in a transaction) and FETCHed from by hand; waiting on the connection keeps
+    the query interruptible and cancellable like any other.
+    """
+
+    name = "redash_stream"
+
+    def __init__(self, connection, statement):
+        self.connection = connection
+        self.cursor = connection.cursor()
+        self._execute("BEGIN; DECLARE {} NO SCROLL CURSOR FOR\n{}".format(self.name, statement))
+        # Doesn't move the cursor, but runs the query and describes its result.
+        self._execute("FETCH FORWARD 0 FROM {}".format(self.name))
+
+    @property
+    def description(self):
+        return self.cursor.description
+
+    def _execute(self, sql):
+        self.cursor.execute(sql)
+        _wait(self.connection)
+
+    def fetchmany(self, size):
+        self._execute("FETCH FORWARD {:d} FROM {}".format(size, self.name))
+        return self.cursor.fetchall()
+
+
+def _server_side_statement(query):
+    # Only a single SELECT can be declared as a cursor (not DDL, DML, SHOW, EXPLAIN or
+    # SELECT ... INTO).
+    statements = split_sql_statements(query)
+    if len(statements) != 1:
+        return None
+
+    parsed = sqlparse.parse(statements[0])[0]
+    if parsed.get_type() != "SELECT" or any(t.match(sqlparse.tokens.Keyword, "INTO") for t in parsed.tokens):
+        return None
+    return statements[0]
+
+
 def full_table_name(schema, name):
     if "." in name:
         name = '"{}"'.format(name)
@@ -140,10 +204,13 @@ def _get_ssl_config(configuration):
 
 class PostgreSQL(BaseSQLQueryRunner):
     noop_query = "SELECT 1"
+    supports_streaming = True
+    # Clears the session state a query may leave behind, before its connection is used again.
+    reset_query = "DISCARD ALL"
 
     @classmethod
     def configuration_schema(cls):
-        return {
+        schema = {
             "type": "object",
             "properties": {
                 "user": {"type": "string"},
@@ -179,6 +246,8 @@ class PostgreSQL(BaseSQLQueryRunner):
             ],
         }
 
+        return with_result_limits(schema)
+
     @classmethod
     def type(cls):
         return "pg"
@@ -256,9 +325,35 @@ class PostgreSQL(BaseSQLQueryRunner):
 
         return connection
 
-    def run_query(self, query, user):
+    def _connect(self):
         connection = self._get_connection()
-        _wait(connection, timeout=10)
+        try:
+            _wait(connection, timeout=10)
+        except BaseException:
+            connection.close()
+            raise
+        finally:
+            # libpq only reads the certificates while connecting.
+            _cleanup_ssl_certs(self.ssl_config)
+
+        return connection
+
+    def _reset_connection(self, connection):
+        if connection.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            _execute(connection, "ROLLBACK")
+        _execute(connection, self.reset_query)
+
+    def _connection_pool(self):
+        return get_connection_pool(
+            self,
+            is_reusable=_is_reusable,
+            reset=self._reset_connection,
+            ping=lambda connection: _execute(connection, self.noop_query),
+        )
+
+    def run_query(self, query, user):
+        pool = self._connection_pool()
+        connection = pool.acquire(self._connect)
 
         cursor = connection.cursor()
 
@@ -268,9 +363,9 @@ class PostgreSQL(BaseSQLQueryRunner):
 
             if cursor.description is not None:
                 columns = self.fetch_columns([(i[0], types_map.get(i[1], None)) for i in cursor.description])
-                rows = [dict(zip((column["name"] for column in columns), row)) for row in cursor]
+                rows, metadata = self.fetch_rows(cursor, columns)
 
-                data = {"columns": columns, "rows": rows}
+                data = {"columns": columns, "rows": rows, **metadata}
                 error = None
             else:
                 error = "Query completed but it returned no data."
@@ -285,13 +380,46 @@ class PostgreSQL(BaseSQLQueryRunner):
             connection.cancel()
             raise
         finally:
-            connection.close()
-            _cleanup_ssl_certs(self.ssl_config)
+            pool.release(connection)
 
         return data, error
 
+    def stream_query(self, query, user):
+        pool = self._connection_pool()
+        connection = pool.acquire(self._connect)
+
+        statement = _server_side_statement(query)
+
+        try:
+            if statement is not None:
+                cursor = _ServerSideCursor(connection, statement)
+            else:
+                # Other statements are run as they are, and their result is buffered by libpq.
+                cursor = connection.cursor()
+                cursor.execute(query)
+                _wait(connection)
+
+            if cursor.description is None:
+                raise QueryRunnerError("Query completed but it returned no data.")
+
+            columns = self.fetch_columns([(i[0], types_map.get(i[1], None)) for i in cursor.description])
+            yield columns
+            yield from self.fetch_batches(cursor, columns)
+        except (select.error, OSError):
+            raise QueryRunnerError("Query interrupted. Please retry.")
+        except psycopg2.DatabaseError as e:
+            raise QueryRunnerError(str(e))
+        except (KeyboardInterrupt, InterruptException, JobTimeoutException):
+            connection.cancel()
+            raise
+        finally:
+            pool.release(connection)
+
 
 class Redshift(PostgreSQL):
+    # Redshift doesn't support DISCARD.
+    reset_query = "RESET ALL"
+
     @classmethod
     def type(cls):
         return "redshift"
@@ -320,7 +448,7 @@ class Redshift(PostgreSQL):
 
     @classmethod
     def configuration_schema(cls):
-        return {
+        schema = {
             "type": "object",
             "properties": {
                 "user": {"type": "string"},
@@ -354,6 +482,8 @@ class Redshift(PostgreSQL):
             "secret": ["password"],
         }
 
+        return with_result_limits(schema)
+
     def annotate_query(self, query, metadata):
         annotated = super(Redshift, self).annotate_query(query, metadata)
 
@@ -429,7 +559,7 @@ class RedshiftIAM(Redshift):
 
     @classmethod
     def configuration_schema(cls):
-        return {
+        schema = {
             "type": "object",
             "properties": {
                 "rolename": {"type": "string", "title": "IAM Role Name"},
@@ -474,6 +604,8 @@ class RedshiftIAM(Redshift):
             "secret": ["aws_secret_access_key"],
         }
 
+        return with_result_limits(schema)
+
     def _get_connection(self):
         self.ssl_config = {}
 
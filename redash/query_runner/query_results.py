@@ -2,13 +2,25 @@ import datetime
 import decimal
 import hashlib
 import logging
+import os
 import re
 import sqlite3
+import tempfile
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from urllib.parse import parse_qs
 
-from redash import models
+from flask import current_app, has_app_context
+
+from redash import models, settings
 from redash.permissions import has_access, view_only
 from redash.query_runner import (
+    TYPE_BOOLEAN,
+    TYPE_DATE,
+    TYPE_DATETIME,
+    TYPE_FLOAT,
+    TYPE_INTEGER,
     TYPE_STRING,
     BaseQueryRunner,
     JobTimeoutException,
@@ -16,9 +28,70 @@ from redash.query_runner import (
     register,
 )
 from redash.utils import json_dumps
+from redash.utils.result_storage import iter_json_columns
 
 logger = logging.getLogger(__name__)
 
+try:
+    import duckdb
+
+    duckdb_enabled = True
+except ImportError:
+    duckdb_enabled = False
+
+ENGINE_SQLITE = "sqlite"
+ENGINE_DUCKDB = "duckdb"
+
+# Column types of the tables loaded from query results. Booleans are stored as integers either way.
+SQLITE_TYPES = {
+    TYPE_INTEGER: "INTEGER",
+    TYPE_BOOLEAN: "INTEGER",
+    TYPE_FLOAT: "REAL",
+    TYPE_STRING: "TEXT",
+    TYPE_DATETIME: "DATETIME",
+    TYPE_DATE: "DATE",
+}
+# And back, for the columns of the output.
+COLUMN_TYPES = {
+    "INTEGER": TYPE_INTEGER,
+    "REAL": TYPE_FLOAT,
+    "TEXT": TYPE_STRING,
+    "DATETIME": TYPE_DATETIME,
+    "DATE": TYPE_DATE,
+}
+
+# Values SQLite stores as they are, without going through `flatten`.
+PLAIN_TYPES = {int, float, str, bool, type(None)}
+
+# The same for the DuckDB engine. Datetimes keep their offset (the session is in UTC).
+DUCKDB_TYPES = {
+    TYPE_INTEGER: "BIGINT",
+    TYPE_BOOLEAN: "BOOLEAN",
+    TYPE_FLOAT: "DOUBLE",
+    TYPE_STRING: "VARCHAR",
+    TYPE_DATETIME: "TIMESTAMPTZ",
+    TYPE_DATE: "DATE",
+}
+DUCKDB_COLUMN_TYPES = {
+    "BOOLEAN": TYPE_BOOLEAN,
+    "TINYINT": TYPE_INTEGER,
+    "SMALLINT": TYPE_INTEGER,
+    "INTEGER": TYPE_INTEGER,
+    "BIGINT": TYPE_INTEGER,
+    "HUGEINT": TYPE_INTEGER,
+    "UTINYINT": TYPE_INTEGER,
+    "USMALLINT": TYPE_INTEGER,
+    "UINTEGER": TYPE_INTEGER,
+    "UBIGINT": TYPE_INTEGER,
+    "FLOAT": TYPE_FLOAT,
+    "DOUBLE": TYPE_FLOAT,
+    "DECIMAL": TYPE_FLOAT,
+    "VARCHAR": TYPE_STRING,
+    "DATE": TYPE_DATE,
+    "TIMESTAMP": TYPE_DATETIME,
+    "TIMESTAMP WITH TIME ZONE": TYPE_DATETIME,
+}
+
 
 class PermissionError(Exception):
     pass
@@ -71,35 +144,262 @@ def get_query_results(user, query_id, bring_from_cache, params=None):
         else:
             raise Exception("No cached result available for query {}.".format(query.id))
     else:
-        query_text = query.query_text
-        if params is not None:
-            query_text = replace_query_parameters(query_text, params)
-
-        results, error = query.data_source.query_runner.run_query(query_text, user)
-        if error:
-            raise Exception("Failed loading results for query id {}.".format(query.id))
+        results, _ = _run_upstream_query(query.id, *_prepare_upstream_query(query, params), user)
 
     return results
 
 
-def create_tables_from_query_ids(user, connection, query_ids, query_params, cached_query_ids=[]):
-    for query_id in set(cached_query_ids):
+def _prepare_upstream_query(query, params):
+    query_text = query.query_text
+    if params is not None:
+        query_text = replace_query_parameters(query_text, params)
+    return query.data_source.query_runner, query_text
+
+
+def _run_upstream_query(query_id, query_runner, query_text, user):
+    started_at = time.perf_counter()
+    results, error = query_runner.run_query(query_text, user)
+    if error:
+        raise Exception("Failed loading results for query id {}.".format(query_id))
+    return results, time.perf_counter() - started_at
+
+
+def _run_in_app_context(app, func, *args):
+    if app is None:
+        return func(*args)
+    with app.app_context():
+        return func(*args)
+
+
+def fetch_query_results(user, upstream):
+    """Runs the `upstream` queries (table name, query id and parameters) a query references, up
+    to QUERY_RESULTS_RUNNER_MAX_PARALLEL_FETCHES at a time, and yields each table name and query
+    id with the query's results and how long it ran, as they complete."""
+    # Queries are loaded (and access to them checked) here: only running them happens in threads.
+    prepared = [
+        (table_name, query_id) + _prepare_upstream_query(_load_query(user, query_id), params)
+        for table_name, query_id, params in upstream
+    ]
+
+    workers = min(settings.QUERY_RESULTS_RUNNER_MAX_PARALLEL_FETCHES, len(prepared))
+    if workers <= 1:
+        for table_name, query_id, query_runner, query_text in prepared:
+            yield (table_name, query_id) + _run_upstream_query(query_id, query_runner, query_text, user)
+        return
+
+    app = current_app._get_current_object() if has_app_context() else None
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="query_results_fetch")
+    try:
+        futures = {
+            executor.submit(_run_in_app_context, app, _run_upstream_query, query_id, query_runner, query_text, user): (
+                table_name,
+                query_id,
+            )
+            for table_name, query_id, query_runner, query_text in prepared
+        }
+        for future in as_completed(futures):
+            yield futures[future] + future.result()
+    finally:
+        # When one fails (or the execution times out), the others' results aren't needed anymore.
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+class TableCache:
+    """
+    A least-recently-used set of query results loaded as tables, kept for the next executions in
+    the same process (i.e. the same work horse, see WORKER_PERSISTENT_HORSES), so that referencing
+    the same cached result again doesn't load it again.
+
+    The tables live in an in-memory SQLite database that executions ATTACH, keyed by query result
+    id. It holds up to QUERY_RESULTS_RUNNER_CACHE_TABLES tables, of up to
+    QUERY_RESULTS_RUNNER_CACHE_MAX_ROWS rows each.
+    """
+
+    schema = "cache"
+
+    def __init__(self):
+        self._pid = None
+        self._connection = None
+        self._tables = OrderedDict()
+
+    @property
+    def uri(self):
+        return "file:redash_query_results_{}?mode=memory&cache=shared".format(self._pid)
+
+    @property
+    def is_enabled(self):
+        return settings.QUERY_RESULTS_RUNNER_CACHE_TABLES > 0
+
+    def _ensure_connection(self):
+        if self._pid != os.getpid():
+            # Forked: the parent's database isn't ours to use (nor to close).
+            self._pid = os.getpid()
+            self._connection = sqlite3.connect(self.uri, uri=True)
+            self._tables.clear()
+
+    def attach(self, connection):
+        self._ensure_connection()
+        connection.execute("ATTACH DATABASE ? AS {}".format(self.schema), (self.uri,))
+
+    def get(self, result_id, index_columns=()):
+        """Returns the table holding the query result with `result_id`, if it's loaded."""
+        table_name = self._tables.get(result_id)
+        if table_name is None:
+            return None
+
+        self._tables.move_to_end(result_id)
+        create_indexes(self._connection, table_name, index_columns)
+        return "{}.{}".format(self.schema, table_name)
+
+    def put(self, result_id, query_results, index_columns=(), in_use=()):
+        """Loads `query_results` and returns its table, unless it's too large to keep or every
+        table is `in_use` by the current execution."""
+        if len(query_results["rows"]) > settings.QUERY_RESULTS_RUNNER_CACHE_MAX_ROWS:
+            return None
+
+        evictable = [cached_id for cached_id in self._tables if cached_id not in in_use]
+        if len(self._tables) - len(evictable) >= settings.QUERY_RESULTS_RUNNER_CACHE_TABLES:
+            return None
+        while len(self._tables) >= settings.QUERY_RESULTS_RUNNER_CACHE_TABLES:
+            evicted = self._tables.pop(evictable.pop(0))
+            self._connection.execute("DROP TABLE IF EXISTS {}".format(evicted))
+
+        table_name = "query_result_{}".format(result_id)
+        self._connection.execute("DROP TABLE IF EXISTS {}".format(table_name))
+        create_table(self._connection, table_name, query_results)
+        create_indexes(self._connection, table_name, index_columns)
+        self._tables[result_id] = table_name
+        return "{}.{}".format(self.schema, table_name)
+
+    def clear(self):
+        if self._connection is not None and self._pid == os.getpid():
+            self._connection.close()
+        self._pid = self._connection = None
+        self._tables.clear()
+
+
+table_cache = TableCache()
+
+
+def _load_cached_table(user, connection, query_id, join_keys, in_use):
+    table_name = "cached_query_{query_id}".format(query_id=query_id)
+    result_id = _load_query(user, query_id).latest_query_data_id
+
+    results = cached_table = None
+    if table_cache.is_enabled and result_id is not None:
+        cached_table = table_cache.get(result_id, join_keys)
+        if cached_table is None:
+            results = get_query_results(user, query_id, True)
+            cached_table = table_cache.put(result_id, results, join_keys, in_use)
+
+    if cached_table is not None:
+        in_use.add(result_id)
+        connection.execute("CREATE TEMP VIEW {} AS SELECT * FROM {}".format(table_name, cached_table))
+        return
+
+    if results is None:
         results = get_query_results(user, query_id, True)
-        table_name = "cached_query_{query_id}".format(query_id=query_id)
-        create_table(connection, table_name, results)
+    create_table(connection, table_name, results)
+    create_indexes(connection, table_name, join_keys)
 
-    for query in set(query_params):
-        results = get_query_results(user, query[0], False, query[1])
-        table_hash = hashlib.md5(
-            "query_{query}_{hash}".format(query=query[0], hash=query[1]).encode(), usedforsecurity=False
-        ).hexdigest()
-        table_name = "query_{query_id}_{param_hash}".format(query_id=query[0], param_hash=table_hash)
-        create_table(connection, table_name, results)
+
+def _param_table_name(query_id, params):
+    table_hash = hashlib.md5(
+        "query_{query}_{hash}".format(query=query_id, hash=params).encode(), usedforsecurity=False
+    ).hexdigest()
+    return "query_{query_id}_{param_hash}".format(query_id=query_id, param_hash=table_hash)
+
+
+def _referenced_tables(query_ids, query_params, cached_query_ids):
+    """Yields the name of each table a query references, the id of the query it's loaded from,
+    whether it's that query's cached result and the parameters to run the query with."""
+    for query_id in set(cached_query_ids):
+        yield "cached_query_{query_id}".format(query_id=query_id), query_id, True, None
+
+    for query_id, params in set(query_params):
+        yield _param_table_name(query_id, params), query_id, False, params
 
     for query_id in set(query_ids):
-        results = get_query_results(user, query_id, False)
-        table_name = "query_{query_id}".format(query_id=query_id)
+        yield "query_{query_id}".format(query_id=query_id), query_id, False, None
+
+
+def _dependency(table_name, query_id, cached, runtime):
+    return {"table": table_name, "query_id": query_id, "cached": cached, "runtime": round(runtime, 3)}
+
+
+def create_tables_from_query_ids(user, connection, query_ids, query_params, cached_query_ids=[], join_keys=()):
+    """Loads the tables the query references, and returns how long each took to load (or for
+    those of other queries than cached ones, to run)."""
+    dependencies = []
+    upstream = []
+    in_use = set()
+    for table_name, query_id, from_cache, params in _referenced_tables(query_ids, query_params, cached_query_ids):
+        if from_cache:
+            started_at = time.perf_counter()
+            _load_cached_table(user, connection, query_id, join_keys, in_use)
+            dependencies.append(_dependency(table_name, query_id, True, time.perf_counter() - started_at))
+        else:
+            upstream.append((table_name, query_id, params))
+
+    for table_name, query_id, results, runtime in fetch_query_results(user, upstream):
         create_table(connection, table_name, results)
+        create_indexes(connection, table_name, join_keys)
+        dependencies.append(_dependency(table_name, query_id, False, runtime))
+
+    return dependencies
+
+
+def create_duckdb_tables_from_query_ids(user, connection, query_ids, query_params, cached_query_ids=[]):
+    """Same as `create_tables_from_query_ids`, for the DuckDB engine."""
+    dependencies = []
+    upstream = []
+    for table_name, query_id, from_cache, params in _referenced_tables(query_ids, query_params, cached_query_ids):
+        if not from_cache:
+            upstream.append((table_name, query_id, params))
+            continue
+
+        started_at = time.perf_counter()
+        query = _load_query(user, query_id)
+        if query.latest_query_data_id is None:
+            raise Exception("No cached result available for query {}.".format(query.id))
+
+        # Stored column chunks are loaded as they are, without decoding their values.
+        payload = query.latest_query_data.payload
+        create_duckdb_table(connection, table_name, payload.columns, payload.iter_json_columns())
+        dependencies.append(_dependency(table_name, query_id, True, time.perf_counter() - started_at))
+
+    for table_name, query_id, results, runtime in fetch_query_results(user, upstream):
+        names = [column["name"] for column in results["columns"]]
+        create_duckdb_table(connection, table_name, results["columns"], iter_json_columns(names, results["rows"]))
+        dependencies.append(_dependency(table_name, query_id, False, runtime))
+
+    return dependencies
+
+
+def extract_join_keys(query):
+    """Returns the names of the columns the query compares for equality (e.g. in JOIN ... ON) or
+    joins USING."""
+    identifier = r'(?:[\w"]+\.)?("[^"]+"|\w+)'
+    keys = set()
+    for left, right in re.findall(r"{0}\s*=\s*{0}".format(identifier), query):
+        keys.update([left.strip('"'), right.strip('"')])
+    for columns in re.findall(r"\busing\s*\(([^)]*)\)", query, re.IGNORECASE):
+        keys.update(column.strip().strip('"') for column in columns.split(","))
+    return keys
+
+
+def create_indexes(connection, table_name, columns):
+    """Indexes the columns of `table_name` among `columns`."""
+    if not columns:
+        return
+
+    table_columns = [row[1] for row in connection.execute("PRAGMA table_info({})".format(table_name))]
+    for column in table_columns:
+        if column in columns:
+            index_name = fix_column_name("{}_{}".format(table_name, column))
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS {} ON {} ({})".format(index_name, table_name, fix_column_name(column))
+            )
 
 
 def fix_column_name(name):
@@ -117,14 +417,25 @@ def flatten(value):
         return value
 
 
+def _column_definition(column):
+    sqlite_type = SQLITE_TYPES.get(column.get("type"))
+    name = fix_column_name(column["name"])
+    return name if sqlite_type is None else "{} {}".format(name, sqlite_type)
+
+
+def _row_values(rows, columns):
+    for row in rows:
+        yield [value if type(value) in PLAIN_TYPES else flatten(value) for value in map(row.get, columns)]
+
+
 def create_table(connection, table_name, query_results):
     try:
         columns = [column["name"] for column in query_results["columns"]]
         safe_columns = [fix_column_name(column) for column in columns]
 
-        column_list = ", ".join(safe_columns)
-        create_table = "CREATE TABLE {table_name} ({column_list})".format(
-            table_name=table_name, column_list=column_list
+        column_definitions = ", ".join(_column_definition(column) for column in query_results["columns"])
+        create_table = "CREATE TABLE {table_name} ({column_definitions})".format(
+            table_name=table_name, column_definitions=column_definitions
         )
         logger.debug("CREATE TABLE query: %s", create_table)
         connection.execute(create_table)
@@ -133,23 +444,88 @@ def create_table(connection, table_name, query_results):
 
     insert_template = "insert into {table_name} ({column_list}) values ({place_holders})".format(
         table_name=table_name,
-        column_list=column_list,
+        column_list=", ".join(safe_columns),
         place_holders=",".join(["?"] * len(columns)),
     )
 
-    for row in query_results["rows"]:
-        values = [flatten(row.get(column)) for column in columns]
-        connection.execute(insert_template, values)
+    # All the rows in one transaction.
+    with connection:
+        connection.executemany(insert_template, _row_values(query_results["rows"], columns))
+
+
+def _write_json_lines(file, batches):
+    """Writes each batch of JSON arrays as a `{"c0": [...], "c1": [...], ...}` line, and returns
+    the length of the longest one."""
+    longest = 0
+    for arrays in batches:
+        line = b"{" + b",".join(b'"c%d":%s' % (i, array) for i, array in enumerate(arrays)) + b"}\n"
+        file.write(line)
+        longest = max(longest, len(line))
+    return longest
+
+
+def create_duckdb_table(connection, table_name, columns, batches):
+    """Creates `table_name` in DuckDB from `batches` of JSON arrays (see
+    `redash.utils.result_storage.iter_json_columns`), one per column. They go through a
+    newline-delimited JSON file, which DuckDB reads much faster than rows passed as parameters."""
+    if not columns:
+        raise CreateTableError("Error creating table {}: the result has no columns.".format(table_name))
+
+    safe_columns = [fix_column_name(column["name"]) for column in columns]
+    types = [DUCKDB_TYPES.get(column.get("type")) for column in columns]
+
+    with tempfile.NamedTemporaryFile(prefix="redash_query_results_", suffix=".json") as file:
+        longest = _write_json_lines(file, batches)
+        file.flush()
+
+        if not longest:
+            column_definitions = ", ".join(
+                "{} {}".format(name, column_type or "VARCHAR") for name, column_type in zip(safe_columns, types)
+            )
+            statements = ["CREATE TABLE {} ({})".format(table_name, column_definitions)]
+        else:
+            select = "CREATE TABLE {} AS SELECT {} FROM ".format(
+                table_name, ", ".join("unnest(c{}) AS {}".format(i, name) for i, name in enumerate(safe_columns))
+            )
+            read_json = "read_json(?, format = 'newline_delimited', maximum_object_size = {}, {})"
+            statements = [select + read_json.format(longest, "sample_size = -1")]
+            if None not in types:
+                declared = ", ".join("'c{}': '{}[]'".format(i, column_type) for i, column_type in enumerate(types))
+                # Falls back to detecting the types when the values don't match the declared ones.
+                statements.insert(0, select + read_json.format(longest, "columns = {%s}" % declared))
+
+        logger.debug("CREATE TABLE query: %s", statements[0])
+        for statement in statements:
+            try:
+                connection.execute(statement, [file.name] if longest else None)
+                return
+            except duckdb.Error as exc:
+                error = exc
+
+    raise CreateTableError("Error creating table {}: {}".format(table_name, str(error)))
+
+
+def declared_types(connection, query):
+    """Returns the types SQLite declares for the columns of the output of `query`, or None for
+    those it can't tell (e.g. expressions)."""
+    try:
+        connection.execute("CREATE TEMP VIEW redash_output AS {}".format(query))
+    except (sqlite3.Error, sqlite3.Warning):
+        return None
+
+    try:
+        return [
+            COLUMN_TYPES.get(declared_type.split("(")[0].strip().upper())
+            for _, _, declared_type, _, _, _ in connection.execute("PRAGMA table_info(redash_output)")
+        ]
+    finally:
+        connection.execute("DROP VIEW redash_output")
 
 
 def prepare_parameterized_query(query, query_params):
     for params in query_params:
-        table_hash = hashlib.md5(
-            "query_{query}_{hash}".format(query=params[0], hash=params[1]).encode(), usedforsecurity=False
-        ).hexdigest()
         key = "param_query_{query_id}_{{{param_string}}}".format(query_id=params[0], param_string=params[1])
-        value = "query_{query_id}_{param_hash}".format(query_id=params[0], param_hash=table_hash)
-        query = query.replace(key, value)
+        query = query.replace(key, _param_table_name(params[0], params[1]))
     return query
 
 
@@ -157,56 +533,135 @@ class Results(BaseQueryRunner):
     should_annotate_query = False
     noop_query = "SELECT 1"
 
-    @classmethod
-    def configuration_schema(cls):
-        return {"type": "object", "properties": {}}
-
     @classmethod
     def name(cls):
         return "Query Results"
 
+    @classmethod
+    def configuration_schema(cls):
+        return {
+            "type": "object",
+            "properties": {
+                "engine": {
+                    "type": "string",
+                    "title": "Engine",
+                    "enum": [ENGINE_SQLITE, ENGINE_DUCKDB],
+                    "default": ENGINE_SQLITE,
+                },
+                "index_join_keys": {
+                    "type": "boolean",
+                    "title": "Index the columns queries join on (SQLite)",
+                    "default": True,
+                },
+            },
+        }
+
     def run_query(self, query, user):
-        connection = sqlite3.connect(":memory:")
+        if self.configuration.get("engine", ENGINE_SQLITE) == ENGINE_DUCKDB:
+            return self._run_duckdb_query(query, user)
+        return self._run_sqlite_query(query, user)
+
+    def _run_duckdb_query(self, query, user):
+        if not duckdb_enabled:
+            return None, "The DuckDB engine needs the duckdb package to be installed."
+
+        connection = duckdb.connect(":memory:")
+
+        query_ids = extract_query_ids(query)
+        query_params = extract_query_params(query)
+        cached_query_ids = extract_cached_query_ids(query)
+
+        try:
+            connection.execute("SET TimeZone = 'UTC'")
+            dependencies = create_duckdb_tables_from_query_ids(
+                user, connection, query_ids, query_params, cached_query_ids
+            )
+            query = prepare_parameterized_query(query, query_params)
+
+            cursor = connection.execute(query)
+            if cursor.description is not None:
+                columns = self.fetch_columns(
+                    [
+                        (d[0], DUCKDB_COLUMN_TYPES.get(str(d[1]).split("(")[0].upper(), TYPE_STRING))
+                        for d in cursor.description
+                    ]
+                )
+                column_names = [c["name"] for c in columns]
+                rows = [dict(zip(column_names, row)) for row in cursor.fetchall()]
+                data = {"columns": columns, "rows": rows}
+                if dependencies:
+                    data["metadata"] = {"dependencies": dependencies}
+                error = None
+            else:
+                error = "Query completed but it returned no data."
+                data = None
+        except (KeyboardInterrupt, JobTimeoutException):
+            connection.interrupt()
+            raise
+        finally:
+            connection.close()
+        return data, error
+
+    def _run_sqlite_query(self, query, user):
+        connection = sqlite3.connect(":memory:", uri=True)
 
         query_ids = extract_query_ids(query)
 
         query_params = extract_query_params(query)
 
         cached_query_ids = extract_cached_query_ids(query)
-        create_tables_from_query_ids(user, connection, query_ids, query_params, cached_query_ids)
+        join_keys = extract_join_keys(query) if self.configuration.get("index_join_keys", True) else ()
 
-        cursor = connection.cursor()
+        try:
+            if cached_query_ids and table_cache.is_enabled:
+                table_cache.attach(connection)
+            dependencies = create_tables_from_query_ids(
+                user, connection, query_ids, query_params, cached_query_ids, join_keys
+            )
 
-        if query_params is not None:
-            query = prepare_parameterized_query(query, query_params)
+            if query_params is not None:
+                query = prepare_parameterized_query(query, query_params)
 
-        try:
+            cursor = connection.cursor()
             cursor.execute(query)
 
             if cursor.description is not None:
-                columns = self.fetch_columns([(i[0], None) for i in cursor.description])
-
-                rows = []
+                types = declared_types(connection, query) or []
+                if len(types) != len(cursor.description):
+                    types = [None] * len(cursor.description)
+                columns = self.fetch_columns([(d[0], t) for d, t in zip(cursor.description, types)])
                 column_names = [c["name"] for c in columns]
 
-                for i, row in enumerate(cursor):
-                    for j, col in enumerate(row):
-                        guess = guess_type(col)
-
-                        if columns[j]["type"] is None:
-                            columns[j]["type"] = guess
-                        elif columns[j]["type"] != guess:
-                            columns[j]["type"] = TYPE_STRING
-
-                    rows.append(dict(zip(column_names, row)))
+                # Only guess the types SQLite doesn't declare, and only until they're mixed.
+                guessing = [j for j, column in enumerate(columns) if column["type"] is None]
+                if not guessing:
+                    rows = [dict(zip(column_names, row)) for row in cursor]
+                else:
+                    rows = []
+                    for row in cursor:
+                        mixed = False
+                        for j in guessing:
+                            guess = guess_type(row[j])
+
+                            if columns[j]["type"] is None:
+                                columns[j]["type"] = guess
+                            elif columns[j]["type"] != guess:
+                                columns[j]["type"] = TYPE_STRING
+                            mixed = mixed or columns[j]["type"] == TYPE_STRING
+                        if mixed:
+                            guessing = [j for j in guessing if columns[j]["type"] != TYPE_STRING]
+
+                        rows.append(dict(zip(column_names, row)))
 
                 data = {"columns": columns, "rows": rows}
+                if dependencies:
+                    data["metadata"] = {"dependencies": dependencies}
                 error = None
             else:
                 error = "Query completed but it returned no data."
                 data = None
         except (KeyboardInterrupt, JobTimeoutException):
-            connection.cancel()
+            connection.interrupt()
             raise
         finally:
             connection.close()
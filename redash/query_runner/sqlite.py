@@ -4,7 +4,9 @@ import sqlite3
 from redash.query_runner import (
     BaseSQLQueryRunner,
     JobTimeoutException,
+    QueryRunnerError,
     register,
+    with_result_limits,
 )
 
 logger = logging.getLogger(__name__)
@@ -12,15 +14,18 @@ logger = logging.getLogger(__name__)
 
 class Sqlite(BaseSQLQueryRunner):
     noop_query = "pragma quick_check"
+    supports_streaming = True
 
     @classmethod
     def configuration_schema(cls):
-        return {
+        schema = {
             "type": "object",
             "properties": {"dbpath": {"type": "string", "title": "Database Path"}},
             "required": ["dbpath"],
         }
 
+        return with_result_limits(schema)
+
     @classmethod
     def type(cls):
         return "sqlite"
@@ -61,9 +66,9 @@ class Sqlite(BaseSQLQueryRunner):
 
             if cursor.description is not None:
                 columns = self.fetch_columns([(i[0], None) for i in cursor.description])
-                rows = [dict(zip((column["name"] for column in columns), row)) for row in cursor]
+                rows, metadata = self.fetch_rows(cursor, columns)
 
-                data = {"columns": columns, "rows": rows}
+                data = {"columns": columns, "rows": rows, **metadata}
                 error = None
             else:
                 error = "Query completed but it returned no data."
@@ -75,5 +80,25 @@ class Sqlite(BaseSQLQueryRunner):
             connection.close()
         return data, error
 
+    def stream_query(self, query, user):
+        connection = sqlite3.connect(self._dbpath)
+
+        cursor = connection.cursor()
+
+        try:
+            cursor.execute(query)
+
+            if cursor.description is None:
+                raise QueryRunnerError("Query completed but it returned no data.")
+
+            columns = self.fetch_columns([(i[0], None) for i in cursor.description])
+            yield columns
+            yield from self.fetch_batches(cursor, columns)
+        except (KeyboardInterrupt, JobTimeoutException):
+            connection.interrupt()
+            raise
+        finally:
+            connection.close()
+
 
 register(Sqlite)
@@ -1,5 +1,6 @@
 import logging
 
+from redash import settings
 from redash.query_runner import (
     TYPE_BOOLEAN,
     TYPE_DATE,
@@ -10,7 +11,9 @@ from redash.query_runner import (
     BaseQueryRunner,
     InterruptException,
     JobTimeoutException,
+    QueryRunnerError,
     register,
+    with_result_limits,
 )
 
 logger = logging.getLogger(__name__)
@@ -46,10 +49,11 @@ TRINO_TYPES_MAPPING = {
 class Trino(BaseQueryRunner):
     noop_query = "SELECT 1"
     should_annotate_query = False
+    supports_streaming = True
 
     @classmethod
     def configuration_schema(cls):
-        return {
+        schema = {
             "type": "object",
             "properties": {
                 "protocol": {"type": "string", "default": "http"},
@@ -73,6 +77,8 @@ class Trino(BaseQueryRunner):
             "secret": ["password"],
         }
 
+        return with_result_limits(schema)
+
     @classmethod
     def enabled(cls):
         return enabled
@@ -127,7 +133,7 @@ class Trino(BaseQueryRunner):
             catalogs.append(catalog)
         return catalogs
 
-    def run_query(self, query, user):
+    def _get_connection(self):
         if self.configuration.get("password"):
             auth = trino.auth.BasicAuthentication(
                 username=self.configuration.get("username"), password=self.configuration.get("password")
@@ -144,29 +150,67 @@ class Trino(BaseQueryRunner):
             auth=auth,
         )
 
+        return connection
+
+    def _error_message(self, db):
+        default_message = "Unspecified DatabaseError: {0}".format(str(db))
+        if isinstance(db.args[0], dict):
+            message = db.args[0].get("failureInfo", {"message", None}).get("message")
+        else:
+            message = None
+        return default_message if message is None else message
+
+    def run_query(self, query, user):
+        connection = self._get_connection()
+
         cursor = connection.cursor()
 
         try:
             cursor.execute(query)
-            results = cursor.fetchall()
+            budget = self.result_budget()
+            # The column list is only known once the first page of results has arrived.
+            first_rows = cursor.fetchmany(1)
             description = cursor.description
             columns = self.fetch_columns([(c[0], TRINO_TYPES_MAPPING.get(c[1], None)) for c in description])
-            rows = [dict(zip([c["name"] for c in columns], r)) for r in results]
-            data = {"columns": columns, "rows": rows}
+            rows = budget.fit([dict(zip([c["name"] for c in columns], r)) for r in first_rows])
+            if not budget.truncated:
+                for batch in self.fetch_batches(cursor, columns, budget=budget):
+                    rows.extend(batch)
+            data = {"columns": columns, "rows": rows, **budget.metadata()}
+            if budget.truncated:
+                cursor.cancel()
             error = None
         except DatabaseError as db:
             data = None
-            default_message = "Unspecified DatabaseError: {0}".format(str(db))
-            if isinstance(db.args[0], dict):
-                message = db.args[0].get("failureInfo", {"message", None}).get("message")
-            else:
-                message = None
-            error = default_message if message is None else message
+            error = self._error_message(db)
         except (KeyboardInterrupt, InterruptException, JobTimeoutException):
             cursor.cancel()
             raise
 
         return data, error
 
+    def stream_query(self, query, user):
+        connection = self._get_connection()
+
+        cursor = connection.cursor()
+
+        try:
+            cursor.execute(query)
+            # The column list is only known once the first page of results has arrived.
+            first_rows = cursor.fetchmany(settings.QUERY_RESULTS_STREAM_BATCH_SIZE)
+            description = cursor.description
+            columns = self.fetch_columns([(c[0], TRINO_TYPES_MAPPING.get(c[1], None)) for c in description])
+            yield columns
+
+            if first_rows:
+                yield [dict(zip([c["name"] for c in columns], r)) for r in first_rows]
+                yield from self.fetch_batches(cursor, columns)
+        except DatabaseError as db:
+            raise QueryRunnerError(self._error_message(db))
+        except (GeneratorExit, KeyboardInterrupt, InterruptException, JobTimeoutException):
+            # GeneratorExit: the consumer stopped reading (e.g. the result budget ran out).
+            cursor.cancel()
+            raise
+
 
 register(Trino)
@@ -15,8 +15,11 @@ from redash.permissions import has_access, view_only
 from redash.serializers.query_result import (
     serialize_query_result,
     serialize_query_result_to_dsv,
+    serialize_query_result_to_json,
     serialize_query_result_to_xlsx,
-    serialize_query_result_to_pdf
+    serialize_query_result_to_pdf,
+    stream_query_result_to_dsv,
+    write_query_result_to_xlsx,
 )
 
 
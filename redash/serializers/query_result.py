@@ -1,12 +1,26 @@
 import csv
+import datetime
 import io
+import itertools
 import xlsxwriter
 from fpdf import FPDF
 from dateutil.parser import isoparse as parse_date
 from funcy import project, rpartial
 
+from redash import settings
 from redash.authentication.org_resolving import current_org
-from redash.query_runner import TYPE_BOOLEAN, TYPE_DATE, TYPE_DATETIME
+from redash.query_runner import (
+    TYPE_BOOLEAN,
+    TYPE_DATE,
+    TYPE_DATETIME,
+    TYPE_FLOAT,
+    TYPE_INTEGER,
+    TYPE_STRING,
+)
+from redash.utils import json_dumpb
+
+# Size (in characters) of the chunks CSV/TSV downloads are streamed in.
+DSV_CHUNK_SIZE = 64 * 1024
 
 
 def _convert_format(fmt):
@@ -31,12 +45,23 @@ def _convert_bool(value):
     return value
 
 
+def _parse_iso_datetime(value):
+    # datetime.fromisoformat is an order of magnitude faster than dateutil, but (before
+    # Python 3.11) doesn't accept the "Z" suffix or the less common ISO 8601 variants.
+    try:
+        if value.endswith("Z"):
+            return datetime.datetime.fromisoformat(value[:-1] + "+00:00")
+        return datetime.datetime.fromisoformat(value)
+    except ValueError:
+        return parse_date(value)
+
+
 def _convert_datetime(value, fmt):
     if not value:
         return value
 
     try:
-        parsed = parse_date(value)
+        parsed = _parse_iso_datetime(value)
         ret = parsed.strftime(fmt)
     except Exception:
         return value
@@ -44,12 +69,13 @@ def _convert_datetime(value, fmt):
     return ret
 
 
-def _get_column_lists(columns):
-    date_format = _convert_format(current_org.get_setting("date_format"))
+def _get_column_lists(columns, org=None):
+    org = org or current_org
+    date_format = _convert_format(org.get_setting("date_format"))
     datetime_format = _convert_format(
         "{} {}".format(
-            current_org.get_setting("date_format"),
-            current_org.get_setting("time_format"),
+            org.get_setting("date_format"),
+            org.get_setting("time_format"),
         )
     )
 
@@ -60,16 +86,16 @@ def _get_column_lists(columns):
     }
 
     fieldnames = []
-    special_columns = dict()
+    converters = []
 
-    for col in columns:
+    for index, col in enumerate(columns):
         fieldnames.append(col["name"])
 
-        for col_type in special_types.keys():
-            if col["type"] == col_type:
-                special_columns[col["name"]] = special_types[col_type]
+        converter = special_types.get(col.get("type"))
+        if converter is not None:
+            converters.append((index, converter))
 
-    return fieldnames, special_columns
+    return fieldnames, converters
 
 
 def serialize_query_result(query_result, is_api_user):
@@ -80,226 +106,295 @@ def serialize_query_result(query_result, is_api_user):
         return query_result.to_dict()
 
 
-def serialize_query_result_to_dsv(query_result, delimiter):
+def serialize_query_result_to_json(query_result):
+    """
+    Returns the `{"query_result": {...}}` document as an iterator of chunks of bytes. The
+    stored payload is spliced into the envelope instead of being decoded and encoded again.
+    The model is only read up front, so the iterator can be consumed after the request.
+    """
+    envelope = json_dumpb(query_result.to_dict(include_data=False))
+    payload = query_result.payload
+
+    return itertools.chain(
+        [b'{"query_result":' + envelope[:-1] + b',"data":'],
+        [b"null"] if payload is None else payload.iter_json(),
+        [b"}}"],
+    )
+
+
+def _iter_dsv(payload, fieldnames, converters, delimiter):
     s = io.StringIO()
+    writer = csv.writer(s, delimiter=delimiter)
+    writer.writerow(fieldnames)
 
-    query_data = query_result.data
+    for row in payload.iter_rows():
+        values = [row.get(name) for name in fieldnames]
+        for index, converter in converters:
+            values[index] = converter(values[index])
 
-    fieldnames, special_columns = _get_column_lists(query_data["columns"] or [])
+        writer.writerow(values)
 
-    writer = csv.DictWriter(s, extrasaction="ignore", fieldnames=fieldnames, delimiter=delimiter)
-    writer.writeheader()
+        if s.tell() >= DSV_CHUNK_SIZE:
+            yield s.getvalue()
+            s.seek(0)
+            s.truncate()
 
-    for row in query_data["rows"]:
-        for col_name, converter in special_columns.items():
-            if col_name in row:
-                row[col_name] = converter(row[col_name])
+    yield s.getvalue()
 
-        writer.writerow(row)
 
-    return s.getvalue()
+def stream_query_result_to_dsv(query_result, delimiter, org=None):
+    """
+    Returns the query result as delimiter-separated text, in chunks of roughly
+    `DSV_CHUNK_SIZE` characters. The org settings (of `org`, or the current org) and the
+    payload are read up front, so the iterator can be consumed after the request (e.g. by a
+    streamed response).
+    """
+    payload = query_result.payload
+    fieldnames, converters = _get_column_lists(payload.columns or [], org)
 
+    return _iter_dsv(payload, fieldnames, converters, delimiter)
 
-def serialize_query_result_to_xlsx(query_result):
-    output = io.BytesIO()
 
-    query_data = query_result.data
-    book = xlsxwriter.Workbook(output, {"constant_memory": True})
-    sheet = book.add_worksheet("result")
+def serialize_query_result_to_dsv(query_result, delimiter):
+    return "".join(stream_query_result_to_dsv(query_result, delimiter))
+
+
+def _get_xlsx_writers(book, sheet, columns):
+    """Picks a cell writer for each column from its type, so values don't go through
+    xlsxwriter's generic type dispatch one cell at a time."""
+    date_format = book.add_format({"num_format": "yyyy-mm-dd"})
+    datetime_format = book.add_format({"num_format": "yyyy-mm-dd hh:mm:ss"})
+
+    def write_any(r, c, value):
+        if isinstance(value, (dict, list)):
+            value = str(value)
+        sheet.write(r, c, value)
+
+    def write_number(r, c, value):
+        if type(value) in (int, float):
+            sheet.write_number(r, c, value)
+        else:
+            write_any(r, c, value)
+
+    def write_string(r, c, value):
+        sheet.write_string(r, c, value if type(value) is str else str(value))
+
+    def write_boolean(r, c, value):
+        if type(value) is bool:
+            sheet.write_boolean(r, c, value)
+        else:
+            write_any(r, c, value)
+
+    def datetime_writer(cell_format):
+        def write_datetime(r, c, value):
+            try:
+                sheet.write_datetime(r, c, _parse_iso_datetime(value), cell_format)
+            except Exception:
+                write_any(r, c, value)
+
+        return write_datetime
+
+    writers = {
+        TYPE_INTEGER: write_number,
+        TYPE_FLOAT: write_number,
+        TYPE_STRING: write_string,
+        TYPE_BOOLEAN: write_boolean,
+        TYPE_DATE: datetime_writer(date_format),
+        TYPE_DATETIME: datetime_writer(datetime_format),
+    }
 
-    column_names = []
-    for c, col in enumerate(query_data["columns"]):
-        sheet.write(0, c, col["name"])
-        column_names.append(col["name"])
+    return [writers.get(col.get("type"), write_any) for col in columns]
 
-    for r, row in enumerate(query_data["rows"]):
-        for c, name in enumerate(column_names):
-            v = row.get(name)
-            if isinstance(v, (dict, list)):
-                v = str(v)
-            sheet.write(r + 1, c, v)
 
-    book.close()
+def write_query_result_to_xlsx(query_result, output):
+    """Writes the query result as an XLSX workbook to `output` (a file name or a binary file
+    object)."""
+    payload = query_result.payload
+    columns = payload.columns or []
 
-    return output.getvalue()
+    # Excel has no notion of time zones; aware datetimes are written in their own local time.
+    book = xlsxwriter.Workbook(output, {"constant_memory": True, "remove_timezone": True})
+    sheet = book.add_worksheet("result")
 
-def serialize_query_result_to_pdf(query_result):
-    query_data = query_result.data
-    rows = query_data.get("rows") or []
-    columns_meta = query_data.get("columns") or []
-    column_names = [c["name"] for c in columns_meta[:20]]
+    column_names = [col["name"] for col in columns]
+    sheet.write_row(0, 0, column_names)
 
-    if not column_names:
-        pdf = FPDF("L")
-        # pdf = FPDF();
-        return pdf.output(dest="S").encode("latin1")
+    cells = list(zip(itertools.count(), column_names, _get_xlsx_writers(book, sheet, columns)))
+    for r, row in enumerate(payload.iter_rows(), 1):
+        for c, name, write in cells:
+            value = row.get(name)
+            if value is not None:
+                write(r, c, value)
 
-    # ------------------ CONFIG --------------------
-    PAGE_W, PAGE_H = 297, 210          # A4 landscape
-    # PAGE_W, PAGE_H = 210, 297
-    LEFT, RIGHT = 5, 5
-    TOP, BOTTOM = 10, 10
-    AVAILABLE_W = PAGE_W - LEFT - RIGHT
+    book.close()
 
-    MAX_LINES = 3                    # max lines per cell
-    LINE_HEIGHT = 5                    # mm per line
-    MAX_ROW_HEIGHT = MAX_LINES * LINE_HEIGHT  # 20mm
 
-    MIN_COL_W = 25
-    CHAR_MM = 0.5
-    PAD = 1
+def serialize_query_result_to_xlsx(query_result):
+    output = io.BytesIO()
+    write_query_result_to_xlsx(query_result, output)
 
-    HEADER_FONT = ("Arial", "B", 8)
-    DATA_FONT = ("Arial", "", 8)
+    return output.getvalue()
 
-    # ------------- BUILD PDF ----------------------
-    pdf = FPDF("L")
-    # pdf = FPDF();
-    pdf.add_page()
-    pdf.set_left_margin(LEFT)
-    pdf.set_right_margin(RIGHT)
-    pdf.set_y(TOP)
-    pdf.set_auto_page_break(auto=False)
 
-    # ------------- HELPERS -------------------------
+# Layout of PDF exports (A4 landscape), in millimetres.
+PDF_PAGE_W, PDF_PAGE_H = 297, 210
+PDF_MARGIN_X, PDF_MARGIN_Y = 5, 10
+PDF_MAX_COLUMNS = 20
+PDF_MAX_LINES = 3  # per cell
+PDF_LINE_HEIGHT = 5
+PDF_CELL_PADDING = 1.5
+PDF_MIN_COL_W = 25
+PDF_CHAR_W = 0.5  # rough width of a character, to size columns from their content
+PDF_HEADER_FONT = ("Arial", "B", 8)
+PDF_DATA_FONT = ("Arial", "", 8)
+PDF_ELLIPSIS = "..."
 
-    def wrap_to_lines(text, width_mm, font):
-        """Wrap text into up to MAX_LINES lines, no padding; last line may get ellipsis."""
+
+class _PdfFontMetrics:
+    """Glyph widths (in mm) of one of FPDF's core fonts, taken from its width table once so that
+    laying out text doesn't go through `FPDF.get_string_width` for every candidate substring."""
+
+    def __init__(self, pdf, font):
         pdf.set_font(*font)
-        text = "" if text is None else str(text).replace("\n", " ")
+        scale = pdf.font_size / 1000.0
+        self.font = font
+        self.widths = {char: width * scale for char, width in pdf.current_font["cw"].items()}
+        self.max_char_width = max(self.widths.values())
+        self.ellipsis_width = sum(self.widths[char] for char in PDF_ELLIPSIS)
+
+    def wrap(self, text, width, max_lines=PDF_MAX_LINES):
+        """Breaks `text` into at most `max_lines` lines no wider than `width`, in a single pass
+        over its characters. If it doesn't fit, the last line ends with an ellipsis.
+        `text` must only contain Latin-1 characters."""
+        widths = self.widths
+        # Most values are short enough to fit on one line without measuring every character.
+        if len(text) * self.max_char_width <= width or sum(map(widths.__getitem__, text)) <= width:
+            return [text]
 
-        width_limit = width_mm - 3.5  # padding from borders
         lines = []
-        remaining = text
-
-        def fit_line(s):
-            lo, hi = 0, len(s)
-            best = 0
-            while lo <= hi:
-                mid = (lo + hi) // 2
-                part = s[:mid]
-                if pdf.get_string_width(part) <= width_limit:
-                    best = mid
-                    lo = mid + 1
-                else:
-                    hi = mid - 1
-            return s[:best]
-
-        for i in range(MAX_LINES):
-            if not remaining:
-                break
-
-            # Last allowed line → add ellipsis if truncated
-            if i == MAX_LINES - 1:
-                lo, hi = 0, len(remaining)
-                best = 0
-                while lo <= hi:
-                    mid = (lo + hi) // 2
-                    part = remaining[:mid] + "..."
-                    if pdf.get_string_width(part) <= width_limit:
-                        best = mid
-                        lo = mid + 1
-                    else:
-                        hi = mid - 1
-
-                if best == 0:
-                    lines.append("...")
-                else:
-                    sub = remaining[:best]
-                    if best < len(remaining):
-                        sub += "..."
-                    lines.append(sub)
-                break
-
-            # Normal line
-            chunk = fit_line(remaining)
-            if not chunk:
-                lines.append("...")
-                break
-
-            lines.append(chunk)
-            remaining = remaining[len(chunk):]
-
+        start = 0
+        used = 0.0
+
+        for end, char in enumerate(text):
+            char_width = widths[char]
+            # A line always gets at least one character, even one wider than the cell.
+            if used + char_width > width and end > start:
+                if len(lines) == max_lines - 1:
+                    lines.append(self._truncate(text[start:end], used, width))
+                    return lines
+                lines.append(text[start:end])
+                start = end
+                used = 0.0
+            used += char_width
+
+        lines.append(text[start:])
         return lines
 
-    def compute_widths():
-        widths = []
-        sample = rows[:10]
+    def _truncate(self, line, used, width):
+        end = len(line)
+        while end and used + self.ellipsis_width > width:
+            end -= 1
+            used -= self.widths[line[end]]
+        return line[:end] + PDF_ELLIPSIS
 
-        for name in column_names:
-            max_chars = max(
-                [len(name)] +
-                [len(str(r.get(name, ""))) for r in sample]
-            )
-            est = max(max_chars * CHAR_MM + PAD, MIN_COL_W)
-            widths.append(est)
 
-        total = sum(widths)
+def _pdf_text(value):
+    # The core fonts only cover Latin-1; other characters are rendered as "?".
+    if value is None:
+        return ""
+    text = str(value).replace("\n", " ")
+    if not text.isascii():
+        text = text.encode("latin-1", "replace").decode("latin-1")
+    return text
 
-        if total > AVAILABLE_W:
-            scale = AVAILABLE_W / total
-            return [w * scale for w in widths]
 
-        extra = AVAILABLE_W - total
-        add = extra / len(widths)
-        return [w + add for w in widths]
+def _pdf_column_widths(column_names, sample):
+    available = PDF_PAGE_W - 2 * PDF_MARGIN_X
+    widths = []
+    for name in column_names:
+        max_chars = max([len(name)] + [len(_pdf_text(row.get(name))) for row in sample])
+        widths.append(max(max_chars * PDF_CHAR_W + 1, PDF_MIN_COL_W))
 
-    def draw_row(text_values, widths, font, fill=False):
-        """Draw one row with dynamic height based on wrapped content."""
-        y_start = pdf.get_y()
-        pdf.set_font(*font)
+    total = sum(widths)
+    if total > available:
+        return [w * available / total for w in widths]
 
-        # Wrap all cells first
-        wrapped_cells = [wrap_to_lines(txt, w, font) for txt, w in zip(text_values, widths)]
+    extra = (available - total) / len(widths)
+    return [w + extra for w in widths]
 
-        # Determine how many lines this row needs (min 1), cap at MAX_LINES
-        line_counts = [max(1, min(len(lines), MAX_LINES)) for lines in wrapped_cells]
-        max_lines_in_row = max(line_counts) if line_counts else 1
-        row_height = min(max_lines_in_row * LINE_HEIGHT, MAX_ROW_HEIGHT)
 
-        # Page break check WITH this dynamic row height
-        if y_start + row_height + BOTTOM > PAGE_H:
-            pdf.add_page()
-            pdf.set_y(TOP)
-            # redraw header on new page
-            draw_row(column_names, widths, HEADER_FONT, fill=True)
-            y_start = pdf.get_y()
-            pdf.set_font(*font)
-
-            # recompute wrapped because font might have changed, but we can reuse
-            wrapped_cells[:] = [wrap_to_lines(txt, w, font) for txt, w in zip(text_values, widths)]
-            line_counts[:] = [max(1, min(len(lines), MAX_LINES)) for lines in wrapped_cells]
-            max_lines_in_row = max(line_counts) if line_counts else 1
-            row_height = min(max_lines_in_row * LINE_HEIGHT, MAX_ROW_HEIGHT)
-
-        # Draw each cell manually
-        x = LEFT
-        for lines, w in zip(wrapped_cells, widths):
-            pdf.set_xy(x, y_start)
-            pdf.rect(x, y_start, w, row_height)  # border rect
-
-            # Draw lines of text inside the cell
-            TEXT_PADDING = 1.5  # mm
-            for idx, line in enumerate(lines[:MAX_LINES]):
-                y_line = y_start + idx * LINE_HEIGHT
-                if y_line + LINE_HEIGHT > y_start + row_height:
-                    break
-                pdf.set_xy(x + TEXT_PADDING, y_line)
-                pdf.cell(w - 2 * TEXT_PADDING, LINE_HEIGHT, line, border=0)
+def serialize_query_result_to_pdf(query_result, max_rows=None):
+    """Renders the first `max_rows` rows (settings.PDF_EXPORT_MAX_ROWS by default, 0 for all of
+    them) of the query result as a PDF table, repeating the header on every page."""
+    if max_rows is None:
+        max_rows = settings.PDF_EXPORT_MAX_ROWS
 
-            x += w
+    payload = query_result.payload
+    columns = (payload.columns if payload is not None else None) or []
+    column_names = [c["name"] for c in columns[:PDF_MAX_COLUMNS]]
+
+    pdf = FPDF("L")
+    if not column_names:
+        return pdf.output(dest="S").encode("latin1")
 
-        pdf.set_y(y_start + row_height)
+    pdf.add_page()
+    pdf.set_left_margin(PDF_MARGIN_X)
+    pdf.set_right_margin(PDF_MARGIN_X)
+    pdf.set_y(PDF_MARGIN_Y)
+    pdf.set_auto_page_break(auto=False)
 
-    # compute final column widths
-    col_widths = compute_widths()
+    header_metrics = _PdfFontMetrics(pdf, PDF_HEADER_FONT)
+    data_metrics = _PdfFontMetrics(pdf, PDF_DATA_FONT)
+
+    stop = max_rows or None
+    rows = payload.iter_rows(columns=column_names, stop=stop)
+    sample = list(itertools.islice(rows, 10))
+    col_widths = _pdf_column_widths(column_names, sample)
+    text_widths = [w - 2 * PDF_CELL_PADDING - 0.5 for w in col_widths]
+    current_metrics = None
+
+    def layout(values, metrics):
+        cells = [metrics.wrap(_pdf_text(v), w) for v, w in zip(values, text_widths)]
+        return cells, max(len(lines) for lines in cells) * PDF_LINE_HEIGHT
+
+    def draw(cells, height, metrics):
+        nonlocal current_metrics
+        if current_metrics is not metrics:
+            pdf.set_font(*metrics.font)
+            current_metrics = metrics
+
+        y = pdf.get_y()
+        x = PDF_MARGIN_X
+        for lines, w in zip(cells, col_widths):
+            pdf.rect(x, y, w, height)
+            for i, line in enumerate(lines):
+                if line:
+                    pdf.set_xy(x + PDF_CELL_PADDING, y + i * PDF_LINE_HEIGHT)
+                    pdf.cell(w - 2 * PDF_CELL_PADDING, PDF_LINE_HEIGHT, line, border=0)
+            x += w
+        pdf.set_y(y + height)
 
-    # draw header
-    draw_row(column_names, col_widths, HEADER_FONT, fill=True)
+    # The header is laid out once and redrawn as is on every page.
+    header, header_height = layout(column_names, header_metrics)
+    draw(header, header_height, header_metrics)
 
-    # draw rows
-    for r in rows:
-        vals = [r.get(c, "") for c in column_names]
-        draw_row(vals, col_widths, DATA_FONT)
+    row_count = 0
+    for row in itertools.chain(sample, rows):
+        cells, height = layout([row.get(name) for name in column_names], data_metrics)
+        if pdf.get_y() + height + PDF_MARGIN_Y > PDF_PAGE_H:
+            pdf.add_page()
+            pdf.set_y(PDF_MARGIN_Y)
+            draw(header, header_height, header_metrics)
+        draw(cells, height, data_metrics)
+        row_count += 1
+
+    total_rows = payload.row_count
+    if row_count < total_rows:
+        if pdf.get_y() + PDF_LINE_HEIGHT + PDF_MARGIN_Y > PDF_PAGE_H:
+            pdf.add_page()
+            pdf.set_y(PDF_MARGIN_Y)
+        pdf.set_font(*PDF_DATA_FONT)
+        pdf.set_x(PDF_MARGIN_X)
+        pdf.cell(0, PDF_LINE_HEIGHT, "Showing the first {} of {} rows.".format(row_count, total_rows), border=0)
 
     return pdf.output(dest="S").encode("latin1")
@@ -40,6 +40,9 @@ SQLALCHEMY_ECHO = False
 
 RQ_REDIS_URL = os.environ.get("RQ_REDIS_URL", _REDIS_URL)
 
+# JSON codec behind redash.utils.json_dumps/json_loads: "orjson" (used when installed) or "json" (the stdlib).
+JSON_CODEC = os.environ.get("REDASH_JSON_CODEC", "orjson")
+
 # The following enables periodic job (every 5 minutes) of removing unused query results.
 QUERY_RESULTS_CLEANUP_ENABLED = parse_boolean(os.environ.get("REDASH_QUERY_RESULTS_CLEANUP_ENABLED", "true"))
 QUERY_RESULTS_CLEANUP_COUNT = int(os.environ.get("REDASH_QUERY_RESULTS_CLEANUP_COUNT", "100"))
@@ -49,6 +52,40 @@ QUERY_RESULTS_EXPIRED_TTL_ENABLED = parse_boolean(os.environ.get("REDASH_QUERY_R
 # default set query results expired ttl 86400 seconds
 QUERY_RESULTS_EXPIRED_TTL = int(os.environ.get("REDASH_QUERY_RESULTS_EXPIRED_TTL", "86400"))
 
+# How query result payloads are stored: "columnar" (compressed per column and row group, so readers can decode
+# only what they need) or "json" (the legacy single JSON document). Results stored in either format stay readable.
+QUERY_RESULTS_STORAGE_FORMAT = os.environ.get("REDASH_QUERY_RESULTS_STORAGE_FORMAT", "columnar")
+QUERY_RESULTS_ROW_GROUP_SIZE = int(os.environ.get("REDASH_QUERY_RESULTS_ROW_GROUP_SIZE", "10000"))
+QUERY_RESULTS_COMPRESSION_LEVEL = int(os.environ.get("REDASH_QUERY_RESULTS_COMPRESSION_LEVEL", "6"))
+# Runners that support it stream their results into storage in batches of this many rows, instead of
+# loading the whole result set into memory first.
+QUERY_RESULTS_STREAMING_ENABLED = parse_boolean(os.environ.get("REDASH_QUERY_RESULTS_STREAMING_ENABLED", "true"))
+QUERY_RESULTS_STREAM_BATCH_SIZE = int(os.environ.get("REDASH_QUERY_RESULTS_STREAM_BATCH_SIZE", "10000"))
+# Query results are cut short (and marked as truncated) past this many rows or (roughly) bytes; 0 means no limit.
+# Data sources can override them with their `result_max_rows` and `result_max_bytes` options.
+QUERY_RESULTS_MAX_ROWS = int(os.environ.get("REDASH_QUERY_RESULTS_MAX_ROWS", "0"))
+QUERY_RESULTS_MAX_BYTES = int(os.environ.get("REDASH_QUERY_RESULTS_MAX_BYTES", str(256 * 1024 * 1024)))
+# Query results read by id are kept in a least-recently-used cache in Redis (QUERY_RESULTS_CACHE_REDIS_URL) of up to
+# QUERY_RESULTS_CACHE_SIZE megabytes (0 disables it). Results larger than QUERY_RESULTS_CACHE_MAX_ENTRY_SIZE kilobytes
+# are never cached.
+QUERY_RESULTS_CACHE_SIZE = int(os.environ.get("REDASH_QUERY_RESULTS_CACHE_SIZE", "0"))
+QUERY_RESULTS_CACHE_MAX_ENTRY_SIZE = int(os.environ.get("REDASH_QUERY_RESULTS_CACHE_MAX_ENTRY_SIZE", "1024"))
+QUERY_RESULTS_CACHE_REDIS_URL = os.environ.get("REDASH_QUERY_RESULTS_CACHE_REDIS_URL", _REDIS_URL)
+
+# PDF exports only include this many rows (0 means all of them).
+PDF_EXPORT_MAX_ROWS = int(os.environ.get("REDASH_PDF_EXPORT_MAX_ROWS", "10000"))
+
+# Downloads are rendered by background jobs into EXPORTS_STORAGE, where they are kept for EXPORTS_TTL seconds:
+# "local" (EXPORTS_PATH, a directory that has to be shared by the web and worker processes) or "s3" (a bucket of
+# S3 or of any S3-compatible store; downloads are redirected to it, so it has to allow Redash's origin).
+EXPORTS_STORAGE = os.environ.get("REDASH_EXPORTS_STORAGE", "local")
+EXPORTS_PATH = os.environ.get("REDASH_EXPORTS_PATH", "/tmp/redash-exports")
+EXPORTS_S3_BUCKET = os.environ.get("REDASH_EXPORTS_S3_BUCKET", "")
+EXPORTS_S3_PREFIX = os.environ.get("REDASH_EXPORTS_S3_PREFIX", "exports/")
+EXPORTS_S3_ENDPOINT_URL = os.environ.get("REDASH_EXPORTS_S3_ENDPOINT_URL") or None
+EXPORTS_TTL = int(os.environ.get("REDASH_EXPORTS_TTL", "3600"))
+EXPORTS_TIMEOUT = int(os.environ.get("REDASH_EXPORTS_TIMEOUT", "600"))
+
 SCHEMAS_REFRESH_SCHEDULE = int(os.environ.get("REDASH_SCHEMAS_REFRESH_SCHEDULE", 30))
 SCHEMAS_REFRESH_TIMEOUT = int(os.environ.get("REDASH_SCHEMAS_REFRESH_TIMEOUT", 300))
 
@@ -218,6 +255,42 @@ ADHOC_QUERY_TIME_LIMIT = int(os.environ.get("REDASH_ADHOC_QUERY_TIME_LIMIT", -1)
 JOB_EXPIRY_TIME = int(os.environ.get("REDASH_JOB_EXPIRY_TIME", 3600 * 12))
 JOB_DEFAULT_FAILURE_TTL = int(os.environ.get("REDASH_JOB_DEFAULT_FAILURE_TTL", 7 * 24 * 60 * 60))
 
+# Clients can wait for job updates instead of polling them (see JobResource and JobEventsResource). A request waits
+# for up to JOB_EVENTS_TIMEOUT seconds, and watches at most JOB_EVENTS_MAX_JOBS jobs. Each waiting request holds a
+# web worker, so prefer asynchronous (e.g. gevent) gunicorn workers when many clients wait.
+JOB_EVENTS_TIMEOUT = int(os.environ.get("REDASH_JOB_EVENTS_TIMEOUT", 30))
+JOB_EVENTS_MAX_JOBS = int(os.environ.get("REDASH_JOB_EVENTS_MAX_JOBS", 100))
+
+# Workers pick the next job fairly across data sources (and within their limits) among the first
+# QUEUE_FAIR_DEQUEUE_WINDOW jobs of a queue. When those are all held back by their limits, they
+# check again every QUEUE_LIMITS_POLL_INTERVAL seconds.
+QUEUE_FAIR_DEQUEUE_WINDOW = int(os.environ.get("REDASH_QUEUE_FAIR_DEQUEUE_WINDOW", 100))
+QUEUE_LIMITS_POLL_INTERVAL = float(os.environ.get("REDASH_QUEUE_LIMITS_POLL_INTERVAL", 0.5))
+
+# With WORKER_PERSISTENT_HORSES, each worker runs its jobs in a long-lived work horse instead of forking one per
+# job. The horse is replaced after WORKER_HORSE_MAX_JOBS jobs, or once its memory use reaches WORKER_HORSE_MAX_MEMORY
+# megabytes.
+WORKER_PERSISTENT_HORSES = parse_boolean(os.environ.get("REDASH_WORKER_PERSISTENT_HORSES", "false"))
+WORKER_HORSE_MAX_JOBS = int(os.environ.get("REDASH_WORKER_HORSE_MAX_JOBS", 500))
+WORKER_HORSE_MAX_MEMORY = int(os.environ.get("REDASH_WORKER_HORSE_MAX_MEMORY", 1024))
+
+# Query runners that pool their connections keep up to DATA_SOURCE_POOL_SIZE idle connections to each data source, for
+# up to DATA_SOURCE_POOL_IDLE_TIMEOUT seconds. Only persistent work horses reuse them: a horse that runs a single job
+# doesn't, so it's off (0) by default without WORKER_PERSISTENT_HORSES.
+DATA_SOURCE_POOL_SIZE = int(os.environ.get("REDASH_DATA_SOURCE_POOL_SIZE", 2 if WORKER_PERSISTENT_HORSES else 0))
+DATA_SOURCE_POOL_IDLE_TIMEOUT = int(os.environ.get("REDASH_DATA_SOURCE_POOL_IDLE_TIMEOUT", 300))
+
+# The Query Results data source keeps up to QUERY_RESULTS_RUNNER_CACHE_TABLES of the results its queries loaded as
+# cached_query_N tables (of up to QUERY_RESULTS_RUNNER_CACHE_MAX_ROWS rows each), for the next queries the same work
+# horse runs. Like the connection pools, it's off (0) by default without WORKER_PERSISTENT_HORSES.
+QUERY_RESULTS_RUNNER_CACHE_TABLES = int(
+    os.environ.get("REDASH_QUERY_RESULTS_RUNNER_CACHE_TABLES", 4 if WORKER_PERSISTENT_HORSES else 0)
+)
+QUERY_RESULTS_RUNNER_CACHE_MAX_ROWS = int(os.environ.get("REDASH_QUERY_RESULTS_RUNNER_CACHE_MAX_ROWS", 500000))
+# It runs up to QUERY_RESULTS_RUNNER_MAX_PARALLEL_FETCHES of the queries its queries reference (query_N tables) at the
+# same time, each in a thread of the work horse. 1 runs them one after another.
+QUERY_RESULTS_RUNNER_MAX_PARALLEL_FETCHES = int(os.environ.get("REDASH_QUERY_RESULTS_RUNNER_MAX_PARALLEL_FETCHES", 4))
+
 LOG_LEVEL = os.environ.get("REDASH_LOG_LEVEL", "INFO")
 LOG_STDOUT = parse_boolean(os.environ.get("REDASH_LOG_STDOUT", "false"))
 LOG_PREFIX = os.environ.get("REDASH_LOG_PREFIX", "")
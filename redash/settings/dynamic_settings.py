@@ -11,6 +11,14 @@ def query_time_limit(is_scheduled, user_id, org_id):
         return settings.ADHOC_QUERY_TIME_LIMIT
 
 
+# Replace this method with your own implementation in case you want to change which query executions workers pick first.
+# priority_class is one of "interactive" (runs from the editor and dashboards), "api" (runs through API keys), "download"
+# or "scheduled". Workers take the waiting job with the lowest priority first.
+def query_priority(priority_class, user_id, org_id):
+    priorities = {"interactive": 0, "api": 1, "download": 2, "scheduled": 3}
+    return priorities.get(priority_class, 1)
+
+
 def periodic_jobs():
     """Schedule any custom periodic jobs here. For example:
 
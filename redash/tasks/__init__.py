@@ -2,6 +2,7 @@ from rq.connections import pop_connection, push_connection
 
 from redash import rq_redis_connection
 from redash.tasks.alerts import check_alerts_for_query
+from redash.tasks.exports import cleanup_exports, enqueue_export, render_export
 from redash.tasks.failure_report import send_aggregated_errors
 from redash.tasks.general import (
     record_event,
@@ -23,7 +24,7 @@ from redash.tasks.schedule import (
     rq_scheduler,
     schedule_periodic_jobs,
 )
-from redash.tasks.worker import Job, Queue, Worker
+from redash.tasks.worker import Job, Queue, Worker, wait_for_job, watch_jobs
 
 
 def init_app(app):
@@ -0,0 +1,117 @@
+import os
+import tempfile
+
+from rq import get_current_job
+from rq.exceptions import NoSuchJobError
+from rq.job import Dependency, JobStatus
+
+from redash import models, rq_redis_connection, settings
+from redash.tasks.worker import Queue
+from redash.utils.export_storage import get_export_storage
+from redash.worker import get_job_logger
+
+logger = get_job_logger(__name__)
+
+EXPORT_CONTENT_TYPES = {
+    "csv": "text/csv; charset=UTF-8",
+    "tsv": "text/tab-separated-values; charset=UTF-8",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "pdf": "application/pdf",
+}
+
+
+def enqueue_export(filetype, data_source, query_result=None, query_job=None, query_id=None):
+    """Enqueues rendering `query_result` as a `filetype` file or, when `query_job` (an
+    execute_query job) is given instead, the result it produces once it's done. The file is
+    then kept in the export storage, under the job's ID, for settings.EXPORTS_TTL seconds."""
+    query_result_id = query_result.id if query_result is not None else None
+    enqueue_kwargs = {
+        "job_timeout": settings.EXPORTS_TIMEOUT,
+        "result_ttl": settings.EXPORTS_TTL,
+        "failure_ttl": settings.JOB_DEFAULT_FAILURE_TTL,
+        "meta": {
+            "org_id": data_source.org_id,
+            "data_source_id": data_source.id,
+            "query_id": query_id,
+            "query_result_id": query_result_id,
+            "filetype": filetype,
+        },
+    }
+    if query_job is not None:
+        # Queries that fail still finish (with the error as their result), but those that are
+        # killed don't: let their exports run anyway, to report it.
+        enqueue_kwargs["depends_on"] = Dependency(jobs=[query_job], allow_failure=True)
+
+    queue = Queue("default", connection=rq_redis_connection)
+    return queue.enqueue(render_export, filetype, query_result_id, **enqueue_kwargs)
+
+
+def _query_job_result(export_job):
+    try:
+        query_job = export_job.dependency
+    except NoSuchJobError:
+        query_job = None
+
+    if query_job is None:
+        return {"error": "The query job has expired."}
+    if query_job.is_cancelled:
+        return {"error": "Query execution was cancelled."}
+
+    result = query_job.result
+    if isinstance(result, Exception):
+        return {"error": str(result)}
+    if query_job.get_status() != JobStatus.FINISHED or not result:
+        return {"error": "Query execution failed."}
+
+    return result
+
+
+def _render(filetype, query_result, output):
+    # Imported here: redash.serializers depends on redash.authentication, which imports redash.tasks.
+    from redash.serializers import (
+        serialize_query_result_to_pdf,
+        stream_query_result_to_dsv,
+        write_query_result_to_xlsx,
+    )
+
+    if filetype == "xlsx":
+        write_query_result_to_xlsx(query_result, output)
+    elif filetype == "pdf":
+        output.write(serialize_query_result_to_pdf(query_result))
+    else:
+        delimiter = "\t" if filetype == "tsv" else ","
+        for chunk in stream_query_result_to_dsv(query_result, delimiter, org=query_result.org):
+            output.write(chunk.encode("utf-8"))
+
+
+def render_export(filetype, query_result_id=None):
+    current_job = get_current_job()
+
+    if query_result_id is None:
+        query_result_id = _query_job_result(current_job)
+        if isinstance(query_result_id, dict):
+            return query_result_id
+
+        current_job.meta["query_result_id"] = query_result_id
+        current_job.save_meta()
+
+    query_result = models.QueryResult.query.get(query_result_id)
+    logger.info("Rendering query result %s as %s", query_result_id, filetype)
+
+    fd, filename = tempfile.mkstemp(suffix="." + filetype)
+    try:
+        with os.fdopen(fd, "wb") as output:
+            _render(filetype, query_result, output)
+        size = os.path.getsize(filename)
+        get_export_storage().save(current_job.id, filename)
+    except Exception:
+        if os.path.exists(filename):
+            os.remove(filename)
+        raise
+
+    logger.info("Rendered query result %s as %s (%d bytes)", query_result_id, filetype, size)
+
+
+def cleanup_exports():
+    removed = get_export_storage().cleanup(settings.EXPORTS_TTL)
+    logger.info("Removed %d expired exports", removed)
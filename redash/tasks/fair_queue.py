@@ -0,0 +1,317 @@
+"""
+Fair queueing of query jobs, on top of RQ's queues.
+
+Query jobs carry their data source and org in their meta, along with the data source's
+execution limits (see `DataSource.execution_limits`):
+
+* max_concurrent -- how many of its jobs may run at once (0 for no limit).
+* rate -- how many of its jobs may start per minute (0 for no limit). It's enforced with a
+  token bucket, which allows bursts of up to a tenth of that.
+* weight -- its share of the workers when several data sources have jobs waiting.
+
+Query jobs also carry their priority (see `dynamic_settings.query_priority`): each queue keeps
+an index of its jobs by priority, then by when they were enqueued.
+
+Instead of always taking the job at the head of a queue, workers look at its first
+QUEUE_FAIR_DEQUEUE_WINDOW jobs and at the first QUEUE_FAIR_DEQUEUE_WINDOW ones of its priority
+index, so that urgent jobs get noticed behind a backlog of others. Among those whose limits let
+them start, they take the one with the lowest priority, then whose org, then data source, has
+the fewest jobs running for its weight. Jobs that don't belong to a data source are taken in
+order.
+
+Starting a job takes one of its data source's slots, atomically with removing it from the
+queue. The worker frees the slot when the job is done. If the worker dies first, the slot is
+freed once the job's time limit has passed.
+"""
+import math
+import time
+
+from rq import Queue as BaseQueue
+from rq.exceptions import DequeueTimeout, NoSuchJobError
+from rq.serializers import resolve_serializer
+from rq.utils import as_text, utcnow
+
+from redash import settings, statsd_client
+
+# KEYS: queue, data source slots, org slots, data source token bucket, queue priority index
+# ARGV: job ID, now, max concurrent, rate (per second), bucket capacity, slot expiry,
+#       "1" if the job was already popped from the queue
+ADMIT_SCRIPT = """
+local now = tonumber(ARGV[2])
+local max_concurrent = tonumber(ARGV[3])
+local rate = tonumber(ARGV[4])
+local capacity = tonumber(ARGV[5])
+
+redis.call("ZREMRANGEBYSCORE", KEYS[2], "-inf", now)
+redis.call("ZREMRANGEBYSCORE", KEYS[3], "-inf", now)
+if max_concurrent > 0 and redis.call("ZCARD", KEYS[2]) >= max_concurrent then
+    return -1
+end
+
+local tokens = 0
+if rate > 0 then
+    local bucket = redis.call("HMGET", KEYS[4], "tokens", "at")
+    local at = tonumber(bucket[2]) or now
+    tokens = math.min(capacity, (tonumber(bucket[1]) or capacity) + math.max(0, now - at) * rate)
+    if tokens < 1 then
+        return -2
+    end
+end
+
+local taken = ARGV[7] == "1" or redis.call("LREM", KEYS[1], 1, ARGV[1]) == 1
+redis.call("ZREM", KEYS[5], ARGV[1])
+if not taken then
+    return 0
+end
+
+if rate > 0 then
+    redis.call("HSET", KEYS[4], "tokens", tostring(tokens - 1), "at", ARGV[2])
+    redis.call("EXPIRE", KEYS[4], math.ceil(capacity / rate) + 60)
+end
+redis.call("ZADD", KEYS[2], ARGV[6], ARGV[1])
+redis.call("ZADD", KEYS[3], ARGV[6], ARGV[1])
+return 1
+"""
+
+# How long a slot outlives its job's time limit, in case the worker dies.
+SLOT_GRACE_PERIOD = 60
+
+# Scores in the priority index: priority * PRIORITY_SPAN + the time the job was enqueued at.
+PRIORITY_SPAN = 10**10
+
+
+def _slots_key(kind, object_id):
+    return "fair_queue:{}:{}:slots".format(kind, object_id)
+
+
+def _bucket_key(data_source_id):
+    return "fair_queue:ds:{}:bucket".format(data_source_id)
+
+
+def _priorities_key(queue_name):
+    return "fair_queue:queue:{}:priorities".format(queue_name)
+
+
+class _Candidate:
+    def __init__(self, job_id, position, meta, timeout):
+        self.job_id = job_id
+        self.position = position
+        self.data_source_id = meta.get("data_source_id")
+        self.org_id = meta.get("org_id")
+        self.priority = meta.get("priority") or 0
+        limits = meta.get("limits") or {}
+        self.max_concurrent = int(limits.get("max_concurrent") or 0)
+        self.rate = float(limits.get("rate") or 0) / 60
+        self.weight = float(limits.get("weight") or 1)
+        self.timeout = int(timeout) if timeout else -1
+
+    @property
+    def slot_expires_at(self):
+        time_limit = self.timeout if self.timeout > 0 else settings.JOB_EXPIRY_TIME
+        return time.time() + time_limit + SLOT_GRACE_PERIOD
+
+    def admit(self, queue, popped=False):
+        script = queue.connection.register_script(ADMIT_SCRIPT)
+        capacity = max(1.0, self.rate * 6)
+        return script(
+            keys=[
+                queue.key,
+                _slots_key("ds", self.data_source_id),
+                _slots_key("org", self.org_id),
+                _bucket_key(self.data_source_id),
+                _priorities_key(queue.name),
+            ],
+            args=[
+                self.job_id,
+                time.time(),
+                self.max_concurrent,
+                self.rate,
+                capacity,
+                self.slot_expires_at,
+                "1" if popped else "0",
+            ],
+        )
+
+
+def _free_slot(connection, job_id, data_source_id, org_id):
+    with connection.pipeline() as pipe:
+        pipe.zrem(_slots_key("ds", data_source_id), job_id)
+        pipe.zrem(_slots_key("org", org_id), job_id)
+        pipe.execute()
+
+
+def release(job, connection):
+    """Frees the slot `job` took when it started, if any."""
+    if job.meta.get("data_source_id") is not None:
+        _free_slot(connection, job.id, job.meta["data_source_id"], job.meta.get("org_id"))
+
+
+class FairQueue(BaseQueue):
+    """RQ Queue Mixin that overrides `dequeue_any` to dequeue jobs fairly and within their
+    data source's limits."""
+
+    @property
+    def priorities_key(self):
+        return _priorities_key(self.name)
+
+    def _enqueue_job(self, job, pipeline=None, at_front=False):
+        priority = job.meta.get("priority")
+        if priority is None or not self._is_async:
+            return super()._enqueue_job(job, pipeline=pipeline, at_front=at_front)
+
+        pipe = pipeline if pipeline is not None else self.connection.pipeline()
+        job = super()._enqueue_job(job, pipeline=pipe, at_front=at_front)
+        enqueued_at = 0 if at_front else time.time()
+        pipe.zadd(self.priorities_key, {job.id: priority * PRIORITY_SPAN + enqueued_at})
+        if pipeline is None:
+            pipe.execute()
+
+        return job
+
+    def empty(self):
+        self.connection.delete(self.priorities_key)
+        return super().empty()
+
+    def _candidates(self, serializer):
+        window = settings.QUEUE_FAIR_DEQUEUE_WINDOW
+        with self.connection.pipeline() as pipe:
+            pipe.lrange(self.key, 0, window - 1)
+            pipe.zrange(self.priorities_key, 0, window - 1)
+            head, urgent = pipe.execute()
+
+        # Jobs at the head of the queue keep their position; urgent ones behind them come after.
+        job_ids = list(dict.fromkeys(as_text(job_id) for job_id in head + urgent))
+        with self.connection.pipeline() as pipe:
+            for job_id in job_ids:
+                pipe.hmget(self.job_class.key_for(job_id), "meta", "timeout")
+            fields = pipe.execute()
+
+        candidates = []
+        for position, (job_id, (meta, timeout)) in enumerate(zip(job_ids, fields)):
+            meta = serializer.loads(meta) if meta else {}
+            candidates.append(_Candidate(job_id, position, meta, timeout and as_text(timeout)))
+
+        return candidates
+
+    def _running_counts(self, candidates):
+        keys = {_slots_key("ds", c.data_source_id) for c in candidates if c.data_source_id is not None}
+        keys |= {_slots_key("org", c.org_id) for c in candidates if c.data_source_id is not None}
+        keys = list(keys)
+
+        now = time.time()
+        with self.connection.pipeline() as pipe:
+            for key in keys:
+                pipe.zcount(key, now, "+inf")
+            return dict(zip(keys, pipe.execute()))
+
+    def _fair_order(self, candidates):
+        running = self._running_counts(candidates)
+
+        def share(candidate):
+            if candidate.data_source_id is None:
+                return (candidate.priority, 0, 0, candidate.position)
+
+            return (
+                candidate.priority,
+                running[_slots_key("org", candidate.org_id)],
+                running[_slots_key("ds", candidate.data_source_id)] / candidate.weight,
+                candidate.position,
+            )
+
+        return sorted(candidates, key=share)
+
+    def _fetch_admitted(self, candidate, serializer):
+        try:
+            job = self.job_class.fetch(candidate.job_id, connection=self.connection, serializer=serializer)
+        except NoSuchJobError:
+            # Deleted in the meantime (e.g. cancelled): skip it, like RQ does.
+            if candidate.data_source_id is not None:
+                _free_slot(self.connection, candidate.job_id, candidate.data_source_id, candidate.org_id)
+            return None
+
+        if candidate.data_source_id is not None and job.enqueued_at:
+            statsd_client.timing("rq.jobs.wait.{}".format(candidate.data_source_id), utcnow() - job.enqueued_at)
+
+        return job
+
+    def _hold_back(self, candidate):
+        statsd_client.incr("rq.jobs.throttled.{}".format(candidate.data_source_id))
+
+    def dequeue_fairly(self, serializer):
+        """Returns the job to run next from this queue, and whether there were jobs held back by
+        their limits."""
+        held_back = set()
+        for candidate in self._fair_order(self._candidates(serializer)):
+            if candidate.data_source_id is None:
+                with self.connection.pipeline() as pipe:
+                    pipe.lrem(self.key, 1, candidate.job_id)
+                    pipe.zrem(self.priorities_key, candidate.job_id)
+                    admitted = pipe.execute()[0]
+            elif candidate.data_source_id in held_back:
+                continue
+            else:
+                admitted = candidate.admit(self)
+                if admitted < 0:
+                    self._hold_back(candidate)
+                    held_back.add(candidate.data_source_id)
+                    continue
+
+            if admitted:
+                job = self._fetch_admitted(candidate, serializer)
+                if job is not None:
+                    return job, bool(held_back)
+
+        return None, bool(held_back)
+
+    def admit_popped(self, job_id, serializer):
+        """Admits the job popped from this queue, or puts it back at its head if its limits
+        don't let it start."""
+        meta, timeout = self.connection.hmget(self.job_class.key_for(job_id), "meta", "timeout")
+        if meta is None:
+            return None
+
+        candidate = _Candidate(job_id, 0, serializer.loads(meta), timeout and as_text(timeout))
+        if candidate.data_source_id is not None and candidate.admit(self, popped=True) < 0:
+            self._hold_back(candidate)
+            self.push_job_id(job_id, at_front=True)
+            return None
+
+        return self._fetch_admitted(candidate, serializer)
+
+    @classmethod
+    def dequeue_any(cls, queues, timeout, connection=None, job_class=None, serializer=None, death_penalty_class=None):
+        serializer = resolve_serializer(serializer)
+        started_at = time.monotonic()
+
+        while True:
+            held_back = False
+            for queue in queues:
+                job, queue_held_back = queue.dequeue_fairly(serializer)
+                if job is not None:
+                    return job, queue
+                held_back = held_back or queue_held_back
+
+            remaining = None if timeout is None else timeout - (time.monotonic() - started_at)
+            if remaining is not None and remaining <= 0:
+                raise DequeueTimeout(timeout, [queue.key for queue in queues])
+
+            if held_back:
+                # Only jobs that their limits hold back: check again once some slots may be free.
+                if timeout is None:
+                    return None
+                time.sleep(min(settings.QUEUE_LIMITS_POLL_INTERVAL, remaining))
+                continue
+
+            # Every queue is empty: wait for a job like RQ does.
+            queue_keys = [queue.key for queue in queues]
+            result = cls.lpop(
+                queue_keys, None if timeout is None else max(1, math.ceil(remaining)), connection=connection
+            )
+            if result is None:
+                return None
+
+            queue_key, job_id = map(as_text, result)
+            queue = queues[queue_keys.index(queue_key)]
+            job = queue.admit_popped(job_id, serializer)
+            if job is not None:
+                return job, queue
@@ -1,7 +1,7 @@
 import signal
-import sys
 import time
-from collections import deque
+from collections import defaultdict
+from uuid import uuid4
 
 import redis
 from rq import get_current_job
@@ -9,12 +9,19 @@ from rq.exceptions import NoSuchJobError
 from rq.job import JobStatus
 from rq.timeouts import JobTimeoutException
 
-from redash import models, redis_connection, settings
-from redash.query_runner import InterruptException
+from redash import (
+    models,
+    redis_connection,
+    rq_redis_connection,
+    settings,
+    statsd_client,
+)
+from redash.query_runner import InterruptException, QueryRunnerError
 from redash.tasks.alerts import check_alerts_for_query
 from redash.tasks.failure_report import track_failure
-from redash.tasks.worker import Job, Queue
+from redash.tasks.worker import Job, Queue, notify_job_progress
 from redash.utils import gen_query_hash, utcnow
+from redash.utils.result_storage import ResultPayload, result_writer
 from redash.worker import get_job_logger
 
 logger = get_job_logger(__name__)
@@ -29,7 +36,22 @@ def _unlock(query_hash, data_source_id):
     redis_connection.delete(_job_lock_id(query_hash, data_source_id))
 
 
-def enqueue_query(query, data_source, user_id, is_api_key=False, scheduled_query=None, metadata={}):
+def _query_priority(priority_class, user_id, org_id):
+    return {
+        "priority_class": priority_class,
+        "priority": settings.dynamic_settings.query_priority(priority_class, user_id, org_id),
+    }
+
+
+def enqueue_query(
+    query, data_source, user_id, is_api_key=False, scheduled_query=None, metadata={}, priority_class=None
+):
+    if priority_class is None:
+        if scheduled_query:
+            priority_class = "scheduled"
+        else:
+            priority_class = "api" if is_api_key else "interactive"
+
     query_hash = gen_query_hash(query)
     logger.info("Inserting job for %s with metadata=%s", query_hash, metadata)
     try_count = 0
@@ -92,9 +114,11 @@ def enqueue_query(query, data_source, user_id, is_api_key=False, scheduled_query
                     "meta": {
                         "data_source_id": data_source.id,
                         "org_id": data_source.org_id,
+                        "limits": data_source.execution_limits,
                         "scheduled": scheduled_query_id is not None,
                         "query_id": metadata.get("query_id"),
                         "user_id": user_id,
+                        **_query_priority(priority_class, user_id, data_source.org_id),
                     },
                 }
 
@@ -123,6 +147,90 @@ def enqueue_query(query, data_source, user_id, is_api_key=False, scheduled_query
     return job
 
 
+def enqueue_scheduled_queries(queries):
+    """
+    Bulk version of enqueue_query, for the scheduler: `queries` is a list of (query_text, scheduled_query,
+    metadata) tuples. It takes the same few round trips to Redis however many queries there are.
+
+    Returns the job of each query: the one already running it, the one created for it, or None if
+    another process took its lock in the meantime.
+    """
+    lock_ids = [_job_lock_id(gen_query_hash(query_text), query.data_source_id) for query_text, query, _ in queries]
+    locked_job_ids = redis_connection.mget(lock_ids)
+
+    existing_job_ids = list({job_id for job_id in locked_job_ids if job_id})
+    existing_jobs = dict(zip(existing_job_ids, Job.fetch_many(existing_job_ids, connection=rq_redis_connection)))
+
+    jobs = [None] * len(queries)
+    lock_owners = {}
+    stale_lock_ids = []
+    for i, (lock_id, job_id) in enumerate(zip(lock_ids, locked_job_ids)):
+        job = existing_jobs.get(job_id)
+        if job is not None and job.get_status(refresh=False) not in (JobStatus.FINISHED, JobStatus.FAILED):
+            if not job.is_cancelled:
+                jobs[i] = job
+                continue
+
+        if job_id and lock_id not in lock_owners:
+            logger.info("[%s] Found job %s is complete, cancelled or expired, removing lock", lock_id, job_id)
+            stale_lock_ids.append(lock_id)
+        lock_owners.setdefault(lock_id, i)
+
+    new_job_ids = {lock_id: str(uuid4()) for lock_id in lock_owners}
+    pipe = redis_connection.pipeline(transaction=False)
+    for lock_id in stale_lock_ids:
+        pipe.delete(lock_id)
+    for lock_id, job_id in new_job_ids.items():
+        pipe.set(lock_id, job_id, ex=settings.JOB_EXPIRY_TIME, nx=True)
+    acquired = pipe.execute()[len(stale_lock_ids) :]
+
+    job_datas = defaultdict(list)
+    for (lock_id, i), is_acquired in zip(lock_owners.items(), acquired):
+        if not is_acquired:
+            logger.info("[%s] Another job took the lock, skipping", lock_id)
+            continue
+
+        query_text, query, metadata = queries[i]
+        data_source = query.data_source
+        metadata["Queue"] = data_source.scheduled_queue_name
+        job_data = Queue.prepare_data(
+            execute_query,
+            args=(query_text, data_source.id, metadata),
+            kwargs={"user_id": query.user_id, "scheduled_query_id": query.id, "is_api_key": False},
+            timeout=settings.dynamic_settings.query_time_limit(query, query.user_id, data_source.org_id),
+            failure_ttl=settings.JOB_DEFAULT_FAILURE_TTL,
+            job_id=new_job_ids[lock_id],
+            meta={
+                "data_source_id": data_source.id,
+                "org_id": data_source.org_id,
+                "limits": data_source.execution_limits,
+                "scheduled": True,
+                "query_id": metadata.get("query_id"),
+                "user_id": query.user_id,
+                **_query_priority("scheduled", query.user_id, data_source.org_id),
+            },
+        )
+        job_datas[data_source.scheduled_queue_name].append((i, job_data))
+
+    with rq_redis_connection.pipeline() as pipe:
+        for queue_name, items in job_datas.items():
+            queue = Queue(queue_name, connection=rq_redis_connection)
+            created = queue.enqueue_many([job_data for _, job_data in items], pipeline=pipe)
+            for (i, _), job in zip(items, created):
+                jobs[i] = job
+        pipe.execute()
+
+    # Queries that share a lock share its job.
+    for i, lock_id in enumerate(lock_ids):
+        owner = lock_owners.get(lock_id)
+        if owner is not None and owner != i:
+            jobs[i] = jobs[owner]
+
+    logger.info("Enqueued %d of %d scheduled queries", sum(len(items) for items in job_datas.values()), len(queries))
+
+    return jobs
+
+
 def signal_handler(*args):
     raise InterruptException
 
@@ -147,30 +255,6 @@ def _resolve_user(user_id, is_api_key, query_id):
         return None
 
 
-def _get_size_iterative(dict_obj):
-    """Iteratively finds size of objects in bytes"""
-    seen = set()
-    size = 0
-    objects = deque([dict_obj])
-
-    while objects:
-        current = objects.popleft()
-        if id(current) in seen:
-            continue
-        seen.add(id(current))
-        size += sys.getsizeof(current)
-
-        if isinstance(current, dict):
-            objects.extend(current.keys())
-            objects.extend(current.values())
-        elif hasattr(current, "__dict__"):
-            objects.append(current.__dict__)
-        elif hasattr(current, "__iter__") and not isinstance(current, (str, bytes, bytearray)):
-            objects.extend(current)
-
-    return size
-
-
 class QueryExecutor:
     def __init__(self, query, data_source_id, user_id, is_api_key, metadata, is_scheduled_query):
         self.job = get_current_job()
@@ -205,7 +289,12 @@ class QueryExecutor:
         annotated_query = self._annotate_query(query_runner)
 
         try:
-            data, error = query_runner.run_query(annotated_query, self.user)
+            if query_runner.supports_streaming and settings.QUERY_RESULTS_STREAMING_ENABLED:
+                data, error = self._stream_query(query_runner, annotated_query), None
+            else:
+                data, error = query_runner.run_query(annotated_query, self.user)
+        except QueryRunnerError as e:
+            data, error = None, str(e)
         except Exception as e:
             if isinstance(e, JobTimeoutException):
                 error = TIMEOUT_MESSAGE
@@ -217,16 +306,28 @@ class QueryExecutor:
 
         run_time = time.time() - started_at
 
+        # Serializing the result gives its size for free (streamed results are already serialized).
+        if data is not None and not isinstance(data, ResultPayload):
+            data = ResultPayload.from_data(data)
+
         logger.info(
             "job=execute_query query_hash=%s ds_id=%d data_length=%s error=[%s]",
             self.query_hash,
             self.data_source_id,
-            data and _get_size_iterative(data),
+            data and data.size,
             error,
         )
+        if data is not None:
+            statsd_client.timing("query_results.data_size.{}".format(self.data_source_id), data.size)
 
-        _unlock(self.query_hash, self.data_source.id)
+        # The lock is only released once the result is stored: until then, those who run the same
+        # query keep getting this job instead of running it again.
+        try:
+            return self._store_result(data, error, run_time)
+        finally:
+            _unlock(self.query_hash, self.data_source.id)
 
+    def _store_result(self, data, error, run_time):
         if error is not None and data is None:
             result = QueryExecutionError(error)
             if self.is_scheduled_query:
@@ -262,6 +363,28 @@ class QueryExecutor:
             models.db.session.commit()
             return result
 
+    def _stream_query(self, query_runner, annotated_query):
+        """Writes the result batches to storage as they arrive, so the whole result set never
+        has to be held in memory as Python objects."""
+        budget = query_runner.result_budget()
+        batches = query_runner.stream_query(annotated_query, self.user)
+        extra = {}
+        try:
+            writer = result_writer(next(batches))
+            while not budget.truncated:
+                try:
+                    rows = next(batches)
+                except StopIteration as e:
+                    # Keys the runner added to the result, e.g. when it truncated it itself.
+                    extra = e.value or {}
+                    break
+                writer.write_rows(budget.fit(rows))
+        finally:
+            # Stops the runner from fetching any further when the budget ran out.
+            batches.close()
+
+        return ResultPayload(writer.close(extra={**extra, **budget.metadata()}))
+
     def _annotate_query(self, query_runner):
         self.metadata["Job ID"] = self.job.id
         self.metadata["Query Hash"] = self.query_hash
@@ -282,6 +405,7 @@ class QueryExecutor:
             self.metadata.get("query_id", "unknown"),
             self.metadata.get("Username", "unknown"),
         )
+        notify_job_progress(self.job, state)
 
     def _load_data_source(self):
         logger.info("job=execute_query state=load_ds ds_id=%d", self.data_source_id)
@@ -1,19 +1,26 @@
 import logging
 import time
 
+from rq.job import JobStatus
 from rq.timeouts import JobTimeoutException
 
-from redash import models, redis_connection, settings, statsd_client
+from redash import (
+    models,
+    redis_connection,
+    rq_redis_connection,
+    settings,
+    statsd_client,
+)
 from redash.models.parameterized_query import (
     InvalidParameterError,
     QueryDetachedFromDataSourceError,
 )
-from redash.monitor import rq_job_ids
 from redash.tasks.failure_report import track_failure
-from redash.utils import json_dumps, sentry
+from redash.tasks.worker import Job
+from redash.utils import json_dumps, result_cache, sentry
 from redash.worker import get_job_logger, job
 
-from .execution import enqueue_query
+from .execution import enqueue_scheduled_queries
 
 logger = get_job_logger(__name__)
 
@@ -29,7 +36,7 @@ def empty_schedules():
     logger.info("Deleted %d schedules.", len(queries))
 
 
-def _should_refresh_query(query):
+def _should_refresh_query(query, paused_data_sources):
     if settings.FEATURE_DISABLE_REFRESH_QUERIES:
         logger.info("Disabled refresh queries.")
         return False
@@ -39,12 +46,12 @@ def _should_refresh_query(query):
     elif query.data_source is None:
         logger.debug("Skipping refresh of %s because the datasource is none.", query.id)
         return False
-    elif query.data_source.paused:
+    elif query.data_source.id in paused_data_sources:
         logger.debug(
             "Skipping refresh of %s because datasource - %s is paused (%s).",
             query.id,
             query.data_source.name,
-            query.data_source.pause_reason,
+            paused_data_sources[query.data_source.id],
         )
         return False
     else:
@@ -80,31 +87,91 @@ def _apply_auto_limit(query_text, query):
     return query.data_source.query_runner.apply_auto_limit(query_text, should_apply_auto_limit)
 
 
+def _in_dependency_order(queries, upstream):
+    """Sorts `queries` so that the ones they read (their `upstream` queries) come first."""
+    by_id = {query.id: query for query in queries}
+    ordered = []
+    visited = set()
+
+    def visit(query_id):
+        # Queries in a cycle keep their order.
+        if query_id in visited:
+            return
+        visited.add(query_id)
+        for upstream_query_id in sorted(upstream.get(query_id, ())):
+            if upstream_query_id in by_id:
+                visit(upstream_query_id)
+        ordered.append(by_id[query_id])
+
+    for query in queries:
+        visit(query.id)
+    return ordered
+
+
+def _reads_other_queries(query, inputs):
+    return bool(inputs) and query.data_source.type == "results"
+
+
+def _inputs_changed(query, inputs):
+    """Whether one of the queries `query` reads (`inputs`, with when their latest result was
+    retrieved) has a newer result than it."""
+    retrieved_at = query.latest_query_data and query.latest_query_data.retrieved_at
+    return retrieved_at is None or any(
+        input_retrieved_at is None or input_retrieved_at > retrieved_at for input_retrieved_at in inputs.values()
+    )
+
+
 def refresh_queries():
     started_at = time.time()
     logger.info("Refreshing queries...")
-    enqueued = []
-    for query in models.Query.outdated_queries():
-        if not _should_refresh_query(query):
+    queries = models.Query.outdated_queries()
+    data_sources = {query.data_source.id: query.data_source for query in queries if query.data_source}
+    paused_data_sources = models.DataSource.pause_reasons(list(data_sources.values()))
+
+    # Queries that read other queries run after them, and those of the Query Results data source only
+    # when the queries they read have new results. Until then they stay outdated, so they're looked at
+    # again on the next refresh.
+    upstream = models.QueryDependency.upstream_of([query.id for query in queries])
+    queries = _in_dependency_order(queries, upstream)
+    pending = set()
+
+    batch = []
+    for query in queries:
+        if not _should_refresh_query(query, paused_data_sources):
             continue
 
+        inputs = upstream.get(query.id)
+        if _reads_other_queries(query, inputs):
+            if pending.intersection(inputs):
+                logger.debug("Postponing refresh of %s until its upstream queries are refreshed.", query.id)
+                pending.add(query.id)
+                continue
+            if not _inputs_changed(query, inputs):
+                logger.debug("Skipping refresh of %s because its upstream queries have no new results.", query.id)
+                continue
+
         try:
             query_text = _apply_default_parameters(query)
             query_text = _apply_auto_limit(query_text, query)
-            enqueue_query(
-                query_text,
-                query.data_source,
-                query.user_id,
-                scheduled_query=query,
-                metadata={"query_id": query.id, "Username": query.user.get_actual_user()},
-            )
-            enqueued.append(query)
+            batch.append((query_text, query, {"query_id": query.id, "Username": query.user.get_actual_user()}))
+            pending.add(query.id)
         except Exception as e:
             message = "Could not enqueue query %d due to %s" % (query.id, repr(e))
             logging.info(message)
             error = RefreshQueriesError(message).with_traceback(e.__traceback__)
             sentry.capture_exception(error)
 
+    enqueued = []
+    if batch:
+        try:
+            enqueue_scheduled_queries(batch)
+            enqueued = [query for _, query, _ in batch]
+        except Exception as e:
+            message = "Could not enqueue %d queries due to %s" % (len(batch), repr(e))
+            logging.info(message)
+            error = RefreshQueriesError(message).with_traceback(e.__traceback__)
+            sentry.capture_exception(error)
+
     status = {
         "started_at": started_at,
         "outdated_queries_count": len(enqueued),
@@ -132,29 +199,62 @@ def cleanup_query_results():
     )
 
     unused_query_results = models.QueryResult.unused(settings.QUERY_RESULTS_CLEANUP_MAX_AGE)
-    deleted_count = models.QueryResult.query.filter(
-        models.QueryResult.id.in_(unused_query_results.limit(settings.QUERY_RESULTS_CLEANUP_COUNT).subquery())
-    ).delete(synchronize_session=False)
+    unused_ids = [result.id for result in unused_query_results.limit(settings.QUERY_RESULTS_CLEANUP_COUNT)]
+    deleted_count = 0
+    if unused_ids:
+        deleted_count = models.QueryResult.query.filter(models.QueryResult.id.in_(unused_ids)).delete(
+            synchronize_session=False
+        )
     models.db.session.commit()
+    result_cache.invalidate(unused_ids)
     logger.info("Deleted %d unused query results.", deleted_count)
 
 
-def remove_ghost_locks():
-    """
-    Removes query locks that reference a non existing RQ job.
-    """
-    keys = redis_connection.keys("query_hash_job:*")
-    locks = {k: redis_connection.get(k) for k in keys}
-    jobs = list(rq_job_ids())
+# Deletes a lock only if it still references the same job.
+DELETE_LOCK_SCRIPT = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("DEL", KEYS[1])
+end
+return 0
+"""
+
+GHOST_LOCKS_BATCH_SIZE = 1000
+
+
+def _remove_ghost_locks(lock_ids):
+    job_ids = redis_connection.mget(lock_ids)
+    with rq_redis_connection.pipeline(transaction=False) as pipe:
+        for job_id in job_ids:
+            pipe.hget(Job.key_for(job_id or ""), "status")
+        statuses = [status and status.decode() for status in pipe.execute()]
 
+    delete_lock = redis_connection.register_script(DELETE_LOCK_SCRIPT)
     count = 0
+    for lock_id, job_id, status in zip(lock_ids, job_ids, statuses):
+        if job_id and status not in (JobStatus.QUEUED, JobStatus.STARTED):
+            count += delete_lock(keys=[lock_id], args=[job_id])
 
-    for lock, job_id in locks.items():
-        if job_id not in jobs:
-            redis_connection.delete(lock)
-            count += 1
+    return count
 
-    logger.info("Locks found: {}, Locks removed: {}".format(len(locks), count))
+
+def remove_ghost_locks():
+    """
+    Removes query locks that reference an RQ job that isn't queued or running anymore.
+    """
+    found = count = 0
+    lock_ids = []
+    for lock_id in redis_connection.scan_iter("query_hash_job:*", count=GHOST_LOCKS_BATCH_SIZE):
+        lock_ids.append(lock_id)
+        if len(lock_ids) == GHOST_LOCKS_BATCH_SIZE:
+            found += len(lock_ids)
+            count += _remove_ghost_locks(lock_ids)
+            lock_ids = []
+
+    if lock_ids:
+        found += len(lock_ids)
+        count += _remove_ghost_locks(lock_ids)
+
+    logger.info("Locks found: {}, Locks removed: {}".format(found, count))
 
 
 @job("schemas", timeout=settings.SCHEMAS_REFRESH_TIMEOUT)
@@ -7,6 +7,7 @@ from rq.job import Job
 from rq_scheduler import Scheduler
 
 from redash import rq_redis_connection, settings
+from redash.tasks.exports import cleanup_exports
 from redash.tasks.failure_report import send_aggregated_errors
 from redash.tasks.general import sync_user_details, version_check
 from redash.tasks.queries import (
@@ -63,6 +64,7 @@ def periodic_job_definitions():
             "result_ttl": 600,
         },
         {"func": empty_schedules, "interval": timedelta(minutes=60)},
+        {"func": cleanup_exports, "timeout": 600, "interval": timedelta(minutes=5)},
         {
             "func": refresh_schemas,
             "interval": timedelta(minutes=settings.SCHEMAS_REFRESH_SCHEDULE),
@@ -1,19 +1,28 @@
+import contextlib
 import errno
 import os
+import random
+import resource
 import signal
 import sys
+import time
 
 from rq import Queue as BaseQueue
+from rq.exceptions import NoSuchJobError
 from rq.job import Job as BaseJob
 from rq.job import JobStatus
 from rq.timeouts import HorseMonitorTimeoutException
-from rq.utils import utcnow
+from rq.utils import as_text, utcnow
 from rq.worker import (
     HerokuWorker,  # HerokuWorker implements graceful shutdown on SIGTERM
     Worker,
 )
 
-from redash import statsd_client
+from redash import settings, statsd_client
+from redash.query_runner import close_connection_pools
+from redash.tasks.fair_queue import FairQueue, release
+
+DONE_STATUSES = (JobStatus.FINISHED, JobStatus.FAILED, JobStatus.STOPPED, JobStatus.CANCELED)
 
 # HerokuWorker does not work in OSX https://github.com/getredash/redash/issues/5413
 if sys.platform == "darwin":
@@ -22,12 +31,110 @@ else:
     BaseWorker = HerokuWorker
 
 
+def job_done_channel(job_id):
+    return "rq:job_done:{}".format(job_id)
+
+
+def job_progress_channel(job_id):
+    return "rq:job_progress:{}".format(job_id)
+
+
+def notify_job_done(job):
+    """Tells those waiting for `job` (see `wait_for_job` and `watch_jobs`) that it's done."""
+    job.connection.publish(job_done_channel(job.id), job.get_status() or "")
+
+
+def notify_job_progress(job, state):
+    """Tells those watching `job` (see `watch_jobs`) that it reached `state`."""
+    job.connection.publish(job_progress_channel(job.id), state)
+
+
+def _is_done(job):
+    return job.is_cancelled or job.get_status(refresh=False) in DONE_STATUSES
+
+
+def wait_for_job(job, timeout):
+    """Waits for up to `timeout` seconds for `job` to be done (finished, failed, stopped or
+    cancelled), without polling it, and returns whether it is."""
+    pubsub = job.connection.pubsub(ignore_subscribe_messages=True)
+    try:
+        pubsub.subscribe(job_done_channel(job.id))
+        # It may have been done before we subscribed.
+        job.refresh()
+        if _is_done(job):
+            return True
+
+        deadline = time.monotonic() + timeout
+        remaining = timeout
+        while remaining > 0:
+            if pubsub.get_message(timeout=remaining) is not None:
+                return True
+            remaining = deadline - time.monotonic()
+        return False
+    finally:
+        pubsub.close()
+
+
+def watch_jobs(job_ids, connection, timeout, heartbeat=None):
+    """Yields each of the jobs with `job_ids` as it is, then again each time it starts a new stage
+    or is done, until they are all done or `timeout` seconds have passed. Jobs that don't exist are
+    left out. If `heartbeat` is given, yields None whenever that many seconds pass without news."""
+    channels = {}
+    for job_id in job_ids:
+        channels[job_done_channel(job_id)] = job_id
+        channels[job_progress_channel(job_id)] = job_id
+
+    pubsub = connection.pubsub(ignore_subscribe_messages=True)
+    try:
+        pubsub.subscribe(*channels)
+        watching = set()
+        # Fetched after subscribing, so that no change in between is missed.
+        for job_id in dict.fromkeys(job_ids):
+            try:
+                job = CancellableJob.fetch(job_id, connection=connection)
+            except NoSuchJobError:
+                continue
+            yield job
+            if not _is_done(job):
+                watching.add(job_id)
+
+        deadline = time.monotonic() + timeout
+        quiet_since = time.monotonic()
+        while watching and time.monotonic() < deadline:
+            now = time.monotonic()
+            if heartbeat and now - quiet_since >= heartbeat:
+                yield None
+                quiet_since = now
+            wait = deadline - now
+            if heartbeat:
+                wait = min(wait, quiet_since + heartbeat - now)
+
+            message = pubsub.get_message(timeout=wait)
+            # Subscription confirmations are ignored, and come back as None too.
+            if message is None or channels[as_text(message["channel"])] not in watching:
+                continue
+
+            job_id = channels[as_text(message["channel"])]
+            try:
+                job = CancellableJob.fetch(job_id, connection=connection)
+            except NoSuchJobError:
+                watching.discard(job_id)
+                continue
+            yield job
+            quiet_since = time.monotonic()
+            if _is_done(job):
+                watching.discard(job_id)
+    finally:
+        pubsub.close()
+
+
 class CancellableJob(BaseJob):
-    def cancel(self, pipeline=None):
+    def cancel(self, pipeline=None, enqueue_dependents=False):
         self.meta["cancelled"] = True
         self.save_meta()
 
-        super().cancel(pipeline=pipeline)
+        super().cancel(pipeline=pipeline, enqueue_dependents=enqueue_dependents)
+        notify_job_done(self)
 
     @property
     def is_cancelled(self):
@@ -36,7 +143,7 @@ class CancellableJob(BaseJob):
 
 class StatsdRecordingQueue(BaseQueue):
     """
-    RQ Queue Mixin that overrides `enqueue_call` to increment metrics via Statsd
+    RQ Queue Mixin that overrides `enqueue_job` and `enqueue_many` to increment metrics via Statsd
     """
 
     def enqueue_job(self, *args, **kwargs):
@@ -44,12 +151,17 @@ class StatsdRecordingQueue(BaseQueue):
         statsd_client.incr("rq.jobs.created.{}".format(self.name))
         return job
 
+    def enqueue_many(self, *args, **kwargs):
+        jobs = super().enqueue_many(*args, **kwargs)
+        statsd_client.incr("rq.jobs.created.{}".format(self.name), len(jobs))
+        return jobs
+
 
 class CancellableQueue(BaseQueue):
     job_class = CancellableJob
 
 
-class RedashQueue(StatsdRecordingQueue, CancellableQueue):
+class RedashQueue(FairQueue, StatsdRecordingQueue, CancellableQueue):
     pass
 
 
@@ -71,6 +183,32 @@ class StatsdRecordingWorker(BaseWorker):
                 statsd_client.incr("rq.jobs.failed.{}".format(queue.name))
 
 
+class JobNotifyingWorker(BaseWorker):
+    """
+    RQ Worker Mixin that overrides `execute_job` to notify those waiting for the job (see
+    `wait_for_job`) once it's done, whether it finished, failed or its work horse was killed
+    """
+
+    def execute_job(self, job, queue):
+        try:
+            super().execute_job(job, queue)
+        finally:
+            notify_job_done(job)
+
+
+class FairQueueWorker(BaseWorker):
+    """
+    RQ Worker Mixin that overrides `execute_job` to free the slot the job took from its data
+    source's limits (see redash.tasks.fair_queue) once it's done
+    """
+
+    def execute_job(self, job, queue):
+        try:
+            super().execute_job(job, queue)
+        finally:
+            release(job, self.connection)
+
+
 class HardLimitingWorker(BaseWorker):
     """
     RQ's work horses enforce time limits by setting a timed alarm and stopping jobs
@@ -191,7 +329,131 @@ class HardLimitingWorker(BaseWorker):
             self.handle_job_failure(job, queue=queue, exc_string=exc_string)
 
 
-class RedashWorker(StatsdRecordingWorker, HardLimitingWorker):
+# What a persistent work horse reports after each job.
+HORSE_READY = b"1"
+HORSE_RECYCLED = b"0"
+
+
+class PersistentHorseWorker(BaseWorker):
+    """
+    RQ forks a new work horse for every job, which then has to connect again to the metadata
+    database, Redis and the data source. With settings.WORKER_PERSISTENT_HORSES, this RQ Worker
+    Mixin forks a single work horse when it starts, and passes it the ID of each job over a pipe
+    instead. The horse reports back once it's done and waits for the next one.
+
+    The work horse is still monitored (and killed) the same way while it runs a job. A new one is
+    forked for the next job when it dies, and once it ran settings.WORKER_HORSE_MAX_JOBS jobs or
+    its memory use reached settings.WORKER_HORSE_MAX_MEMORY megabytes. It closes the connections
+    its query runners pooled (see redash.query_runner.ConnectionPool) before exiting.
+    """
+
+    _persistent_horse = None
+
+    def bootstrap(self, *args, **kwargs):
+        super().bootstrap(*args, **kwargs)
+        if settings.WORKER_PERSISTENT_HORSES:
+            self._fork_persistent_horse()
+
+    def teardown(self):
+        self._stop_persistent_horse()
+        super().teardown()
+
+    def _fork_persistent_horse(self):
+        jobs_read, jobs_write = os.pipe()
+        results_read, results_write = os.pipe()
+        os.environ["RQ_WORKER_ID"] = self.name
+        child_pid = os.fork()
+        if child_pid == 0:
+            os.setsid()
+            os.close(jobs_write)
+            os.close(results_read)
+            self._run_persistent_horse(os.fdopen(jobs_read), results_write)
+            os._exit(0)  # just in case
+
+        os.close(jobs_read)
+        os.close(results_write)
+        self._persistent_horse = (child_pid, jobs_write, results_read)
+        self.procline("Forked persistent work horse {0} at {1}".format(child_pid, utcnow()))
+
+    def _close_persistent_horse(self):
+        _, jobs_write, results_read = self._persistent_horse
+        self._persistent_horse = None
+        os.close(jobs_write)
+        os.close(results_read)
+
+    def _stop_persistent_horse(self):
+        if self._persistent_horse is not None:
+            pid = self._persistent_horse[0]
+            # The horse exits once there won't be any more jobs.
+            self._close_persistent_horse()
+            with contextlib.suppress(ChildProcessError):
+                os.waitpid(pid, 0)
+
+    def _run_persistent_horse(self, jobs, results):
+        random.seed()
+        self._is_horse = True
+        queues = {queue.name: queue for queue in self.queues}
+        jobs_done = 0
+        try:
+            while True:
+                self.setup_work_horse_signals()
+                line = jobs.readline()
+                if not line:
+                    break
+
+                job_id, queue_name = line.split()
+                os.environ["RQ_JOB_ID"] = job_id
+                job = self.job_class.fetch(job_id, connection=self.connection, serializer=self.serializer)
+                self.perform_job(job, queues[queue_name])
+
+                jobs_done += 1
+                max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+                if jobs_done >= settings.WORKER_HORSE_MAX_JOBS or max_rss >= settings.WORKER_HORSE_MAX_MEMORY:
+                    os.write(results, HORSE_RECYCLED)
+                    break
+                os.write(results, HORSE_READY)
+        except:  # noqa
+            os._exit(1)
+        close_connection_pools()
+        os._exit(0)
+
+    def fork_work_horse(self, job, queue):
+        if not settings.WORKER_PERSISTENT_HORSES:
+            return super().fork_work_horse(job, queue)
+
+        message = "{} {}\n".format(job.id, queue.name).encode()
+        if self._persistent_horse is not None:
+            try:
+                os.write(self._persistent_horse[1], message)
+            except BrokenPipeError:
+                # The horse died while it was waiting for a job.
+                self.wait_for_horse()
+            else:
+                self._horse_pid = self._persistent_horse[0]
+                return
+
+        self._fork_persistent_horse()
+        os.write(self._persistent_horse[1], message)
+        self._horse_pid = self._persistent_horse[0]
+
+    def wait_for_horse(self):
+        if self._persistent_horse is None:
+            return super().wait_for_horse()
+
+        pid, _, results_read = self._persistent_horse
+        if os.read(results_read, 1) == HORSE_READY:
+            return pid, os.EX_OK, None
+
+        # The horse is done: either it's being recycled, or it died (e.g. killed for exceeding the
+        # job's time limit).
+        self._close_persistent_horse()
+        self._horse_pid = pid
+        return super().wait_for_horse()
+
+
+class RedashWorker(
+    StatsdRecordingWorker, JobNotifyingWorker, FairQueueWorker, PersistentHorseWorker, HardLimitingWorker
+):
     queue_class = RedashQueue
 
 
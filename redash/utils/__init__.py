@@ -24,6 +24,13 @@ from redash import settings
 
 from .human_time import parse_human_time
 
+try:
+    import orjson
+
+    orjson_enabled = True
+except ImportError:
+    orjson_enabled = False
+
 COMMENTS_REGEX = re.compile(r"/\*.*?\*/")
 WRITER_ENCODING = os.environ.get("REDASH_CSV_WRITER_ENCODING", "utf-8")
 WRITER_ERRORS = os.environ.get("REDASH_CSV_WRITER_ERRORS", "strict")
@@ -71,53 +78,149 @@ def generate_token(length):
     return "".join(rand.choice(chars) for x in range(length))
 
 
-class JSONEncoder(json.JSONEncoder):
-    """Adapter for `json.dumps`."""
+# Runner-specific encoders (`custom_json_encoder`), resolved once per type: maps a type to
+# the encoder that handled it, or to None when none of them does.
+_query_runners = None
+_runner_encoders = (0, [])
+_runner_encoder_by_type = {}
 
-    def __init__(self, **kwargs):
+
+def _get_runner_encoders():
+    global _query_runners, _runner_encoders
+
+    if _query_runners is None:
         from redash.query_runner import query_runners
 
-        self.encoders = [r.custom_json_encoder for r in query_runners.values() if hasattr(r, "custom_json_encoder")]
-        super().__init__(**kwargs)
+        _query_runners = query_runners
+
+    if _runner_encoders[0] != len(_query_runners):
+        encoders = [r.custom_json_encoder for r in _query_runners.values() if hasattr(r, "custom_json_encoder")]
+        _runner_encoders = (len(_query_runners), encoders)
+        _runner_encoder_by_type.clear()
+
+    return _runner_encoders[1]
+
+
+def _runner_default(encoder, o):
+    encoders = _get_runner_encoders()
+    cls = type(o)
+
+    if cls in _runner_encoder_by_type:
+        runner_encoder = _runner_encoder_by_type[cls]
+        if runner_encoder is None:
+            return None
+        result = runner_encoder(encoder, o)
+        if result is not None:
+            return result
+
+    for runner_encoder in encoders:
+        result = runner_encoder(encoder, o)
+        if result is not None:
+            _runner_encoder_by_type[cls] = runner_encoder
+            return result
+
+    _runner_encoder_by_type.setdefault(cls, None)
+    return None
+
+
+# See "Date Time String Format" in the ECMA-262 specification.
+def _encode_datetime(o):
+    result = o.isoformat()
+    if o.microsecond:
+        result = result[:23] + result[26:]
+    if result.endswith("+00:00"):
+        result = result[:-6] + "Z"
+    return result
+
+
+def _encode_time(o):
+    if o.utcoffset() is not None:
+        raise ValueError("JSON can't represent timezone-aware times.")
+    result = o.isoformat()
+    if o.microsecond:
+        result = result[:12]
+    return result
+
+
+def _encode_hex(o):
+    return binascii.hexlify(o).decode()
+
+
+# Checked in order (so subclasses are handled too) the first time a type is seen.
+_ENCODERS = [
+    (Query, list),
+    (decimal.Decimal, float),
+    ((datetime.timedelta, uuid.UUID), str),
+    (datetime.datetime, _encode_datetime),
+    (datetime.date, datetime.date.isoformat),
+    (datetime.time, _encode_time),
+    ((memoryview, bytes), _encode_hex),
+]
+_encoder_by_type = {}
+
+
+class JSONEncoder(json.JSONEncoder):
+    """Adapter for `json.dumps`."""
 
     def default(self, o):
-        for encoder in self.encoders:
-            result = encoder(self, o)
-            if result:
-                return result
-        if isinstance(o, Query):
-            result = list(o)
-        elif isinstance(o, decimal.Decimal):
-            result = float(o)
-        elif isinstance(o, (datetime.timedelta, uuid.UUID)):
-            result = str(o)
-        # See "Date Time String Format" in the ECMA-262 specification.
-        elif isinstance(o, datetime.datetime):
-            result = o.isoformat()
-            if o.microsecond:
-                result = result[:23] + result[26:]
-            if result.endswith("+00:00"):
-                result = result[:-6] + "Z"
-        elif isinstance(o, datetime.date):
-            result = o.isoformat()
-        elif isinstance(o, datetime.time):
-            if o.utcoffset() is not None:
-                raise ValueError("JSON can't represent timezone-aware times.")
-            result = o.isoformat()
-            if o.microsecond:
-                result = result[:12]
-        elif isinstance(o, memoryview):
-            result = binascii.hexlify(o).decode()
-        elif isinstance(o, bytes):
-            result = binascii.hexlify(o).decode()
-        else:
-            result = super().default(o)
-        return result
+        result = _runner_default(self, o)
+        if result is not None:
+            return result
+
+        cls = type(o)
+        encoder = _encoder_by_type.get(cls)
+        if encoder is None:
+            for types, encoder in _ENCODERS:
+                if isinstance(o, types):
+                    _encoder_by_type[cls] = encoder
+                    break
+            else:
+                return super().default(o)
+
+        return encoder(o)
+
+
+_default_encoder = JSONEncoder()
+
+# orjson serializes NaN and Infinity as null natively. Dates and times are passed to
+# `JSONEncoder.default` so they're formatted the same way as with the stdlib codec.
+_ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME if orjson_enabled else 0
+
+
+def _use_orjson(args, kwargs):
+    # orjson only produces compact output, so it's used when that's what was asked for.
+    return (
+        settings.JSON_CODEC == "orjson"
+        and orjson_enabled
+        and not args
+        and kwargs.keys() <= {"sort_keys", "ensure_ascii", "separators"}
+        and not kwargs.get("ensure_ascii", False)
+        and tuple(kwargs.get("separators", (",", ":"))) == (",", ":")
+    )
+
+
+def _orjson_dumps(data, sort_keys=False, ensure_ascii=False, separators=None):
+    try:
+        return orjson.dumps(
+            data,
+            default=_default_encoder.default,
+            option=(_ORJSON_OPTIONS | orjson.OPT_SORT_KEYS) if sort_keys else _ORJSON_OPTIONS,
+        )
+    except orjson.JSONEncodeError:
+        # Integers over 64 bits, non-string keys of other types, etc. The stdlib codec
+        # handles them (or raises its usual errors).
+        return None
 
 
 def json_loads(data, *args, **kwargs):
     """A custom JSON loading function which passes all parameters to the
     json.loads function."""
+    if _use_orjson(args, kwargs):
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # orjson is stricter (e.g. about NaN literals); the stdlib decoder has the final say.
+            pass
     return json.loads(data, *args, **kwargs)
 
 
@@ -132,9 +235,7 @@ def _sanitize_data(data):
     return data
 
 
-def json_dumps(data, *args, **kwargs):
-    """A custom JSON dumping function which passes all parameters to the
-    json.dumps function."""
+def _stdlib_json_dumps(data, *args, **kwargs):
     kwargs.setdefault("cls", JSONEncoder)
     kwargs.setdefault("ensure_ascii", False)
     # Float value nan or inf in Python should be render to None or null in json.
@@ -143,6 +244,30 @@ def json_dumps(data, *args, **kwargs):
     return json.dumps(_sanitize_data(data), *args, **kwargs)
 
 
+def json_dumps(data, *args, **kwargs):
+    """A custom JSON dumping function which passes all parameters to the
+    json.dumps function.
+
+    With the orjson codec (REDASH_JSON_CODEC), compact output (`separators=(",", ":")`) is
+    produced by orjson unless other stdlib-only options (indent, cls, ...) are given."""
+    if "separators" in kwargs and _use_orjson(args, kwargs):
+        result = _orjson_dumps(data, **kwargs)
+        if result is not None:
+            return result.decode("utf-8")
+    return _stdlib_json_dumps(data, *args, **kwargs)
+
+
+def json_dumpb(data, **kwargs):
+    """Compact JSON as UTF-8 encoded bytes: what result storage and API responses use. With
+    orjson this avoids both the stdlib encoder and a decode/encode round trip."""
+    kwargs.setdefault("separators", (",", ":"))
+    if _use_orjson((), kwargs):
+        result = _orjson_dumps(data, **kwargs)
+        if result is not None:
+            return result
+    return _stdlib_json_dumps(data, **kwargs).encode("utf-8")
+
+
 def mustache_render(template, context=None, **kwargs):
     renderer = pystache.Renderer(escape=lambda u: u)
     return renderer.render(template, context, **kwargs)
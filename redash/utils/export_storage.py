@@ -0,0 +1,120 @@
+"""
+Storage for rendered downloads (exports): background jobs save the files they render under
+their job's ID, and the web processes serve them from there until they expire.
+
+* local -- files in a directory (`REDASH_EXPORTS_PATH`), served with support for range and
+  conditional requests. The directory has to be shared by the web and worker processes.
+
+* s3 -- objects in a bucket of S3 or of an S3-compatible store (`REDASH_EXPORTS_S3_*`).
+  Downloads are redirected to a presigned URL, so the store serves them (ranges included).
+"""
+import os
+import shutil
+import time
+from urllib.parse import quote
+
+from flask import redirect, send_file
+
+from redash import settings
+
+try:
+    import boto3
+
+    s3_enabled = True
+except ImportError:
+    s3_enabled = False
+
+
+class LocalExportStorage:
+    def __init__(self, path):
+        self.path = path
+
+    def _path(self, key):
+        return os.path.join(self.path, key)
+
+    def save(self, key, filename):
+        """Moves the file at `filename` into the storage, as `key`."""
+        os.makedirs(self.path, exist_ok=True)
+        shutil.move(filename, self._path(key))
+
+    def exists(self, key):
+        return os.path.isfile(self._path(key))
+
+    def send(self, key, download_name, content_type):
+        return send_file(
+            self._path(key),
+            mimetype=content_type,
+            as_attachment=True,
+            download_name=download_name,
+            conditional=True,
+            max_age=0,
+        )
+
+    def cleanup(self, max_age):
+        """Removes the files saved more than `max_age` seconds ago and returns how many there were."""
+        if not os.path.isdir(self.path):
+            return 0
+
+        removed = 0
+        expired_at = time.time() - max_age
+        for entry in os.scandir(self.path):
+            if entry.is_file() and entry.stat().st_mtime < expired_at:
+                os.remove(entry.path)
+                removed += 1
+
+        return removed
+
+
+class S3ExportStorage:
+    def __init__(self, bucket, prefix="", endpoint_url=None):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = boto3.client("s3", endpoint_url=endpoint_url)
+
+    def save(self, key, filename):
+        self.client.upload_file(filename, self.bucket, self.prefix + key)
+        os.remove(filename)
+
+    def exists(self, key):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.prefix + key)
+        except self.client.exceptions.ClientError:
+            return False
+        return True
+
+    def send(self, key, download_name, content_type):
+        url = self.client.generate_presigned_url(
+            "get_object",
+            Params={
+                "Bucket": self.bucket,
+                "Key": self.prefix + key,
+                "ResponseContentType": content_type,
+                "ResponseContentDisposition": "attachment; filename*=UTF-8''{}".format(quote(download_name)),
+            },
+            ExpiresIn=300,
+        )
+        return redirect(url)
+
+    def cleanup(self, max_age):
+        removed = 0
+        expired_at = time.time() - max_age
+        for page in self.client.get_paginator("list_objects_v2").paginate(Bucket=self.bucket, Prefix=self.prefix):
+            expired = [
+                {"Key": obj["Key"]} for obj in page.get("Contents", []) if obj["LastModified"].timestamp() < expired_at
+            ]
+            if expired:
+                self.client.delete_objects(Bucket=self.bucket, Delete={"Objects": expired})
+                removed += len(expired)
+
+        return removed
+
+
+def get_export_storage():
+    if settings.EXPORTS_STORAGE == "s3":
+        if not s3_enabled:
+            raise Exception("REDASH_EXPORTS_STORAGE=s3 requires boto3.")
+        return S3ExportStorage(
+            settings.EXPORTS_S3_BUCKET, settings.EXPORTS_S3_PREFIX, endpoint_url=settings.EXPORTS_S3_ENDPOINT_URL
+        )
+
+    return LocalExportStorage(settings.EXPORTS_PATH)
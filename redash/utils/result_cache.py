@@ -0,0 +1,170 @@
+"""
+A least-recently-used cache of query results in Redis, in front of the `query_results` table.
+
+Entries hold the stored payload as is (see `redash.utils.result_storage`) along with the
+result's other columns, and are looked up by result id. The cache is bounded by
+QUERY_RESULTS_CACHE_SIZE: adding an entry evicts the least recently read ones until the
+entries fit. Query results never change once stored, so entries only have to be removed when
+their result is deleted (see `invalidate`).
+
+Admission depends on the result's size: results larger than QUERY_RESULTS_CACHE_MAX_ENTRY_SIZE
+are never cached, and those larger than ADMIT_AT_ONCE_SIZE only on their second miss within
+SEEN_TTL, so that large results read only once don't evict the popular ones.
+"""
+import time
+
+import redis
+
+from redash import settings, statsd_client
+from redash.utils import json_dumps, json_loads
+
+# Results up to this size are cached on their first miss.
+ADMIT_AT_ONCE_SIZE = 64 * 1024
+# How long a miss on a larger result is remembered for.
+SEEN_TTL = 3600
+
+INDEX_KEY = "query_result_cache:index"
+STATS_KEY = "query_result_cache:stats"
+
+_REMOVE_ENTRY = """
+local function remove_entry(result_id)
+    local key = "query_result_cache:" .. result_id
+    local size = tonumber(redis.call("HGET", key, "size"))
+    redis.call("ZREM", KEYS[1], result_id)
+    if size then
+        redis.call("DEL", key)
+        redis.call("HINCRBY", KEYS[2], "bytes", -size)
+    end
+end
+"""
+
+# KEYS: index, stats, entry
+# ARGV: result ID, now
+GET_SCRIPT = """
+local entry = redis.call("HMGET", KEYS[3], "meta", "data", "size")
+if not entry[1] then
+    redis.call("HINCRBY", KEYS[2], "misses", 1)
+    return nil
+end
+redis.call("ZADD", KEYS[1], ARGV[2], ARGV[1])
+redis.call("HINCRBY", KEYS[2], "hits", 1)
+redis.call("HINCRBY", KEYS[2], "bytes_saved", entry[3])
+return entry
+"""
+
+# KEYS: index, stats, entry
+# ARGV: result ID, now, meta, data, size, cache size
+PUT_SCRIPT = (
+    _REMOVE_ENTRY
+    + """
+if redis.call("EXISTS", KEYS[3]) == 1 then
+    return 0
+end
+redis.call("HSET", KEYS[3], "meta", ARGV[3], "data", ARGV[4], "size", ARGV[5])
+redis.call("ZADD", KEYS[1], ARGV[2], ARGV[1])
+local total = redis.call("HINCRBY", KEYS[2], "bytes", ARGV[5])
+local cache_size = tonumber(ARGV[6])
+while total > cache_size do
+    local oldest = redis.call("ZRANGE", KEYS[1], 0, 0)
+    if #oldest == 0 then
+        break
+    end
+    remove_entry(oldest[1])
+    total = tonumber(redis.call("HGET", KEYS[2], "bytes"))
+end
+return 1
+"""
+)
+
+# KEYS: index, stats
+# ARGV: result IDs
+INVALIDATE_SCRIPT = (
+    _REMOVE_ENTRY
+    + """
+for _, result_id in ipairs(ARGV) do
+    remove_entry(result_id)
+end
+return 0
+"""
+)
+
+redis_connection = redis.from_url(settings.QUERY_RESULTS_CACHE_REDIS_URL)
+
+
+def _entry_key(result_id):
+    return "query_result_cache:{}".format(result_id)
+
+
+def _seen_key(result_id):
+    return "query_result_cache:seen:{}".format(result_id)
+
+
+def is_enabled():
+    return settings.QUERY_RESULTS_CACHE_SIZE > 0
+
+
+def get(result_id):
+    """Returns the columns and payload cached for the result with `result_id`, or None."""
+    if not is_enabled():
+        return None
+
+    script = redis_connection.register_script(GET_SCRIPT)
+    entry = script(keys=[INDEX_KEY, STATS_KEY, _entry_key(result_id)], args=[result_id, time.time()])
+    if entry is None:
+        statsd_client.incr("query_results_cache.miss")
+        return None
+
+    meta, data, size = entry
+    statsd_client.incr("query_results_cache.hit")
+    statsd_client.incr("query_results_cache.bytes_saved", int(size))
+    return json_loads(meta), data
+
+
+def put(result_id, meta, data):
+    """Caches `data` (the stored payload) and `meta` (the other columns) of the result with
+    `result_id`, if its size lets it in."""
+    if not is_enabled() or data is None:
+        return
+
+    meta = json_dumps(meta)
+    size = len(meta) + len(data)
+    if size > settings.QUERY_RESULTS_CACHE_MAX_ENTRY_SIZE * 1024:
+        return
+    if size > ADMIT_AT_ONCE_SIZE and redis_connection.set(_seen_key(result_id), 1, ex=SEEN_TTL, nx=True):
+        return
+
+    script = redis_connection.register_script(PUT_SCRIPT)
+    script(
+        keys=[INDEX_KEY, STATS_KEY, _entry_key(result_id)],
+        args=[result_id, time.time(), meta, data, size, settings.QUERY_RESULTS_CACHE_SIZE * 1024 * 1024],
+    )
+
+
+def invalidate(result_ids):
+    """Removes the results with `result_ids` from the cache."""
+    if not is_enabled() or not result_ids:
+        return
+
+    script = redis_connection.register_script(INVALIDATE_SCRIPT)
+    script(keys=[INDEX_KEY, STATS_KEY], args=list(result_ids))
+
+
+def get_stats():
+    if not is_enabled():
+        return {"enabled": False}
+
+    with redis_connection.pipeline() as pipe:
+        pipe.hmget(STATS_KEY, "hits", "misses", "bytes_saved", "bytes")
+        pipe.zcard(INDEX_KEY)
+        (hits, misses, bytes_saved, size), entries = pipe.execute()
+
+    hits, misses = int(hits or 0), int(misses or 0)
+    return {
+        "enabled": True,
+        "hits": hits,
+        "misses": misses,
+        "hit_ratio": hits / (hits + misses) if hits + misses else None,
+        "bytes_saved": int(bytes_saved or 0),
+        "entries": entries,
+        "size": int(size or 0),
+    }
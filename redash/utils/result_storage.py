@@ -0,0 +1,362 @@
+"""
+Storage encoding for query result payloads (the `query_results.data` column).
+
+Two layouts are supported:
+
+* JSON -- the legacy layout: the whole ``{"columns": [...], "rows": [...]}`` document
+  serialized as UTF-8 JSON. Results stored before the columnar layout was introduced
+  use it, and it is still written when `REDASH_QUERY_RESULTS_STORAGE_FORMAT=json`.
+
+* Columnar (version 1) -- rows are split into row groups, and each column of a row group
+  is serialized and compressed separately, so readers can decode only the columns and
+  row ranges they need. Row groups whose rows don't match the result's columns exactly
+  (missing or extra keys) are stored row-oriented instead. A JSON footer at the end of
+  the payload describes the layout:
+
+      MAGIC | chunk | chunk | ... | footer | footer length (uint32, big endian) | MAGIC
+"""
+import itertools
+import struct
+import zlib
+
+from redash import settings
+from redash.utils import json_dumpb, json_loads
+
+MAGIC = b"RDC1"
+FOOTER_LENGTH = struct.Struct(">I")
+
+FORMAT_JSON = "json"
+FORMAT_COLUMNAR = "columnar"
+
+LAYOUT_COLUMNS = "columns"
+LAYOUT_ROWS = "rows"
+
+
+class ResultStorageError(Exception):
+    pass
+
+
+def _compress(values, level):
+    return zlib.compress(json_dumpb(values), level)
+
+
+def _decompress(chunk):
+    return json_loads(zlib.decompress(chunk))
+
+
+def is_columnar(raw):
+    return raw[: len(MAGIC)] == MAGIC
+
+
+def supports_columnar(data):
+    """Whether `data` has the `{"columns": [...], "rows": [...]}` shape the columnar layout needs."""
+    return (
+        isinstance(data, dict)
+        and isinstance(data.get("columns"), list)
+        and isinstance(data.get("rows"), list)
+        and all(isinstance(column, dict) and "name" in column for column in data["columns"])
+    )
+
+
+def iter_json_columns(names, rows, batch_size=None):
+    """Yields `rows` in batches of `batch_size`, each as a list of compact JSON arrays holding
+    the values of one of the `names` columns (None where a row doesn't have it)."""
+    batch_size = batch_size or settings.QUERY_RESULTS_ROW_GROUP_SIZE
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start : start + batch_size]
+        yield [json_dumpb([row.get(name) for row in batch]) for name in names]
+
+
+class ColumnarResultWriter:
+    """
+    Encodes a result into the columnar layout incrementally.
+
+    Rows are buffered only until a row group is full and then compressed, so the memory
+    needed is bounded by the row group size plus the compressed output.
+    """
+
+    def __init__(self, columns, row_group_size=None, compression_level=None):
+        self.columns = columns
+        self.column_names = [column["name"] for column in columns]
+        self.row_group_size = row_group_size or settings.QUERY_RESULTS_ROW_GROUP_SIZE
+        self.compression_level = (
+            settings.QUERY_RESULTS_COMPRESSION_LEVEL if compression_level is None else compression_level
+        )
+        self.row_count = 0
+        self.size = len(MAGIC)
+
+        self._name_set = set(self.column_names)
+        self._unique_names = len(self._name_set) == len(self.column_names)
+        self._buffer = []
+        self._row_groups = []
+        self._chunks = [MAGIC]
+
+    def write_rows(self, rows):
+        for row in rows:
+            self._buffer.append(row)
+            if len(self._buffer) >= self.row_group_size:
+                self._flush()
+
+    def _is_rectangular(self, rows):
+        if not self._unique_names:
+            return False
+
+        width = len(self.column_names)
+        names = self._name_set
+        return all(len(row) == width and row.keys() == names for row in rows)
+
+    def _flush(self):
+        rows, self._buffer = self._buffer, []
+        if not rows:
+            return
+
+        if self._is_rectangular(rows):
+            layout = LAYOUT_COLUMNS
+            chunks = [_compress([row[name] for row in rows], self.compression_level) for name in self.column_names]
+        else:
+            layout = LAYOUT_ROWS
+            chunks = [_compress(rows, self.compression_level)]
+
+        self._row_groups.append({"rows": len(rows), "layout": layout, "chunks": [len(c) for c in chunks]})
+        self._chunks.extend(chunks)
+        self.size += sum(len(c) for c in chunks)
+        self.row_count += len(rows)
+
+    def close(self, extra=None):
+        """Flushes buffered rows and returns the encoded payload. `extra` holds any top-level
+        keys of the result other than columns and rows (e.g. `truncated`)."""
+        self._flush()
+
+        footer = json_dumpb(
+            {
+                "version": 1,
+                "compression": "zlib",
+                "columns": self.columns,
+                "row_count": self.row_count,
+                "row_groups": self._row_groups,
+                "extra": extra or {},
+            }
+        )
+        self._chunks.extend([footer, FOOTER_LENGTH.pack(len(footer)), MAGIC])
+
+        raw = b"".join(self._chunks)
+        self._chunks = None
+        self.size = len(raw)
+        return raw
+
+
+class JSONResultWriter:
+    """Same interface as `ColumnarResultWriter`, for the legacy JSON layout (which can't be
+    written incrementally, so rows are kept in memory until `close`)."""
+
+    def __init__(self, columns):
+        self.columns = columns
+        self.row_count = 0
+        self._rows = []
+
+    def write_rows(self, rows):
+        self._rows.extend(rows)
+        self.row_count = len(self._rows)
+
+    def close(self, extra=None):
+        data = {"columns": self.columns, "rows": self._rows, **(extra or {})}
+        self._rows = None
+        return json_dumpb(data)
+
+
+def result_writer(columns, storage_format=None):
+    storage_format = storage_format or settings.QUERY_RESULTS_STORAGE_FORMAT
+
+    if storage_format == FORMAT_COLUMNAR and supports_columnar({"columns": columns, "rows": []}):
+        return ColumnarResultWriter(columns)
+
+    return JSONResultWriter(columns)
+
+
+def encode_result(data, storage_format=None):
+    storage_format = storage_format or settings.QUERY_RESULTS_STORAGE_FORMAT
+
+    if storage_format == FORMAT_COLUMNAR and supports_columnar(data):
+        writer = ColumnarResultWriter(data["columns"])
+        writer.write_rows(data["rows"])
+        return writer.close(extra={k: v for k, v in data.items() if k not in ("columns", "rows")})
+
+    return json_dumpb(data)
+
+
+class ResultPayload:
+    """
+    Read access to a stored query result.
+
+    Nothing is decoded up front: `columns` and `row_count` only need the footer, and
+    `iter_rows` decodes one row group (and only the requested columns) at a time. `to_dict`
+    decodes everything and caches the result.
+    """
+
+    def __init__(self, raw, data=None):
+        self.raw = raw
+        self._data = data
+        self._footer = None
+
+    @classmethod
+    def from_data(cls, data, storage_format=None):
+        return cls(encode_result(data, storage_format), data)
+
+    @property
+    def size(self):
+        return len(self.raw)
+
+    @property
+    def is_columnar(self):
+        return is_columnar(self.raw)
+
+    @property
+    def footer(self):
+        if self._footer is None:
+            end = len(self.raw) - len(MAGIC) - FOOTER_LENGTH.size
+            if end < len(MAGIC) or self.raw[-len(MAGIC) :] != MAGIC:
+                raise ResultStorageError("Corrupted query result payload.")
+
+            (length,) = FOOTER_LENGTH.unpack_from(self.raw, end)
+            self._footer = json_loads(self.raw[end - length : end])
+
+        return self._footer
+
+    def _json_data(self):
+        if self._data is None:
+            self._data = json_loads(self.raw)
+        return self._data
+
+    @property
+    def columns(self):
+        if self.is_columnar:
+            return self.footer["columns"]
+
+        data = self._json_data()
+        return data.get("columns") if isinstance(data, dict) else None
+
+    @property
+    def row_count(self):
+        if self.is_columnar:
+            return self.footer["row_count"]
+
+        data = self._json_data()
+        return len(data.get("rows") or []) if isinstance(data, dict) else 0
+
+    def _iter_row_groups(self, start, stop):
+        offset = len(MAGIC)
+        first_row = 0
+
+        for group in self.footer["row_groups"]:
+            last_row = first_row + group["rows"]
+            if first_row >= stop:
+                break
+
+            if last_row > start:
+                yield first_row, group, offset
+
+            offset += sum(group["chunks"])
+            first_row = last_row
+
+    def _decode_row_group(self, group, offset, columns):
+        chunks = []
+        for length in group["chunks"]:
+            chunks.append((offset, length))
+            offset += length
+
+        if group["layout"] == LAYOUT_ROWS:
+            ((offset, length),) = chunks
+            rows = _decompress(self.raw[offset : offset + length])
+            if columns is None:
+                return rows
+            return [{name: row[name] for name in columns if name in row} for row in rows]
+
+        names = [c["name"] for c in self.footer["columns"]]
+        if columns is not None:
+            names = [name for name in columns if name in names]
+
+        positions = {c["name"]: i for i, c in enumerate(self.footer["columns"])}
+        values = []
+        for name in names:
+            offset, length = chunks[positions[name]]
+            values.append(_decompress(self.raw[offset : offset + length]))
+
+        return [dict(zip(names, row)) for row in zip(*values)] if names else [{} for _ in range(group["rows"])]
+
+    def iter_rows(self, columns=None, start=0, stop=None):
+        """Yields rows (as dicts) in the `[start, stop)` range, limited to `columns` if given."""
+        if not self.is_columnar:
+            data = self._json_data()
+            rows = (data.get("rows") or []) if isinstance(data, dict) else []
+            for row in itertools.islice(rows, start, stop):
+                yield row if columns is None else {name: row[name] for name in columns if name in row}
+            return
+
+        if stop is None:
+            stop = self.row_count
+
+        for first_row, group, offset in self._iter_row_groups(start, stop):
+            rows = self._decode_row_group(group, offset, columns)
+            yield from rows[max(start - first_row, 0) : stop - first_row]
+
+    def iter_json(self):
+        """Yields the result's JSON document (as `to_dict` would serialize it) in chunks of
+        bytes, without decoding the whole result: legacy JSON payloads are returned as stored,
+        row-oriented row groups are decompressed but not parsed, and column-oriented ones are
+        decoded and re-encoded one row group at a time."""
+        if not self.is_columnar:
+            yield self.raw
+            return
+
+        footer = self.footer
+        yield b'{"columns":' + json_dumpb(footer["columns"]) + b',"rows":['
+
+        first = True
+        for _, group, offset in self._iter_row_groups(0, footer["row_count"]):
+            if group["layout"] == LAYOUT_ROWS:
+                # Chunks hold compact JSON arrays: strip the brackets and splice the rows in.
+                (length,) = group["chunks"]
+                rows = zlib.decompress(self.raw[offset : offset + length])[1:-1]
+            else:
+                rows = json_dumpb(self._decode_row_group(group, offset, None))[1:-1]
+
+            if rows:
+                yield rows if first else b"," + rows
+                first = False
+
+        extra = json_dumpb(footer["extra"])[1:-1]
+        yield b"]," + extra + b"}" if extra else b"]}"
+
+    def iter_json_columns(self):
+        """Yields the rows one row group at a time, as `iter_json_columns` (the function) does.
+        Column-oriented row groups are only decompressed: their chunks already hold the arrays."""
+        names = [column["name"] for column in self.columns or []]
+        if not self.is_columnar:
+            data = self._json_data()
+            yield from iter_json_columns(names, (data.get("rows") or []) if isinstance(data, dict) else [])
+            return
+
+        for _, group, offset in self._iter_row_groups(0, self.row_count):
+            if group["layout"] == LAYOUT_ROWS:
+                rows = self._decode_row_group(group, offset, None)
+                yield [json_dumpb([row.get(name) for row in rows]) for name in names]
+                continue
+
+            arrays = []
+            for length in group["chunks"]:
+                arrays.append(zlib.decompress(self.raw[offset : offset + length]))
+                offset += length
+            yield arrays
+
+    def to_dict(self):
+        if self._data is None:
+            if self.is_columnar:
+                self._data = {
+                    "columns": self.columns,
+                    "rows": list(self.iter_rows()),
+                    **self.footer["extra"],
+                }
+            else:
+                self._data = json_loads(self.raw)
+
+        return self._data
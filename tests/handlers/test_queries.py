@@ -471,6 +471,43 @@ class TestQueryForkResourcePost(BaseTestCase):
         self.assertEqual(rv.status_code, 403)
 
 
+class TestQueryDependenciesResourceGet(BaseTestCase):
+    def test_returns_upstream_and_downstream_queries(self):
+        results = self.factory.create_data_source(type="results", group=self.factory.org.default_group)
+        source = self.factory.create_query()
+        query = self.factory.create_query(data_source=results, query_text="SELECT * FROM query_{}".format(source.id))
+        downstream = self.factory.create_query(
+            data_source=results, query_text="SELECT * FROM cached_query_{}".format(query.id)
+        )
+        hidden = self.factory.create_query(
+            data_source=self.factory.create_data_source(type="results", group=self.factory.create_group()),
+            query_text="SELECT * FROM query_{}".format(query.id),
+        )
+
+        rv = self.make_request("get", "/api/queries/{}/dependencies".format(query.id))
+
+        self.assertEqual(rv.status_code, 200)
+        self.assertEqual(
+            rv.json["upstream"],
+            [{"query_id": query.id, "upstream_query_id": source.id, "kind": "query", "depth": 1}],
+        )
+        self.assertEqual(
+            rv.json["downstream"],
+            [{"query_id": downstream.id, "upstream_query_id": query.id, "kind": "cached_query", "depth": 1}],
+        )
+        self.assertEqual([q["id"] for q in rv.json["queries"]], [source.id, query.id, downstream.id])
+        self.assertNotIn(hidden.id, [q["id"] for q in rv.json["queries"]])
+
+    def test_requires_access_to_the_query(self):
+        query = self.factory.create_query(
+            data_source=self.factory.create_data_source(group=self.factory.create_group())
+        )
+
+        rv = self.make_request("get", "/api/queries/{}/dependencies".format(query.id))
+
+        self.assertEqual(rv.status_code, 403)
+
+
 class TestFormatSQLQueryAPI(BaseTestCase):
     def test_format_sql_query(self):
         admin = self.factory.create_admin()
@@ -1,8 +1,20 @@
+import os
+import tempfile
+from unittest.mock import patch
+
+from rq import SimpleWorker
+
+from redash import rq_redis_connection
 from redash.handlers.query_results import error_messages, run_query
 from redash.models import db
+from redash.tasks import Job, Queue
 from tests import BaseTestCase
 
 
+def work():
+    SimpleWorker(["default"], connection=rq_redis_connection, queue_class=Queue, job_class=Job).work(burst=True)
+
+
 class TestRunQuery(BaseTestCase):
     def test_run_query_with_no_data_source(self):
         response, status = run_query(None, None, None, None, None)
@@ -32,6 +44,32 @@ class TestQueryResultsCacheHeaders(BaseTestCase):
         self.assertEqual(404, rv.status_code)
 
 
+class TestQueryResultJSONResponse(BaseTestCase):
+    def test_returns_query_result_with_data(self):
+        data = {"columns": [{"name": "id", "type": "integer"}], "rows": [{"id": i} for i in range(3)]}
+        query_result = self.factory.create_query_result(data=data)
+        query = self.factory.create_query(latest_query_data=query_result)
+
+        rv = self.make_request("get", "/api/queries/{}/results/{}.json".format(query.id, query_result.id))
+        self.assertEqual(rv.status_code, 200)
+        self.assertEqual(rv.json["query_result"]["id"], query_result.id)
+        self.assertEqual(rv.json["query_result"]["data"], data)
+
+    def test_returns_304_when_etag_matches(self):
+        query_result = self.factory.create_query_result()
+        query = self.factory.create_query(latest_query_data=query_result)
+        path = "/api/queries/{}/results/{}.json".format(query.id, query_result.id)
+
+        rv = self.make_request("get", path)
+        self.assertEqual(rv.headers["ETag"], '"{}"'.format(query_result.etag))
+
+        rv = self.client.get(
+            "/{}{}".format(self.factory.org.slug, path), headers={"If-None-Match": rv.headers["ETag"]}
+        )
+        self.assertEqual(rv.status_code, 304)
+        self.assertEqual(rv.data, b"")
+
+
 class TestQueryResultsContentDispositionHeaders(BaseTestCase):
     def test_supports_unicode(self):
         query_result = self.factory.create_query_result()
@@ -416,6 +454,19 @@ class TestQueryResultExcelResponse(BaseTestCase):
         )
         self.assertEqual(rv.status_code, 200)
 
+    def test_streams_excel_file(self):
+        query = self.factory.create_query()
+        query_result = self.factory.create_query_result()
+
+        rv = self.make_request(
+            "get",
+            "/api/queries/{}/results/{}.xlsx".format(query.id, query_result.id),
+            is_json=False,
+        )
+        self.assertEqual(rv.status_code, 200)
+        self.assertEqual(rv.data[:2], b"PK")
+        self.assertEqual(int(rv.headers["Content-Length"]), len(rv.data))
+
     def test_renders_excel_file_when_rows_have_missing_columns(self):
         query = self.factory.create_query()
         data = {
@@ -432,6 +483,97 @@ class TestQueryResultExcelResponse(BaseTestCase):
         self.assertEqual(rv.status_code, 200)
 
 
+class TestExportResource(BaseTestCase):
+    # Other tests leave jobs (e.g. record_event) in the default queue.
+    def setUp(self):
+        super().setUp()
+        Queue("default", connection=rq_redis_connection).empty()
+        self.directory = tempfile.TemporaryDirectory()
+        patcher = patch("redash.settings.EXPORTS_PATH", self.directory.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        Queue("default", connection=rq_redis_connection).empty()
+        self.directory.cleanup()
+        super().tearDown()
+
+    def request_pdf(self):
+        query = self.factory.create_query()
+        query_result = self.factory.create_query_result()
+
+        rv = self.make_request("get", "/api/queries/{}/results/{}.pdf".format(query.id, query_result.id))
+        self.assertEqual(rv.status_code, 202)
+        return rv.json["job"]["id"]
+
+    def test_renders_pdf_in_a_job(self):
+        export_id = self.request_pdf()
+
+        rv = self.make_request("get", "/api/exports/{}".format(export_id))
+        self.assertEqual(rv.status_code, 202)
+        self.assertEqual(rv.json["job"]["status"], 1)
+
+        work()
+
+        rv = self.make_request("get", "/api/exports/{}".format(export_id), is_json=False)
+        self.assertEqual(rv.status_code, 200)
+        self.assertEqual(rv.headers["Content-Type"], "application/pdf")
+        self.assertIn(".pdf", rv.headers["Content-Disposition"])
+        self.assertTrue(rv.data.startswith(b"%PDF"))
+
+    def test_serves_ranges(self):
+        export_id = self.request_pdf()
+        work()
+
+        rv = self.get_request(
+            "/api/exports/{}".format(export_id), org=self.factory.org, headers={"Range": "bytes=0-3"}
+        )
+        self.assertEqual(rv.status_code, 206)
+        self.assertEqual(rv.data, b"%PDF")
+
+    def test_downloads_run_the_query_and_render_the_file_in_jobs(self):
+        query = self.factory.create_query()
+
+        rv = self.make_request("post", "/api/queries/{}/download.csv".format(query.id), data={"parameters": {}})
+        self.assertEqual(rv.status_code, 202)
+        export = Job.fetch(rv.json["job"]["id"], connection=rq_redis_connection)
+        self.assertEqual(rv.json["job"]["status"], 6)  # deferred until the query job finishes
+
+        self.make_request("delete", "/api/jobs/{}".format(export.dependency.id))
+        work()
+
+        rv = self.make_request("get", "/api/exports/{}".format(export.id))
+        self.assertEqual(rv.status_code, 500)
+        self.assertEqual(rv.json["job"]["error"], "Query execution was cancelled.")
+
+    def test_rejects_unknown_file_types(self):
+        query = self.factory.create_query()
+
+        rv = self.make_request("post", "/api/queries/{}/download.html".format(query.id), data={"parameters": {}})
+        self.assertEqual(rv.status_code, 400)
+
+    def test_exports_are_not_shared_across_organizations(self):
+        export_id = self.request_pdf()
+        work()
+
+        other_org = self.factory.create_org()
+        other_user = self.factory.create_user(org=other_org)
+        rv = self.make_request("get", "/api/exports/{}".format(export_id), org=other_org, user=other_user)
+        self.assertEqual(rv.status_code, 404)
+
+    def test_expired_export(self):
+        export_id = self.request_pdf()
+        work()
+        os.remove(os.path.join(self.directory.name, export_id))
+
+        rv = self.make_request("get", "/api/exports/{}".format(export_id))
+        self.assertEqual(rv.status_code, 404)
+
+    def test_unknown_export(self):
+        rv = self.make_request("get", "/api/exports/nope")
+        self.assertEqual(rv.status_code, 404)
+
+
 class TestJobResource(BaseTestCase):
     def test_cancels_queued_queries(self):
         QUEUED = 1
@@ -454,3 +596,34 @@ class TestJobResource(BaseTestCase):
         job = self.make_request("get", f"/api/jobs/{job_id}").json["job"]
         self.assertEqual(job["status"], FAILED)
         self.assertTrue("cancelled" in job["error"])
+
+    def test_waits_for_the_job_to_be_done(self):
+        query = self.factory.create_query()
+        job_id = self.make_request("post", f"/api/queries/{query.id}/results", data={"parameters": {}}).json["job"][
+            "id"
+        ]
+        Job.fetch(job_id, connection=rq_redis_connection).cancel()
+
+        job = self.make_request("get", f"/api/jobs/{job_id}?wait=5").json["job"]
+        self.assertEqual(job["status"], 4)
+
+
+class TestJobEventsResource(BaseTestCase):
+    def test_streams_the_jobs_until_they_are_done(self):
+        query = self.factory.create_query()
+        job_id = self.make_request("post", f"/api/queries/{query.id}/results", data={"parameters": {}}).json["job"][
+            "id"
+        ]
+        Job.fetch(job_id, connection=rq_redis_connection).cancel()
+
+        response = self.make_request("get", f"/api/jobs/events?job_ids={job_id},missing")
+
+        self.assertEqual(response.mimetype, "text/event-stream")
+        events = response.get_data(as_text=True).split("\n\n")
+        self.assertTrue(events[0].startswith("event: job\ndata: "))
+        self.assertIn(job_id, events[0])
+        self.assertEqual(events[1], "event: done\ndata: {}")
+
+    def test_requires_job_ids(self):
+        response = self.make_request("get", "/api/jobs/events")
+        self.assertEqual(response.status_code, 400)
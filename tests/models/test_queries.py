@@ -3,7 +3,7 @@ import datetime
 import mock
 import pytest
 
-from redash.models import Event, Group, Query, QueryResult, db
+from redash.models import Event, Group, Query, QueryDependency, QueryResult, db
 from redash.utils import gen_query_hash, utcnow
 from tests import BaseTestCase
 
@@ -531,3 +531,72 @@ class TestQueryUpdateLatestResult(BaseTestCase):
         self.assertEqual(query1.latest_query_data, query_result)
         self.assertEqual(query2.latest_query_data, query_result)
         self.assertNotEqual(query3.latest_query_data, query_result)
+
+
+class TestQueryDependencies(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.results = self.factory.create_data_source(type="results")
+
+    def dependencies(self, query):
+        return {
+            (d.upstream_query_id, d.kind) for d in QueryDependency.query.filter(QueryDependency.query_id == query.id)
+        }
+
+    def test_records_the_queries_a_query_reads(self):
+        first, second, third, dropdown = [self.factory.create_query() for _ in range(4)]
+        other_org = self.factory.create_query(org=self.factory.create_org())
+        query = self.factory.create_query(
+            data_source=self.results,
+            query_text="SELECT * FROM query_{} JOIN param_query_{}_{{p=1}} JOIN cached_query_{} "
+            "JOIN query_{} JOIN query_999999".format(first.id, second.id, third.id, other_org.id),
+            options={"parameters": [{"name": "p", "type": "query", "queryId": dropdown.id}]},
+        )
+
+        self.assertEqual(
+            self.dependencies(query),
+            {
+                (first.id, QueryDependency.QUERY),
+                (second.id, QueryDependency.QUERY),
+                (third.id, QueryDependency.CACHED_QUERY),
+                (dropdown.id, QueryDependency.DROPDOWN),
+            },
+        )
+
+    def test_records_only_dropdowns_of_other_data_sources(self):
+        upstream = self.factory.create_query()
+        query = self.factory.create_query(query_text="SELECT * FROM query_{}".format(upstream.id))
+
+        self.assertEqual(self.dependencies(query), set())
+
+    def test_updates_the_dependencies_when_the_query_changes(self):
+        first, second = self.factory.create_query(), self.factory.create_query()
+        query = self.factory.create_query(
+            data_source=self.results, query_text="SELECT * FROM query_{}".format(first.id)
+        )
+
+        query.query_text = "SELECT * FROM cached_query_{}".format(second.id)
+        query.options["parameters"] = [{"name": "p", "type": "query", "queryId": first.id}]
+        db.session.flush()
+
+        self.assertEqual(
+            self.dependencies(query), {(second.id, QueryDependency.CACHED_QUERY), (first.id, QueryDependency.DROPDOWN)}
+        )
+
+    def test_walks_upstream_and_downstream(self):
+        source = self.factory.create_query()
+        middle = self.factory.create_query(
+            data_source=self.results, query_text="SELECT * FROM query_{}".format(source.id)
+        )
+        top = self.factory.create_query(
+            data_source=self.results, query_text="SELECT * FROM query_{}".format(middle.id)
+        )
+
+        self.assertEqual(
+            [(d.query_id, d.upstream_query_id, depth) for d, depth in QueryDependency.walk(top.id)],
+            [(top.id, middle.id, 1), (middle.id, source.id, 2)],
+        )
+        self.assertEqual(
+            [(d.query_id, depth) for d, depth in QueryDependency.walk(source.id, downstream=True, max_depth=1)],
+            [(middle.id, 1)],
+        )
@@ -1,7 +1,10 @@
 import datetime
+from unittest.mock import patch
 
 from redash import models
-from redash.utils import utcnow
+from redash.models import db
+from redash.tasks.queries.maintenance import cleanup_query_results
+from redash.utils import json_dumps, result_cache, utcnow
 from tests import BaseTestCase
 
 
@@ -73,3 +76,72 @@ class QueryResultTest(BaseTestCase):
         )
 
         self.assertEqual(original_updated_at, query.updated_at)
+
+    def test_reads_results_stored_as_json(self):
+        qr = self.factory.create_query_result()
+        data = {"columns": [{"name": "a", "type": "integer"}], "rows": [{"a": 1}]}
+        db.session.execute(
+            "UPDATE query_results SET data = convert_to(:data, 'UTF8') WHERE id = :id",
+            {"data": json_dumps(data), "id": qr.id},
+        )
+        db.session.commit()
+        db.session.expire_all()
+
+        qr = models.QueryResult.query.get(qr.id)
+        self.assertFalse(qr.payload.is_columnar)
+        self.assertEqual(qr.data, data)
+
+    def test_stores_results_in_columnar_format(self):
+        data = {"columns": [{"name": "a", "type": "integer"}], "rows": [{"a": 1}, {"a": 2}]}
+        qr = self.factory.create_query_result(data=data)
+        db.session.expire_all()
+
+        qr = models.QueryResult.query.get(qr.id)
+        self.assertTrue(qr.payload.is_columnar)
+        self.assertEqual(qr.data, data)
+
+    def test_records_data_size(self):
+        data = {"columns": [{"name": "a", "type": "integer"}], "rows": [{"a": 1}, {"a": 2}]}
+        qr = self.factory.create_query_result(data=data)
+        db.session.expire_all()
+
+        qr = models.QueryResult.query.get(qr.id)
+        self.assertEqual(qr.data_size, len(qr.payload.raw))
+
+
+@patch("redash.settings.QUERY_RESULTS_CACHE_SIZE", 1)
+class QueryResultCacheTest(BaseTestCase):
+    def test_reads_results_from_the_cache(self):
+        data = {"columns": [{"name": "a", "type": "integer"}], "rows": [{"a": 1}, {"a": 2}]}
+        qr = self.factory.create_query_result(data=data)
+        db.session.commit()
+        db.session.expunge_all()
+        models.QueryResult.get_by_id_and_org(qr.id, self.factory.org)
+        db.session.expunge_all()
+
+        with patch.object(models.BelongsToOrgMixin, "get_by_id_and_org") as get_by_id_and_org:
+            cached = models.QueryResult.get_by_id_and_org(qr.id, self.factory.org)
+
+        get_by_id_and_org.assert_not_called()
+        self.assertEqual(cached.data, data)
+        self.assertEqual(cached.data_size, qr.data_size)
+        self.assertEqual(cached.retrieved_at, qr.retrieved_at)
+        self.assertEqual(cached.data_source.id, qr.data_source_id)
+        self.assertEqual(result_cache.get_stats()["hits"], 1)
+
+    def test_doesnt_return_results_of_other_orgs(self):
+        qr = self.factory.create_query_result()
+        models.QueryResult.get_by_id_and_org(qr.id, self.factory.org)
+        db.session.expunge_all()
+
+        with self.assertRaises(models.NoResultFound):
+            models.QueryResult.get_by_id_and_org(qr.id, self.factory.create_org())
+
+    @patch("redash.settings.QUERY_RESULTS_CLEANUP_MAX_AGE", 0)
+    def test_cleanup_removes_results_from_the_cache(self):
+        qr = self.factory.create_query_result(retrieved_at=utcnow() - datetime.timedelta(days=1))
+        models.QueryResult.get_by_id_and_org(qr.id, self.factory.org)
+
+        cleanup_query_results()
+
+        self.assertIsNone(result_cache.get(qr.id))
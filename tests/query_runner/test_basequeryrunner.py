@@ -1,6 +1,17 @@
+import sqlite3
+import time
 import unittest
+from unittest.mock import patch
 
-from redash.query_runner import BaseQueryRunner
+import jsonschema
+
+from redash.query_runner import (
+    BaseQueryRunner,
+    ConnectionPool,
+    QueryRunnerError,
+    ResultBudget,
+    with_result_limits,
+)
 
 
 class TestBaseQueryRunner(unittest.TestCase):
@@ -29,6 +40,172 @@ class TestBaseQueryRunner(unittest.TestCase):
 
         self.assertEqual(new_columns, expected)
 
+    def test_fetch_batches(self):
+        cursor = sqlite3.connect(":memory:").execute(
+            "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 5) SELECT i FROM n"
+        )
+        columns = self.query_runner.fetch_columns([("i", None)])
+
+        batches = list(self.query_runner.fetch_batches(cursor, columns, batch_size=2))
+
+        self.assertEqual(batches, [[{"i": 1}, {"i": 2}], [{"i": 3}, {"i": 4}], [{"i": 5}]])
+
+    def test_stream_query_defaults_to_run_query(self):
+        data = {"columns": [{"name": "a", "friendly_name": "a", "type": None}], "rows": [{"a": 1}]}
+
+        with patch.object(BaseQueryRunner, "run_query", return_value=(data, None)):
+            self.assertEqual(list(self.query_runner.stream_query("SELECT 1", None)), [data["columns"], data["rows"]])
+
+        with patch.object(BaseQueryRunner, "run_query", return_value=(None, "broken")):
+            with self.assertRaises(QueryRunnerError):
+                list(self.query_runner.stream_query("SELECT 1", None))
+
+    def test_fetch_batches_stops_at_budget(self):
+        cursor = sqlite3.connect(":memory:").execute(
+            "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 5) SELECT i FROM n"
+        )
+        columns = self.query_runner.fetch_columns([("i", None)])
+        budget = ResultBudget(max_rows=3)
+
+        batches = list(self.query_runner.fetch_batches(cursor, columns, batch_size=2, budget=budget))
+
+        self.assertEqual(batches, [[{"i": 1}, {"i": 2}], [{"i": 3}]])
+        self.assertEqual(budget.metadata(), {"truncated": True, "row_count": 3})
+
+    def test_result_budget_uses_data_source_limits(self):
+        with patch("redash.settings.QUERY_RESULTS_MAX_ROWS", 100):
+            self.assertEqual(self.query_runner.result_budget().max_rows, 100)
+
+            query_runner = BaseQueryRunner({"result_max_rows": 10.0, "result_max_bytes": 0})
+            budget = query_runner.result_budget()
+            self.assertEqual(budget.max_rows, 10)
+            self.assertIsNone(budget.max_bytes)
+
+    def test_result_limits_are_configurable(self):
+        schema = with_result_limits({"type": "object", "properties": {}, "order": []})
+
+        self.assertEqual(schema["extra_options"], ["result_max_rows", "result_max_bytes"])
+        self.assertEqual(schema["order"], ["result_max_rows", "result_max_bytes"])
+        jsonschema.validate({"result_max_rows": 10}, schema)
+        with self.assertRaises(jsonschema.ValidationError):
+            jsonschema.validate({"result_max_rows": "10"}, schema)
+
+
+class TestResultBudget(unittest.TestCase):
+    def test_row_limit(self):
+        budget = ResultBudget(max_rows=3)
+
+        self.assertEqual(budget.fit([{"a": 1}, {"a": 2}]), [{"a": 1}, {"a": 2}])
+        self.assertFalse(budget.truncated)
+        self.assertEqual(budget.fit([{"a": 3}, {"a": 4}]), [{"a": 3}])
+        self.assertTrue(budget.truncated)
+        self.assertEqual(budget.fit([{"a": 5}]), [])
+        self.assertEqual(budget.metadata(), {"truncated": True, "row_count": 3})
+
+    def test_exact_fit_is_not_truncated(self):
+        budget = ResultBudget(max_rows=2)
+
+        budget.fit([{"a": 1}, {"a": 2}])
+
+        self.assertFalse(budget.truncated)
+        self.assertEqual(budget.metadata(), {})
+
+    def test_byte_limit(self):
+        budget = ResultBudget(max_bytes=25)
+
+        rows = [{"a": "x" * 10}, {"a": "y" * 10}, {"a": "z" * 10}]
+
+        self.assertEqual(budget.fit(rows), rows[:2])
+        self.assertTrue(budget.truncated)
+
+    def test_unlimited(self):
+        budget = ResultBudget(max_rows=0, max_bytes=None)
+        rows = [{"a": i} for i in range(1000)]
+
+        self.assertEqual(budget.fit(rows), rows)
+        self.assertFalse(budget.truncated)
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class TestConnectionPool(unittest.TestCase):
+    def test_reuses_released_connections(self):
+        pool = ConnectionPool(max_size=1, idle_timeout=60)
+
+        connection = pool.acquire(FakeConnection)
+        pool.release(connection)
+
+        self.assertIs(pool.acquire(FakeConnection), connection)
+        self.assertIsNot(pool.acquire(FakeConnection), connection)
+
+    def test_keeps_at_most_max_size_connections(self):
+        pool = ConnectionPool(max_size=1, idle_timeout=60)
+        first, second = pool.acquire(FakeConnection), pool.acquire(FakeConnection)
+
+        pool.release(first)
+        pool.release(second)
+
+        self.assertFalse(first.closed)
+        self.assertTrue(second.closed)
+
+    def test_closes_connections_without_max_size(self):
+        pool = ConnectionPool(max_size=0, idle_timeout=60)
+        connection = pool.acquire(FakeConnection)
+
+        pool.release(connection)
+
+        self.assertTrue(connection.closed)
+        self.assertTrue(pool.is_unused)
+
+    def test_discards_connections_that_are_not_reusable_or_fail_to_reset(self):
+        pool = ConnectionPool(max_size=2, idle_timeout=60, is_reusable=lambda c: not c.closed, reset=lambda c: 1 / 0)
+        connection = pool.acquire(FakeConnection)
+
+        pool.release(connection)
+
+        self.assertTrue(connection.closed)
+        self.assertIsNot(pool.acquire(FakeConnection), connection)
+
+    def test_evicts_idle_connections(self):
+        pool = ConnectionPool(max_size=1, idle_timeout=60)
+        connection = pool.acquire(FakeConnection)
+        pool.release(connection)
+
+        with patch("time.monotonic", return_value=time.monotonic() + 61):
+            pool.evict_expired()
+
+        self.assertTrue(connection.closed)
+        self.assertTrue(pool.is_unused)
+
+    def test_pings_connections_idle_for_a_while(self):
+        pings = []
+        pool = ConnectionPool(max_size=1, idle_timeout=600, ping=pings.append)
+        connection = pool.acquire(FakeConnection)
+        pool.release(connection)
+        self.assertIs(pool.acquire(FakeConnection), connection)
+        pool.release(connection)
+
+        with patch("time.monotonic", return_value=time.monotonic() + ConnectionPool.PING_AFTER):
+            self.assertIs(pool.acquire(FakeConnection), connection)
+
+        self.assertEqual(pings, [connection])
+
+    def test_ignores_connections_of_the_parent_process(self):
+        pool = ConnectionPool(max_size=1, idle_timeout=60)
+        connection = pool.acquire(FakeConnection)
+        pool.release(connection)
+
+        with patch("os.getpid", return_value=-1):
+            self.assertIsNot(pool.acquire(FakeConnection), connection)
+
+        self.assertFalse(connection.closed)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -1,6 +1,7 @@
 from unittest import TestCase
 from unittest.mock import patch
 
+from redash.query_runner import QueryRunnerError
 from redash.query_runner.duckdb import DuckDB
 
 
@@ -105,3 +106,20 @@ class TestDuckDBSchema(TestCase):
         with self.assertRaises(Exception) as ctx:
             self.runner.get_schema()
         self.assertIn("boom", str(ctx.exception))
+
+
+class TestDuckDBStreamQuery(TestCase):
+    def setUp(self) -> None:
+        self.runner = DuckDB({"dbpath": ":memory:"})
+
+    def test_streams_batches(self) -> None:
+        batches = self.runner.stream_query("SELECT range AS i FROM range(5)", None)
+
+        columns = next(batches)
+        self.assertEqual(columns, [{"name": "i", "friendly_name": "i", "type": "integer"}])
+        with patch("redash.settings.QUERY_RESULTS_STREAM_BATCH_SIZE", 2):
+            self.assertEqual([len(rows) for rows in batches], [2, 2, 1])
+
+    def test_error(self) -> None:
+        with self.assertRaises(QueryRunnerError):
+            list(self.runner.stream_query("SELECT * FROM missing_table", None))
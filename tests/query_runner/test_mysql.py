@@ -0,0 +1,66 @@
+from types import SimpleNamespace
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+from redash.query_runner import QueryRunnerError
+from redash.query_runner.mysql import Mysql
+
+
+class FakeMySQLError(Exception):
+    pass
+
+
+class FakeCursor:
+    def __init__(self, rows, fail_with=None):
+        self.description = [("id", 3)]
+        self.rows = rows
+        self.fail_with = fail_with
+
+    def execute(self, query):
+        pass
+
+    def fetchmany(self, size):
+        if self.fail_with is not None:
+            raise self.fail_with
+        rows, self.rows = self.rows[:size], self.rows[size:]
+        return rows
+
+    def close(self):
+        pass
+
+
+@patch("redash.query_runner.mysql.MySQLdb", SimpleNamespace(Error=FakeMySQLError, cursors=MagicMock()), create=True)
+class TestMysqlStreamQuery(TestCase):
+    def setUp(self):
+        self.runner = Mysql({"db": "test"})
+
+    def stream(self, cursor):
+        connection = MagicMock()
+        connection.cursor.return_value = cursor
+        with patch.object(Mysql, "_connection", return_value=connection), patch.object(Mysql, "_cancel"):
+            return list(self.runner.stream_query("SELECT id FROM t", None))
+
+    def test_streams_batches(self):
+        with patch("redash.settings.QUERY_RESULTS_STREAM_BATCH_SIZE", 2):
+            columns, *batches = self.stream(FakeCursor([(1,), (2,), (3,)]))
+
+        self.assertEqual(columns, [{"name": "id", "friendly_name": "id", "type": "integer"}])
+        self.assertEqual(batches, [[{"id": 1}, {"id": 2}], [{"id": 3}]])
+
+    def test_mysql_error(self):
+        with self.assertRaises(QueryRunnerError) as cm:
+            self.stream(FakeCursor([], fail_with=FakeMySQLError(1146, "Table 't' doesn't exist")))
+        self.assertEqual(str(cm.exception), "Table 't' doesn't exist")
+
+    def test_mysql_error_without_code(self):
+        with self.assertRaises(QueryRunnerError) as cm:
+            self.stream(FakeCursor([], fail_with=FakeMySQLError("connection lost")))
+        self.assertEqual(str(cm.exception), "connection lost")
+
+    def test_other_errors_are_raised(self):
+        with self.assertRaises(ValueError):
+            self.stream(FakeCursor([], fail_with=ValueError("unexpected")))
+
+    def test_reader_thread_dying_silently_doesnt_hang(self):
+        with patch.object(Mysql, "_stream_query"), self.assertRaises(QueryRunnerError):
+            self.stream(FakeCursor([(1,)]))
@@ -1,6 +1,11 @@
 from unittest import TestCase
+from unittest.mock import patch
 
-from redash.query_runner.pg import build_schema
+from sqlalchemy.engine.url import make_url
+
+from redash import settings
+from redash.query_runner import QueryRunnerError, close_connection_pools
+from redash.query_runner.pg import PostgreSQL, _server_side_statement, build_schema
 
 
 class TestBuildSchema(TestCase):
@@ -41,3 +46,99 @@ class TestBuildSchema(TestCase):
         self.assertListEqual(
             schema["main.users"]["columns"], [{"name": "id", "type": "integer"}, {"name": "name", "type": "varchar"}]
         )
+
+
+class TestServerSideStatement(TestCase):
+    def test_single_select_is_declared_as_cursor(self):
+        self.assertEqual(_server_side_statement("/* user */ SELECT 1; -- comment"), "/* user */ SELECT 1")
+        self.assertEqual(
+            _server_side_statement("WITH a AS (SELECT 1) SELECT * FROM a"), "WITH a AS (SELECT 1) SELECT * FROM a"
+        )
+
+    def test_other_statements_are_run_as_they_are(self):
+        self.assertIsNone(_server_side_statement("SELECT 1; SELECT 2"))
+        self.assertIsNone(_server_side_statement("SHOW server_version"))
+        self.assertIsNone(_server_side_statement("SELECT 1 INTO new_table"))
+        self.assertIsNone(_server_side_statement("INSERT INTO t VALUES (1) RETURNING *"))
+
+
+class TestPostgreSQLStreamQuery(TestCase):
+    def setUp(self):
+        url = make_url(settings.SQLALCHEMY_DATABASE_URI)
+        self.runner = PostgreSQL(
+            {
+                "host": url.host or "localhost",
+                "port": url.port or 5432,
+                "user": url.username or "postgres",
+                "password": url.password or "",
+                "dbname": url.database,
+            }
+        )
+
+    def test_streams_batches_from_server_side_cursor(self):
+        with patch("redash.settings.QUERY_RESULTS_STREAM_BATCH_SIZE", 2):
+            columns, *batches = self.runner.stream_query("SELECT generate_series(1, 5) AS i", None)
+
+        self.assertEqual(columns, [{"name": "i", "friendly_name": "i", "type": "integer"}])
+        self.assertEqual(batches, [[{"i": 1}, {"i": 2}], [{"i": 3}, {"i": 4}], [{"i": 5}]])
+
+    def test_streams_other_statements(self):
+        columns, *batches = self.runner.stream_query("SELECT 1 AS a; SELECT 2 AS b", None)
+
+        self.assertEqual([c["name"] for c in columns], ["b"])
+        self.assertEqual(batches, [[{"b": 2}]])
+
+    def test_error(self):
+        with self.assertRaises(QueryRunnerError):
+            list(self.runner.stream_query("SELECT * FROM missing_table", None))
+
+
+class TestPostgreSQLConnectionPool(TestCase):
+    def setUp(self):
+        url = make_url(settings.SQLALCHEMY_DATABASE_URI)
+        self.configuration = {
+            "host": url.host or "localhost",
+            "port": url.port or 5432,
+            "user": url.username or "postgres",
+            "password": url.password or "",
+            "dbname": url.database,
+        }
+
+    def tearDown(self):
+        close_connection_pools()
+
+    def backend_pid(self, configuration=None, query="SELECT pg_backend_pid() AS pid"):
+        runner = PostgreSQL(configuration or self.configuration)
+        data, error = runner.run_query(query, None)
+        self.assertIsNone(error)
+        return data["rows"][0]["pid"]
+
+    @patch("redash.settings.DATA_SOURCE_POOL_SIZE", 2)
+    def test_reuses_connections(self):
+        self.assertEqual(self.backend_pid(), self.backend_pid())
+
+    @patch("redash.settings.DATA_SOURCE_POOL_SIZE", 0)
+    def test_closes_connections_without_pool(self):
+        self.assertNotEqual(self.backend_pid(), self.backend_pid())
+
+    @patch("redash.settings.DATA_SOURCE_POOL_SIZE", 2)
+    def test_uses_new_connections_when_options_change(self):
+        pid = self.backend_pid()
+
+        self.assertNotEqual(pid, self.backend_pid(dict(self.configuration, sslmode="disable")))
+
+    @patch("redash.settings.DATA_SOURCE_POOL_SIZE", 2)
+    def test_resets_session_state(self):
+        self.backend_pid(query="SELECT set_config('application_name', 'leftover', false) AS pid")
+
+        runner = PostgreSQL(self.configuration)
+        data, _ = runner.run_query("SELECT current_setting('application_name') AS name", None)
+
+        self.assertNotEqual(data["rows"][0]["name"], "leftover")
+
+    @patch("redash.settings.DATA_SOURCE_POOL_SIZE", 2)
+    def test_reuses_connections_after_streaming(self):
+        runner = PostgreSQL(self.configuration)
+        columns, *batches = runner.stream_query("SELECT pg_backend_pid() AS pid", None)
+
+        self.assertEqual(batches[0][0]["pid"], self.backend_pid())
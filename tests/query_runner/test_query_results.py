@@ -1,26 +1,40 @@
 import datetime
 import decimal
 import sqlite3
+import threading
 from unittest import TestCase
 
 import mock
 import pytest
 
+from redash.query_runner.pg import PostgreSQL
 from redash.query_runner.query_results import (
     CreateTableError,
     PermissionError,
+    Results,
     _load_query,
+    create_duckdb_table,
+    create_indexes,
     create_table,
+    declared_types,
     extract_cached_query_ids,
+    extract_join_keys,
     extract_query_ids,
     extract_query_params,
     fix_column_name,
     get_query_results,
     prepare_parameterized_query,
     replace_query_parameters,
+    table_cache,
 )
+from redash.utils.result_storage import iter_json_columns
 from tests import BaseTestCase
 
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
 
 class TestExtractQueryIds(TestCase):
     def test_works_with_simple_query(self):
@@ -142,6 +156,266 @@ class TestCreateTable(TestCase):
         create_table(connection, table_name, results)
         self.assertEqual(len(list(connection.execute("SELECT * FROM query_123"))), 2)
 
+    def test_creates_typed_columns(self):
+        connection = sqlite3.connect(":memory:")
+        results = {
+            "columns": [
+                {"name": "id", "type": "integer"},
+                {"name": "amount", "type": "float"},
+                {"name": "name", "type": "string"},
+                {"name": "untyped"},
+            ],
+            "rows": [{"id": "1", "amount": 2, "name": 3, "untyped": "4"}],
+        }
+        create_table(connection, "query_123", results)
+
+        columns = [(row[1], row[2]) for row in connection.execute("PRAGMA table_info(query_123)")]
+        self.assertEqual(columns, [("id", "INTEGER"), ("amount", "REAL"), ("name", "TEXT"), ("untyped", "")])
+        self.assertEqual(list(connection.execute("SELECT * FROM query_123")), [(1, 2.0, "3", "4")])
+
+
+class TestCreateIndexes(TestCase):
+    def test_indexes_the_join_keys(self):
+        connection = sqlite3.connect(":memory:")
+        results = {"columns": [{"name": "id"}, {"name": "user id"}, {"name": "name"}], "rows": []}
+        create_table(connection, "query_123", results)
+
+        create_indexes(connection, "query_123", {"id", "user_id", "other"})
+
+        columns = sorted(
+            column[2]
+            for index in connection.execute("PRAGMA index_list(query_123)").fetchall()
+            for column in connection.execute('PRAGMA index_info("{}")'.format(index[1]))
+        )
+        self.assertEqual(columns, ["id", "user_id"])
+
+
+class TestExtractJoinKeys(TestCase):
+    def test_finds_compared_and_using_columns(self):
+        query = (
+            'SELECT * FROM query_1 a JOIN query_2 b ON a.id = b."user id" '
+            "JOIN query_3 USING (org_id, name) WHERE a.amount >= 5"
+        )
+        self.assertEqual(extract_join_keys(query), {"id", "user id", "org_id", "name"})
+
+
+class TestDeclaredTypes(TestCase):
+    def test_returns_the_types_of_columns(self):
+        connection = sqlite3.connect(":memory:")
+        connection.execute("CREATE TABLE query_1 (id INTEGER, name TEXT, at DATETIME)")
+
+        self.assertEqual(
+            declared_types(connection, "SELECT id, name, at, count(*) FROM query_1"),
+            ["integer", "string", "datetime", None],
+        )
+
+    def test_returns_none_for_other_statements(self):
+        connection = sqlite3.connect(":memory:")
+        self.assertIsNone(declared_types(connection, "PRAGMA table_info(query_1)"))
+
+
+class TestRunQuery(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.runner = Results({})
+        table_cache.clear()
+
+    def tearDown(self):
+        table_cache.clear()
+        super().tearDown()
+
+    def create_cached_query(self, rows):
+        data = {
+            "columns": [{"name": "id", "type": "integer"}, {"name": "name", "type": "string"}],
+            "rows": rows,
+        }
+        query_result = self.factory.create_query_result(data=data)
+        return self.factory.create_query(latest_query_data=query_result)
+
+    def test_types_columns_by_declaration_then_by_value(self):
+        query = self.create_cached_query([{"id": 1, "name": "1"}])
+
+        data, error = self.runner.run_query(
+            "SELECT id, name, id * 1.5 AS half FROM cached_query_{}".format(query.id), self.factory.user
+        )
+
+        self.assertIsNone(error)
+        self.assertEqual([c["type"] for c in data["columns"]], ["integer", "string", "float"])
+        self.assertEqual(data["rows"], [{"id": 1, "name": "1", "half": 1.5}])
+
+    @mock.patch("redash.settings.QUERY_RESULTS_RUNNER_CACHE_TABLES", 2)
+    def test_keeps_cached_query_tables_for_the_next_queries(self):
+        first = self.create_cached_query([{"id": 1, "name": "a"}])
+        second = self.create_cached_query([{"id": 1, "name": "b"}])
+        query = "SELECT a.name, b.name AS other FROM cached_query_{} a JOIN cached_query_{} b ON a.id = b.id".format(
+            first.id, second.id
+        )
+
+        with mock.patch(
+            "redash.query_runner.query_results.get_query_results", wraps=get_query_results
+        ) as loaded_results:
+            self.runner.run_query(query, self.factory.user)
+            data, error = self.runner.run_query(query, self.factory.user)
+
+        self.assertIsNone(error)
+        self.assertEqual(data["rows"], [{"name": "a", "other": "b"}])
+        self.assertEqual(loaded_results.call_count, 2)
+
+    @mock.patch("redash.settings.QUERY_RESULTS_RUNNER_CACHE_TABLES", 1)
+    def test_doesnt_evict_tables_the_query_uses(self):
+        first = self.create_cached_query([{"id": 1, "name": "a"}])
+        second = self.create_cached_query([{"id": 1, "name": "b"}])
+        query = "SELECT a.name, b.name AS other FROM cached_query_{} a JOIN cached_query_{} b ON a.id = b.id".format(
+            first.id, second.id
+        )
+
+        data, error = self.runner.run_query(query, self.factory.user)
+
+        self.assertIsNone(error)
+        self.assertEqual(data["rows"], [{"name": "a", "other": "b"}])
+
+    def test_runs_upstream_queries_at_the_same_time(self):
+        first = self.factory.create_query(query_text="SELECT 1")
+        second = self.factory.create_query(query_text="SELECT 2")
+        cached = self.create_cached_query([{"id": 1, "name": "a"}])
+        both_running = threading.Barrier(2, timeout=5)
+
+        def run_query(query_text, user):
+            # Only returns once the other query runs too.
+            both_running.wait()
+            return {"columns": [{"name": "id", "type": "integer"}], "rows": [{"id": 1}]}, None
+
+        query = "SELECT c.name FROM query_{} a JOIN query_{} b ON a.id = b.id JOIN cached_query_{} c ON a.id = c.id"
+
+        with mock.patch.object(PostgreSQL, "run_query", side_effect=run_query):
+            data, error = self.runner.run_query(query.format(first.id, second.id, cached.id), self.factory.user)
+
+        self.assertIsNone(error)
+        self.assertEqual(data["rows"], [{"name": "a"}])
+        dependencies = sorted(data["metadata"]["dependencies"], key=lambda d: d["table"])
+        self.assertEqual(
+            [(d["table"], d["query_id"], d["cached"]) for d in dependencies],
+            [
+                ("cached_query_{}".format(cached.id), cached.id, True),
+                ("query_{}".format(first.id), first.id, False),
+                ("query_{}".format(second.id), second.id, False),
+            ],
+        )
+        self.assertTrue(all(d["runtime"] >= 0 for d in dependencies))
+
+    def test_fails_when_an_upstream_query_fails(self):
+        first = self.factory.create_query(query_text="SELECT 1")
+        second = self.factory.create_query(query_text="SELECT 2")
+
+        def run_query(query_text, user):
+            if query_text == "SELECT 2":
+                return None, "failed"
+            return {"columns": [{"name": "id", "type": "integer"}], "rows": [{"id": 1}]}, None
+
+        with mock.patch.object(PostgreSQL, "run_query", side_effect=run_query):
+            with pytest.raises(Exception, match="Failed loading results for query id {}".format(second.id)):
+                self.runner.run_query(
+                    "SELECT * FROM query_{} a JOIN query_{} b ON a.id = b.id".format(first.id, second.id),
+                    self.factory.user,
+                )
+
+
+@pytest.mark.skipif(duckdb is None, reason="duckdb is not installed")
+class TestCreateDuckDBTable(TestCase):
+    def create_table(self, results):
+        connection = duckdb.connect(":memory:")
+        connection.execute("SET TimeZone = 'UTC'")
+        names = [column["name"] for column in results["columns"]]
+        create_duckdb_table(connection, "query_1", results["columns"], iter_json_columns(names, results["rows"], 2))
+        return connection
+
+    def test_creates_typed_columns(self):
+        results = {
+            "columns": [
+                {"name": "id", "type": "integer"},
+                {"name": "a:b", "type": "string"},
+                {"name": "at", "type": "datetime"},
+            ],
+            "rows": [
+                {"id": 1, "a:b": "x", "at": "2024-01-01T12:00:00+02:00"},
+                {"id": 2, "a:b": None, "at": None},
+                {"id": 3, "a:b": "z", "at": "2024-01-02T00:00:00"},
+            ],
+        }
+        connection = self.create_table(results)
+
+        types = [(row[0], row[1]) for row in connection.execute("DESCRIBE query_1").fetchall()]
+        self.assertEqual(types, [("id", "BIGINT"), ("a_b", "VARCHAR"), ("at", "TIMESTAMP WITH TIME ZONE")])
+        rows = connection.execute('SELECT id, a_b, epoch("at") FROM query_1 ORDER BY id').fetchall()
+        self.assertEqual(rows, [(1, "x", 1704103200.0), (2, None, None), (3, "z", 1704153600.0)])
+
+    def test_detects_types_of_untyped_or_mismatched_columns(self):
+        results = {
+            "columns": [{"name": "id", "type": "integer"}, {"name": "value"}],
+            "rows": [{"id": 1, "value": 1.5}, {"id": "two", "value": 2}],
+        }
+        connection = self.create_table(results)
+
+        self.assertEqual(
+            connection.execute("SELECT DISTINCT typeof(id), typeof(value) FROM query_1").fetchall(),
+            [("JSON", "DOUBLE")],
+        )
+
+    def test_creates_empty_table(self):
+        connection = self.create_table({"columns": [{"name": "id", "type": "integer"}, {"name": "value"}], "rows": []})
+
+        self.assertEqual(connection.execute("SELECT count(*) FROM query_1").fetchone(), (0,))
+
+    def test_shows_meaningful_error_on_failure_to_create_table(self):
+        with pytest.raises(CreateTableError):
+            self.create_table({"columns": [], "rows": []})
+
+
+@pytest.mark.skipif(duckdb is None, reason="duckdb is not installed")
+class TestRunDuckDBQuery(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.runner = Results({"engine": "duckdb"})
+
+    def test_joins_and_groups_cached_results(self):
+        columns = [{"name": "id", "type": "integer"}, {"name": "name", "type": "string"}]
+        first = self.factory.create_query(
+            latest_query_data=self.factory.create_query_result(
+                data={"columns": columns, "rows": [{"id": 1, "name": "a"}, {"id": 2, "name": "b"}]}
+            )
+        )
+        second = self.factory.create_query(
+            latest_query_data=self.factory.create_query_result(
+                data={"columns": columns, "rows": [{"id": 1, "name": "c"}, {"id": 1, "name": "d"}]}
+            )
+        )
+        query = (
+            "SELECT a.name, count(*) AS matches FROM cached_query_{} a JOIN cached_query_{} b ON a.id = b.id "
+            "GROUP BY a.name".format(first.id, second.id)
+        )
+
+        data, error = self.runner.run_query(query, self.factory.user)
+
+        self.assertIsNone(error)
+        self.assertEqual([c["type"] for c in data["columns"]], ["string", "integer"])
+        self.assertEqual(data["rows"], [{"name": "a", "matches": 2}])
+
+    def test_loads_query_and_param_query_tables(self):
+        query = self.factory.create_query(query_text="SELECT {{n}} AS n")
+        results = {"columns": [{"name": "n", "type": "integer"}], "rows": [{"n": 3}]}
+
+        with mock.patch.object(PostgreSQL, "run_query", return_value=(results, None)) as loaded:
+            data, error = self.runner.run_query(
+                "SELECT q.n + p.n AS total FROM query_{0} q JOIN param_query_{0}_{{n=3}} p ON q.n = p.n".format(
+                    query.id
+                ),
+                self.factory.user,
+            )
+
+        self.assertIsNone(error)
+        self.assertEqual(loaded.call_count, 2)
+        self.assertEqual(data["rows"], [{"total": 6}])
+
 
 class TestGetQuery(BaseTestCase):
     # test query from different account
@@ -242,8 +516,6 @@ class TestGetQueryResult(BaseTestCase):
         query_result = self.factory.create_query_result()
         query = self.factory.create_query(latest_query_data=query_result)
 
-        from redash.query_runner.pg import PostgreSQL
-
         with mock.patch.object(PostgreSQL, "run_query") as qr:
             query_result_data = {"columns": [], "rows": []}
             qr.return_value = (query_result_data, None)
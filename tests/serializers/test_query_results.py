@@ -1,10 +1,20 @@
 import csv
 import io
+import re
+import zipfile
+import zlib
+from unittest.mock import patch
+
+from fpdf import FPDF
 
 from redash.serializers import (
     serialize_query_result,
     serialize_query_result_to_dsv,
+    serialize_query_result_to_pdf,
+    serialize_query_result_to_xlsx,
+    stream_query_result_to_dsv,
 )
+from redash.serializers.query_result import PDF_DATA_FONT, _PdfFontMetrics
 from tests import BaseTestCase
 
 data = {
@@ -79,3 +89,105 @@ class DsvSerializationTest(BaseTestCase):
         self.assertEqual(rows[1]["bool"], "false")
         self.assertEqual(rows[2]["date"], "")
         self.assertEqual(rows[3]["datetime"], "459")
+
+    def test_streams_in_chunks(self):
+        rows = [{"bool": i % 2 == 0, "datetime": "2019-05-26T12:39:23.026Z", "date": "2019-05-26"} for i in range(100)]
+        query_result = self.factory.create_query_result(data={"columns": data["columns"], "rows": rows})
+
+        with self.app.test_request_context("/"), patch("redash.serializers.query_result.DSV_CHUNK_SIZE", 100):
+            chunks = list(stream_query_result_to_dsv(query_result, ","))
+            content = serialize_query_result_to_dsv(query_result, ",")
+
+        self.assertGreater(len(chunks), 10)
+        self.assertEqual("".join(chunks), content)
+        parsed = list(csv.DictReader(io.StringIO(content)))
+        self.assertEqual(len(parsed), 100)
+        self.assertEqual(parsed[99], {"bool": "false", "datetime": "26/05/19 12:39", "date": "26/05/19"})
+
+    def test_serializes_columns_missing_from_rows(self):
+        query_result = self.factory.create_query_result(
+            data={"columns": [{"name": "a", "type": None}, {"name": "b", "type": "boolean"}], "rows": [{"a": 1}]}
+        )
+        with self.app.test_request_context("/"):
+            content = serialize_query_result_to_dsv(query_result, ",")
+
+        self.assertEqual(content, "a,b\r\n1,\r\n")
+
+
+class XlsxSerializationTest(BaseTestCase):
+    def cells(self, data):
+        query_result = self.factory.create_query_result(data=data)
+        workbook = zipfile.ZipFile(io.BytesIO(serialize_query_result_to_xlsx(query_result)))
+        sheet = workbook.read("xl/worksheets/sheet1.xml").decode("utf-8")
+        return {ref: attributes for ref, attributes in re.findall(r'<c r="([A-Z]+[0-9]+)"([^>]*)>', sheet)}
+
+    def test_writes_cells_by_column_type(self):
+        cells = self.cells(
+            {
+                "columns": [
+                    {"name": "number", "type": "integer"},
+                    {"name": "datetime", "type": "datetime"},
+                    {"name": "bool", "type": "boolean"},
+                    {"name": "string", "type": "string"},
+                ],
+                "rows": [{"number": 1, "datetime": "2019-05-26T12:39:23.026Z", "bool": True, "string": 2}],
+            }
+        )
+
+        self.assertEqual(cells["A2"], "")
+        self.assertIn("s=", cells["B2"])
+        self.assertEqual(cells["C2"], ' t="b"')
+        self.assertEqual(cells["D2"], ' t="inlineStr"')
+
+    def test_writes_unexpected_values_as_they_are(self):
+        cells = self.cells(
+            {
+                "columns": [{"name": "number", "type": "integer"}, {"name": "datetime", "type": "datetime"}],
+                "rows": [{"number": "n/a", "datetime": "not a date"}, {"number": None}],
+            }
+        )
+
+        self.assertEqual(cells["A2"], ' t="inlineStr"')
+        self.assertEqual(cells["B2"], ' t="inlineStr"')
+        self.assertNotIn("A3", cells)
+
+
+class PdfSerializationTest(BaseTestCase):
+    def text(self, query_result, **kwargs):
+        content = serialize_query_result_to_pdf(query_result, **kwargs)
+        self.assertTrue(content.startswith(b"%PDF"))
+        streams = re.findall(rb"stream\n(.*?)endstream", content, re.DOTALL)
+        return b"".join(zlib.decompress(stream) for stream in streams).decode("latin-1")
+
+    def test_wraps_values_into_three_lines_at_most(self):
+        metrics = _PdfFontMetrics(FPDF("L"), PDF_DATA_FONT)
+        width = metrics.widths["a"] * 10
+
+        self.assertEqual(metrics.wrap("a" * 10, width), ["a" * 10])
+        self.assertEqual(metrics.wrap("a" * 15, width), ["a" * 10, "a" * 5])
+        lines = metrics.wrap("a" * 100, width)
+        self.assertEqual(lines[:2], ["a" * 10, "a" * 10])
+        self.assertTrue(lines[2].endswith("..."))
+        self.assertLessEqual(sum(metrics.widths[char] for char in lines[2]), width)
+
+    def test_wraps_characters_wider_than_the_cell(self):
+        metrics = _PdfFontMetrics(FPDF("L"), PDF_DATA_FONT)
+
+        self.assertEqual(metrics.wrap("WW", metrics.widths["W"] / 2, max_lines=2), ["W", "W"])
+
+    def test_limits_rows(self):
+        query_result = self.factory.create_query_result(
+            data={"columns": [{"name": "id", "type": "integer"}], "rows": [{"id": i} for i in range(5)]}
+        )
+
+        text = self.text(query_result, max_rows=2)
+
+        self.assertIn("Showing the first 2 of 5 rows.", text)
+        self.assertNotIn("Showing", self.text(query_result, max_rows=0))
+
+    def test_renders_characters_outside_latin1(self):
+        query_result = self.factory.create_query_result(
+            data={"columns": [{"name": "name", "type": "string"}], "rows": [{"name": "caf\u00e9 \u4e16"}]}
+        )
+
+        self.assertIn("(caf\u00e9 ?)", self.text(query_result))
@@ -0,0 +1,93 @@
+import os
+import tempfile
+
+from mock import patch
+from rq import SimpleWorker
+from rq.job import JobStatus
+
+from redash import rq_redis_connection
+from redash.tasks import Job, Queue, enqueue_export
+from tests import BaseTestCase
+
+
+def work():
+    SimpleWorker(["default"], connection=rq_redis_connection, queue_class=Queue, job_class=Job).work(burst=True)
+
+
+def query_job_result(result):
+    return result
+
+
+class TestExports(BaseTestCase):
+    # Other tests leave jobs (e.g. record_event) in the default queue.
+    def setUp(self):
+        super().setUp()
+        Queue("default", connection=rq_redis_connection).empty()
+        self.directory = tempfile.TemporaryDirectory()
+        patcher = patch("redash.settings.EXPORTS_PATH", self.directory.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        Queue("default", connection=rq_redis_connection).empty()
+        self.directory.cleanup()
+        super().tearDown()
+
+    def read_export(self, job):
+        with open(os.path.join(self.directory.name, job.id), "rb") as f:
+            return f.read()
+
+    def query_job(self, result):
+        queue = Queue("default", connection=rq_redis_connection)
+        return queue.enqueue(query_job_result, result)
+
+    def test_renders_query_result(self):
+        query_result = self.factory.create_query_result(
+            data={"columns": [{"name": "id", "type": "integer"}], "rows": [{"id": 1}, {"id": 2}]}
+        )
+
+        job = enqueue_export("csv", query_result.data_source, query_result=query_result)
+        work()
+
+        self.assertEqual(job.get_status(refresh=True), JobStatus.FINISHED)
+        self.assertEqual(self.read_export(job), b"id\r\n1\r\n2\r\n")
+
+    def test_renders_pdf(self):
+        query_result = self.factory.create_query_result()
+
+        job = enqueue_export("pdf", query_result.data_source, query_result=query_result)
+        work()
+
+        self.assertTrue(self.read_export(job).startswith(b"%PDF"))
+
+    def test_renders_the_result_of_the_query_job(self):
+        query_result = self.factory.create_query_result()
+        query_job = self.query_job(query_result.id)
+
+        job = enqueue_export("xlsx", query_result.data_source, query_job=query_job)
+        self.assertEqual(job.get_status(), JobStatus.DEFERRED)
+        work()
+
+        job.refresh()
+        self.assertEqual(job.get_status(), JobStatus.FINISHED)
+        self.assertEqual(job.meta["query_result_id"], query_result.id)
+        self.assertEqual(self.read_export(job)[:2], b"PK")
+
+    def test_reports_query_errors(self):
+        query_job = self.query_job(ValueError("relation does not exist"))
+
+        job = enqueue_export("csv", self.factory.data_source, query_job=query_job)
+        work()
+
+        job.refresh()
+        self.assertEqual(job.result, {"error": "relation does not exist"})
+        self.assertFalse(os.listdir(self.directory.name))
+
+    def test_reports_cancelled_queries(self):
+        query_job = self.query_job(1)
+        job = enqueue_export("csv", self.factory.data_source, query_job=query_job)
+
+        query_job.cancel(enqueue_dependents=True)
+        work()
+
+        self.assertEqual(job.latest_result().return_value, {"error": "Query execution was cancelled."})
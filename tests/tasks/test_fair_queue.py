@@ -0,0 +1,111 @@
+from mock import patch
+from rq.exceptions import DequeueTimeout
+
+from redash import rq_redis_connection
+from redash.tasks import Queue
+from redash.tasks.fair_queue import release
+from tests import BaseTestCase
+
+
+class TestFairQueue(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.queue = Queue("queries", connection=rq_redis_connection)
+        self.queue.empty()
+
+    def tearDown(self):
+        self.queue.empty()
+        for key in rq_redis_connection.scan_iter("fair_queue:*"):
+            rq_redis_connection.delete(key)
+        super().tearDown()
+
+    def enqueue(self, data_source_id=None, org_id=1, priority=None, **limits):
+        meta = {}
+        if data_source_id is not None:
+            meta = {"data_source_id": data_source_id, "org_id": org_id, "limits": limits}
+        if priority is not None:
+            meta["priority"] = priority
+        return self.queue.enqueue("redash.tasks.general.version_check", meta=meta)
+
+    def dequeue(self):
+        result = Queue.dequeue_any([self.queue], None, connection=rq_redis_connection)
+        return result[0].id if result else None
+
+    def test_takes_jobs_without_data_source_in_order(self):
+        jobs = [self.enqueue(), self.enqueue()]
+
+        self.assertEqual([self.dequeue(), self.dequeue(), self.dequeue()], [jobs[0].id, jobs[1].id, None])
+
+    def test_holds_back_jobs_over_the_concurrency_limit(self):
+        first = self.enqueue(1, max_concurrent=1)
+        second = self.enqueue(1, max_concurrent=1)
+        other = self.enqueue(2)
+
+        self.assertEqual(self.dequeue(), first.id)
+        self.assertEqual(self.dequeue(), other.id)
+        self.assertIsNone(self.dequeue())
+
+        release(first, rq_redis_connection)
+
+        self.assertEqual(self.dequeue(), second.id)
+
+    def test_holds_back_jobs_over_the_rate_limit(self):
+        first = self.enqueue(1, rate=6)
+        self.enqueue(1, rate=6)
+
+        self.assertEqual(self.dequeue(), first.id)
+        self.assertIsNone(self.dequeue())
+        self.assertEqual(self.queue.count, 1)
+
+    def test_shares_workers_across_data_sources(self):
+        busy = [self.enqueue(1) for _ in range(3)]
+        quiet = self.enqueue(2)
+
+        self.assertEqual([self.dequeue() for _ in range(3)], [busy[0].id, quiet.id, busy[1].id])
+
+    def test_shares_workers_by_weight(self):
+        heavy = [self.enqueue(1, weight=2) for _ in range(3)]
+        light = [self.enqueue(2) for _ in range(2)]
+
+        self.assertEqual([self.dequeue() for _ in range(4)], [heavy[0].id, light[0].id, heavy[1].id, heavy[2].id])
+
+    def test_shares_workers_across_orgs(self):
+        first_org = [self.enqueue(1, org_id=1), self.enqueue(2, org_id=1)]
+        second_org = self.enqueue(3, org_id=2)
+
+        self.assertEqual([self.dequeue() for _ in range(2)], [first_org[0].id, second_org.id])
+
+    def test_takes_jobs_by_priority(self):
+        bulk = [self.enqueue(1, priority=1) for _ in range(2)]
+        interactive = self.enqueue(2, priority=0)
+
+        self.assertEqual([self.dequeue() for _ in range(3)], [interactive.id, bulk[0].id, bulk[1].id])
+        self.assertEqual(rq_redis_connection.zcard(self.queue.priorities_key), 0)
+
+    @patch("redash.settings.QUEUE_FAIR_DEQUEUE_WINDOW", 2)
+    def test_takes_urgent_jobs_beyond_the_window(self):
+        bulk = [self.enqueue(1, priority=1) for _ in range(3)]
+        interactive = self.enqueue(1, priority=0)
+
+        self.assertEqual([self.dequeue() for _ in range(2)], [interactive.id, bulk[0].id])
+
+    def test_skips_jobs_removed_from_the_queue(self):
+        cancelled = self.enqueue(1, priority=0)
+        other = self.enqueue(1, priority=1)
+        self.queue.remove(cancelled)
+
+        self.assertEqual([self.dequeue(), self.dequeue()], [other.id, None])
+        self.assertEqual(rq_redis_connection.zcard(self.queue.priorities_key), 0)
+
+    @patch("redash.settings.QUEUE_LIMITS_POLL_INTERVAL", 0.01)
+    def test_times_out_when_every_job_is_held_back(self):
+        self.enqueue(1, max_concurrent=1)
+        self.enqueue(1, max_concurrent=1)
+        self.dequeue()
+
+        with self.assertRaises(DequeueTimeout):
+            Queue.dequeue_any([self.queue], 1, connection=rq_redis_connection)
+
+    def test_waits_for_jobs_when_empty(self):
+        with self.assertRaises(DequeueTimeout):
+            Queue.dequeue_any([self.queue], 1, connection=rq_redis_connection)
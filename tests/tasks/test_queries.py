@@ -1,15 +1,21 @@
 from mock import Mock, patch
 from rq import Connection
 from rq.exceptions import NoSuchJobError
+from rq.job import JobStatus
 
-from redash import models, rq_redis_connection
+from redash import models, redis_connection, rq_redis_connection
+from redash.query_runner import BaseQueryRunner, QueryRunnerError
 from redash.query_runner.pg import PostgreSQL
-from redash.tasks import Job
+from redash.tasks import Job, Queue
 from redash.tasks.queries.execution import (
     QueryExecutionError,
+    _job_lock_id,
     enqueue_query,
+    enqueue_scheduled_queries,
     execute_query,
 )
+from redash.tasks.queries.maintenance import remove_ghost_locks
+from redash.utils import gen_query_hash
 from tests import BaseTestCase
 
 
@@ -140,6 +146,21 @@ class TestEnqueueTask(BaseTestCase):
         _, kwargs = enqueue.call_args
         self.assertEqual(60, kwargs.get("job_timeout"))
 
+    def test_sets_priority(self, enqueue, _):
+        query = self.factory.create_query()
+
+        with Connection(rq_redis_connection):
+            enqueue_query(query.query_text, query.data_source, query.user_id, False, None, {"query_id": query.id})
+            enqueue_query(query.query_text + "2", query.data_source, query.api_key, True, None, {})
+            enqueue_query(
+                query.query_text + "3", query.data_source, query.user_id, metadata={}, priority_class="download"
+            )
+
+        priorities = [
+            (kwargs["meta"]["priority_class"], kwargs["meta"]["priority"]) for _, kwargs in enqueue.call_args_list
+        ]
+        self.assertEqual([("interactive", 0), ("api", 1), ("download", 2)], priorities)
+
     def test_multiple_enqueue_of_different_query(self, enqueue, _):
         query = self.factory.create_query()
 
@@ -172,7 +193,102 @@ class TestEnqueueTask(BaseTestCase):
         self.assertEqual(3, enqueue.call_count)
 
 
+class TestEnqueueScheduledQueries(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.queue = Queue("scheduled_queries", connection=rq_redis_connection)
+        self.queue.empty()
+
+    def tearDown(self):
+        self.queue.empty()
+        super().tearDown()
+
+    def batch(self, *queries):
+        return [(query.query_text, query, {"Username": "Arik", "query_id": query.id}) for query in queries]
+
+    def test_enqueues_each_query_once(self):
+        query = self.factory.create_query()
+        same_query = self.factory.create_query(data_source=query.data_source)
+        other_query = self.factory.create_query(query_text="SELECT 2", data_source=query.data_source)
+
+        jobs = enqueue_scheduled_queries(self.batch(query, same_query, other_query))
+
+        self.assertEqual(2, self.queue.count)
+        self.assertEqual(jobs[0].id, jobs[1].id)
+        self.assertNotEqual(jobs[0].id, jobs[2].id)
+        self.assertEqual(
+            {"query_id": query.id, "scheduled": True}, {k: jobs[0].meta[k] for k in ("query_id", "scheduled")}
+        )
+        self.assertEqual(query.id, jobs[0].kwargs["scheduled_query_id"])
+
+        jobs_again = enqueue_scheduled_queries(self.batch(query, other_query))
+
+        self.assertEqual(2, self.queue.count)
+        self.assertEqual([jobs[0].id, jobs[2].id], [job.id for job in jobs_again])
+
+    def test_reenqueues_when_job_is_done(self):
+        query = self.factory.create_query()
+        job = enqueue_scheduled_queries(self.batch(query))[0]
+        job.set_status(JobStatus.FINISHED)
+
+        new_job = enqueue_scheduled_queries(self.batch(query))[0]
+
+        self.assertNotEqual(job.id, new_job.id)
+
+    def test_reenqueues_when_job_expired(self):
+        query = self.factory.create_query()
+        job = enqueue_scheduled_queries(self.batch(query))[0]
+        job.delete()
+
+        new_job = enqueue_scheduled_queries(self.batch(query))[0]
+
+        self.assertNotEqual(job.id, new_job.id)
+        self.assertEqual(1, self.queue.count)
+
+    @patch("redash.settings.dynamic_settings.query_time_limit", return_value=60)
+    def test_limits_query_time(self, _):
+        query = self.factory.create_query()
+
+        job = enqueue_scheduled_queries(self.batch(query))[0]
+
+        self.assertEqual(60, job.timeout)
+
+    @patch("redash.settings.dynamic_settings.query_priority", return_value=5)
+    def test_sets_priority(self, _):
+        query = self.factory.create_query()
+
+        job = enqueue_scheduled_queries(self.batch(query))[0]
+
+        self.assertEqual(("scheduled", 5), (job.meta["priority_class"], job.meta["priority"]))
+        self.assertEqual(1, rq_redis_connection.zcard(self.queue.priorities_key))
+
+
+class TestRemoveGhostLocks(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.queue = Queue("queries", connection=rq_redis_connection)
+        self.queue.empty()
+
+    def tearDown(self):
+        self.queue.empty()
+        super().tearDown()
+
+    def test_removes_locks_of_jobs_that_are_done_or_gone(self):
+        queued = self.queue.enqueue("os.getpid")
+        finished = self.queue.enqueue("os.getpid")
+        finished.set_status(JobStatus.FINISHED)
+        redis_connection.set("query_hash_job:1:queued", queued.id)
+        redis_connection.set("query_hash_job:1:finished", finished.id)
+        redis_connection.set("query_hash_job:1:gone", "missing")
+
+        with patch("redash.tasks.queries.maintenance.GHOST_LOCKS_BATCH_SIZE", 2):
+            remove_ghost_locks()
+
+        self.assertEqual(["query_hash_job:1:queued"], [key for key in redis_connection.scan_iter("query_hash_job:*")])
+
+
 @patch("redash.tasks.queries.execution.get_current_job", side_effect=fetch_job)
+@patch.object(PostgreSQL, "supports_streaming", False)
 class QueryExecutorTests(BaseTestCase):
     def test_success(self, _):
         """
@@ -186,6 +302,36 @@ class QueryExecutorTests(BaseTestCase):
             result = models.QueryResult.query.get(result_id)
             self.assertEqual(result.data, query_result_data)
 
+    def test_keeps_the_lock_until_the_result_is_stored(self, _):
+        lock_id = _job_lock_id(gen_query_hash("SELECT 1, 2"), self.factory.data_source.id)
+        redis_connection.set(lock_id, "job")
+        locked_while_storing = []
+
+        def store_result(*args, **kwargs):
+            locked_while_storing.append(redis_connection.exists(lock_id))
+            return store(*args, **kwargs)
+
+        store = models.QueryResult.store_result
+        with patch.object(PostgreSQL, "run_query", return_value=({"columns": [], "rows": []}, None)), patch.object(
+            models.QueryResult, "store_result", side_effect=store_result
+        ):
+            execute_query("SELECT 1, 2", self.factory.data_source.id, {})
+
+        self.assertEqual([1], locked_while_storing)
+        self.assertFalse(redis_connection.exists(lock_id))
+
+    def test_reports_data_size(self, _):
+        with patch.object(PostgreSQL, "run_query") as qr, patch(
+            "redash.tasks.queries.execution.statsd_client"
+        ) as statsd_client:
+            qr.return_value = ({"columns": [], "rows": []}, None)
+            result_id = execute_query("SELECT 1, 2", self.factory.data_source.id, {})
+
+        result = models.QueryResult.query.get(result_id)
+        statsd_client.timing.assert_called_once_with(
+            "query_results.data_size.{}".format(self.factory.data_source.id), result.data_size
+        )
+
     def test_success_scheduled(self, _):
         """
         Scheduled queries remember their latest results.
@@ -315,3 +461,89 @@ class QueryExecutorTests(BaseTestCase):
             )
             q = models.Query.get_by_id(q.id)
             self.assertEqual(q.schedule_failures, 0)
+
+
+@patch("redash.tasks.queries.execution.get_current_job", side_effect=fetch_job)
+class QueryExecutorStreamingTests(BaseTestCase):
+    columns = [
+        {"name": "_col0", "friendly_name": "_col0", "type": "integer"},
+        {"name": "_col1", "friendly_name": "_col1", "type": "integer"},
+    ]
+
+    def test_stores_streamed_batches(self, _):
+        def stream_query(query, user):
+            yield self.columns
+            yield [{"_col0": 1, "_col1": 2}, {"_col0": 3, "_col1": 4}]
+            yield [{"_col0": 5, "_col1": 6}]
+
+        with patch.object(PostgreSQL, "stream_query", side_effect=stream_query) as sq, patch.object(
+            PostgreSQL, "run_query"
+        ) as qr:
+            result_id = execute_query("SELECT 1, 2", self.factory.data_source.id, {})
+            self.assertEqual(1, sq.call_count)
+            self.assertEqual(0, qr.call_count)
+
+        result = models.QueryResult.query.get(result_id)
+        self.assertEqual(result.payload.row_count, 3)
+        self.assertEqual(
+            result.data,
+            {
+                "columns": self.columns,
+                "rows": [{"_col0": 1, "_col1": 2}, {"_col0": 3, "_col1": 4}, {"_col0": 5, "_col1": 6}],
+            },
+        )
+
+    def test_truncates_to_result_budget(self, _):
+        closed = []
+
+        def stream_query(query, user):
+            try:
+                yield self.columns
+                while True:
+                    yield [{"_col0": 1, "_col1": 2}] * 2
+            finally:
+                closed.append(True)
+
+        with patch.object(PostgreSQL, "stream_query", side_effect=stream_query), patch(
+            "redash.settings.QUERY_RESULTS_MAX_ROWS", 5
+        ):
+            result_id = execute_query("SELECT 1, 2", self.factory.data_source.id, {})
+
+        self.assertEqual(closed, [True])
+        result = models.QueryResult.query.get(result_id)
+        self.assertEqual(result.payload.row_count, 5)
+        self.assertEqual(result.data["truncated"], True)
+        self.assertEqual(result.data["row_count"], 5)
+
+    def test_keeps_truncation_done_by_the_runner(self, _):
+        # E.g. a multi-statement MySQL query, which goes through run_query and fetch_rows.
+        data = {"columns": self.columns, "rows": [{"_col0": 1, "_col1": 2}] * 2, "truncated": True, "row_count": 2}
+
+        with patch.object(PostgreSQL, "stream_query", BaseQueryRunner.stream_query), patch.object(
+            PostgreSQL, "run_query", return_value=(data, None)
+        ), patch("redash.settings.QUERY_RESULTS_MAX_ROWS", 2):
+            result_id = execute_query("SELECT 1, 2", self.factory.data_source.id, {})
+
+        result = models.QueryResult.query.get(result_id)
+        self.assertEqual(result.data["truncated"], True)
+        self.assertEqual(result.data["row_count"], 2)
+
+    def test_runner_error(self, _):
+        def stream_query(query, user):
+            yield self.columns
+            raise QueryRunnerError("relation does not exist")
+
+        with patch.object(PostgreSQL, "stream_query", side_effect=stream_query):
+            result = execute_query("SELECT 1, 2", self.factory.data_source.id, {})
+
+        self.assertTrue(isinstance(result, QueryExecutionError))
+        self.assertEqual(str(result), "relation does not exist")
+
+    def test_disabled(self, _):
+        with patch.object(PostgreSQL, "run_query") as qr, patch.object(PostgreSQL, "stream_query") as sq, patch(
+            "redash.tasks.queries.execution.settings.QUERY_RESULTS_STREAMING_ENABLED", False
+        ):
+            qr.return_value = ({"columns": self.columns, "rows": []}, None)
+            execute_query("SELECT 1, 2", self.factory.data_source.id, {})
+            self.assertEqual(1, qr.call_count)
+            self.assertEqual(0, sq.call_count)
@@ -1,10 +1,13 @@
-from mock import ANY, call, patch
+import datetime
 
-from redash.models import Query
+from mock import ANY, patch
+
+from redash.models import Query, QueryDependency, db
 from redash.tasks.queries.maintenance import refresh_queries
+from redash.utils import utcnow
 from tests import BaseTestCase
 
-ENQUEUE_QUERY = "redash.tasks.queries.maintenance.enqueue_query"
+ENQUEUE_QUERIES = "redash.tasks.queries.maintenance.enqueue_scheduled_queries"
 
 
 class TestRefreshQuery(BaseTestCase):
@@ -20,27 +23,21 @@ class TestRefreshQuery(BaseTestCase):
             options={"apply_auto_limit": True},
         )
         oq = staticmethod(lambda: [query1, query2])
-        with patch(ENQUEUE_QUERY) as add_job_mock, patch.object(Query, "outdated_queries", oq):
+        with patch(ENQUEUE_QUERIES) as add_jobs_mock, patch.object(Query, "outdated_queries", oq):
             refresh_queries()
-            self.assertEqual(add_job_mock.call_count, 2)
-            add_job_mock.assert_has_calls(
+            add_jobs_mock.assert_called_once_with(
                 [
-                    call(
+                    (
                         query1.query_text + " LIMIT 1000",
-                        query1.data_source,
-                        query1.user_id,
-                        scheduled_query=query1,
-                        metadata={"query_id": query1.id, "Username": query1.user.get_actual_user()},
+                        query1,
+                        {"query_id": query1.id, "Username": query1.user.get_actual_user()},
                     ),
-                    call(
+                    (
                         "select 42 LIMIT 1000",
-                        query2.data_source,
-                        query2.user_id,
-                        scheduled_query=query2,
-                        metadata={"query_id": query2.id, "Username": query2.user.get_actual_user()},
+                        query2,
+                        {"query_id": query2.id, "Username": query2.user.get_actual_user()},
                     ),
-                ],
-                any_order=True,
+                ]
             )
 
     def test_enqueues_outdated_queries_for_non_sqlquery(self):
@@ -52,27 +49,13 @@ class TestRefreshQuery(BaseTestCase):
         query1 = self.factory.create_query(data_source=ds, options={"apply_auto_limit": True})
         query2 = self.factory.create_query(query_text="select 42;", data_source=ds, options={"apply_auto_limit": True})
         oq = staticmethod(lambda: [query1, query2])
-        with patch(ENQUEUE_QUERY) as add_job_mock, patch.object(Query, "outdated_queries", oq):
+        with patch(ENQUEUE_QUERIES) as add_jobs_mock, patch.object(Query, "outdated_queries", oq):
             refresh_queries()
-            self.assertEqual(add_job_mock.call_count, 2)
-            add_job_mock.assert_has_calls(
+            add_jobs_mock.assert_called_once_with(
                 [
-                    call(
-                        query1.query_text,
-                        query1.data_source,
-                        query1.user_id,
-                        scheduled_query=query1,
-                        metadata={"query_id": query1.id, "Username": query1.user.get_actual_user()},
-                    ),
-                    call(
-                        query2.query_text,
-                        query2.data_source,
-                        query2.user_id,
-                        scheduled_query=query2,
-                        metadata={"query_id": query2.id, "Username": query2.user.get_actual_user()},
-                    ),
-                ],
-                any_order=True,
+                    (query1.query_text, query1, {"query_id": query1.id, "Username": query1.user.get_actual_user()}),
+                    (query2.query_text, query2, {"query_id": query2.id, "Username": query2.user.get_actual_user()}),
+                ]
             )
 
     def test_doesnt_enqueue_outdated_queries_for_paused_data_source_for_sqlquery(self):
@@ -84,21 +67,15 @@ class TestRefreshQuery(BaseTestCase):
         oq = staticmethod(lambda: [query])
         query.data_source.pause()
         with patch.object(Query, "outdated_queries", oq):
-            with patch(ENQUEUE_QUERY) as add_job_mock:
+            with patch(ENQUEUE_QUERIES) as add_jobs_mock:
                 refresh_queries()
-                add_job_mock.assert_not_called()
+                add_jobs_mock.assert_not_called()
 
             query.data_source.resume()
 
-            with patch(ENQUEUE_QUERY) as add_job_mock:
+            with patch(ENQUEUE_QUERIES) as add_jobs_mock:
                 refresh_queries()
-                add_job_mock.assert_called_with(
-                    query.query_text + " LIMIT 1000",
-                    query.data_source,
-                    query.user_id,
-                    scheduled_query=query,
-                    metadata=ANY,
-                )
+                add_jobs_mock.assert_called_once_with([(query.query_text + " LIMIT 1000", query, ANY)])
 
     def test_doesnt_enqueue_outdated_queries_for_paused_data_source_for_non_sqlquery(
         self,
@@ -112,21 +89,15 @@ class TestRefreshQuery(BaseTestCase):
         oq = staticmethod(lambda: [query])
         query.data_source.pause()
         with patch.object(Query, "outdated_queries", oq):
-            with patch(ENQUEUE_QUERY) as add_job_mock:
+            with patch(ENQUEUE_QUERIES) as add_jobs_mock:
                 refresh_queries()
-                add_job_mock.assert_not_called()
+                add_jobs_mock.assert_not_called()
 
             query.data_source.resume()
 
-            with patch(ENQUEUE_QUERY) as add_job_mock:
+            with patch(ENQUEUE_QUERIES) as add_jobs_mock:
                 refresh_queries()
-                add_job_mock.assert_called_with(
-                    query.query_text,
-                    query.data_source,
-                    query.user_id,
-                    scheduled_query=query,
-                    metadata=ANY,
-                )
+                add_jobs_mock.assert_called_once_with([(query.query_text, query, ANY)])
 
     def test_enqueues_parameterized_queries_for_sqlquery(self):
         """
@@ -148,15 +119,9 @@ class TestRefreshQuery(BaseTestCase):
             },
         )
         oq = staticmethod(lambda: [query])
-        with patch(ENQUEUE_QUERY) as add_job_mock, patch.object(Query, "outdated_queries", oq):
+        with patch(ENQUEUE_QUERIES) as add_jobs_mock, patch.object(Query, "outdated_queries", oq):
             refresh_queries()
-            add_job_mock.assert_called_with(
-                "select 42 LIMIT 1000",
-                query.data_source,
-                query.user_id,
-                scheduled_query=query,
-                metadata=ANY,
-            )
+            add_jobs_mock.assert_called_once_with([("select 42 LIMIT 1000", query, ANY)])
 
     def test_enqueues_parameterized_queries_for_non_sqlquery(self):
         """
@@ -180,15 +145,9 @@ class TestRefreshQuery(BaseTestCase):
             data_source=ds,
         )
         oq = staticmethod(lambda: [query])
-        with patch(ENQUEUE_QUERY) as add_job_mock, patch.object(Query, "outdated_queries", oq):
+        with patch(ENQUEUE_QUERIES) as add_jobs_mock, patch.object(Query, "outdated_queries", oq):
             refresh_queries()
-            add_job_mock.assert_called_with(
-                "select 42",
-                query.data_source,
-                query.user_id,
-                scheduled_query=query,
-                metadata=ANY,
-            )
+            add_jobs_mock.assert_called_once_with([("select 42", query, ANY)])
 
     def test_doesnt_enqueue_parameterized_queries_with_invalid_parameters(self):
         """
@@ -210,9 +169,9 @@ class TestRefreshQuery(BaseTestCase):
             },
         )
         oq = staticmethod(lambda: [query])
-        with patch(ENQUEUE_QUERY) as add_job_mock, patch.object(Query, "outdated_queries", oq):
+        with patch(ENQUEUE_QUERIES) as add_jobs_mock, patch.object(Query, "outdated_queries", oq):
             refresh_queries()
-            add_job_mock.assert_not_called()
+            add_jobs_mock.assert_not_called()
 
     def test_doesnt_enqueue_parameterized_queries_with_dropdown_queries_that_are_detached_from_data_source(
         self,
@@ -239,6 +198,52 @@ class TestRefreshQuery(BaseTestCase):
         self.factory.create_query(id=100, data_source=None)
 
         oq = staticmethod(lambda: [query])
-        with patch(ENQUEUE_QUERY) as add_job_mock, patch.object(Query, "outdated_queries", oq):
+        with patch(ENQUEUE_QUERIES) as add_jobs_mock, patch.object(Query, "outdated_queries", oq):
+            refresh_queries()
+            add_jobs_mock.assert_not_called()
+
+    def create_query_with_result(self, retrieved_at, **kwargs):
+        query_result = self.factory.create_query_result(retrieved_at=retrieved_at)
+        return self.factory.create_query(latest_query_data=query_result, **kwargs)
+
+    def test_enqueues_query_results_queries_only_when_their_inputs_have_new_results(self):
+        results = self.factory.create_data_source(type="results")
+        upstream = self.create_query_with_result(utcnow() - datetime.timedelta(hours=2))
+        query = self.create_query_with_result(
+            utcnow() - datetime.timedelta(hours=1),
+            data_source=results,
+            query_text="SELECT * FROM cached_query_{}".format(upstream.id),
+        )
+        oq = staticmethod(lambda: [query])
+
+        with patch(ENQUEUE_QUERIES) as add_jobs_mock, patch.object(Query, "outdated_queries", oq):
+            refresh_queries()
+            add_jobs_mock.assert_not_called()
+
+            upstream.latest_query_data = self.factory.create_query_result(retrieved_at=utcnow())
+            db.session.flush()
+            refresh_queries()
+            add_jobs_mock.assert_called_once_with([(query.query_text, query, ANY)])
+
+    def test_postpones_query_results_queries_whose_inputs_are_refreshed(self):
+        results = self.factory.create_data_source(type="results")
+        upstream = self.factory.create_query()
+        query = self.factory.create_query(data_source=results, query_text="SELECT * FROM query_{}".format(upstream.id))
+        oq = staticmethod(lambda: [query, upstream])
+
+        with patch(ENQUEUE_QUERIES) as add_jobs_mock, patch.object(Query, "outdated_queries", oq):
+            refresh_queries()
+            add_jobs_mock.assert_called_once_with([(upstream.query_text, upstream, ANY)])
+
+    def test_enqueues_queries_after_the_queries_they_read(self):
+        upstream = self.factory.create_query()
+        query = self.factory.create_query(query_text="select 42")
+        db.session.add(
+            QueryDependency(query_id=query.id, upstream_query_id=upstream.id, kind=QueryDependency.DROPDOWN)
+        )
+        db.session.flush()
+        oq = staticmethod(lambda: [query, upstream])
+
+        with patch(ENQUEUE_QUERIES) as add_jobs_mock, patch.object(Query, "outdated_queries", oq):
             refresh_queries()
-            add_job_mock.assert_not_called()
+            add_jobs_mock.assert_called_once_with([(upstream.query_text, upstream, ANY), ("select 42", query, ANY)])
@@ -1,3 +1,6 @@
+import os
+import threading
+
 from mock import call, patch
 from rq import Connection
 from rq.job import JobStatus
@@ -5,6 +8,13 @@ from rq.job import JobStatus
 from redash import rq_redis_connection
 from redash.tasks import Queue, Worker
 from redash.tasks.queries.execution import enqueue_query
+from redash.tasks.worker import (
+    job_done_channel,
+    notify_job_done,
+    notify_job_progress,
+    wait_for_job,
+    watch_jobs,
+)
 from redash.worker import default_queues, job
 from tests import BaseTestCase
 
@@ -97,3 +107,135 @@ class TestQueueMetrics(BaseTestCase):
 
         foo.delay()
         incr.assert_called_with("rq.jobs.created.default")
+
+
+@patch("redash.settings.WORKER_PERSISTENT_HORSES", True)
+class TestPersistentHorseWorker(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.queue = Queue("default", connection=rq_redis_connection)
+        self.queue.empty()
+
+    def tearDown(self):
+        self.queue.empty()
+        super().tearDown()
+
+    def work(self, *jobs):
+        Worker([self.queue], connection=rq_redis_connection).work(burst=True)
+        for queued in jobs:
+            queued.refresh()
+
+    def test_runs_jobs_in_the_same_work_horse(self):
+        jobs = [self.queue.enqueue("os.getpid") for _ in range(3)]
+
+        self.work(*jobs)
+
+        pids = {job.return_value() for job in jobs}
+        self.assertEqual(1, len(pids))
+        self.assertNotIn(os.getpid(), pids)
+
+    @patch("redash.settings.WORKER_HORSE_MAX_JOBS", 2)
+    def test_recycles_work_horse(self):
+        jobs = [self.queue.enqueue("os.getpid") for _ in range(3)]
+
+        self.work(*jobs)
+
+        pids = [job.return_value() for job in jobs]
+        self.assertEqual(pids[0], pids[1])
+        self.assertNotEqual(pids[1], pids[2])
+
+    def test_replaces_dead_work_horse(self):
+        dead = self.queue.enqueue("os._exit", 1)
+        job = self.queue.enqueue("os.getpid")
+
+        self.work(dead, job)
+
+        self.assertEqual(JobStatus.FAILED, dead.get_status())
+        self.assertEqual(JobStatus.FINISHED, job.get_status())
+
+    def test_enforces_time_limit(self):
+        slow = self.queue.enqueue("time.sleep", 5, job_timeout=1)
+        job = self.queue.enqueue("os.getpid")
+
+        self.work(slow, job)
+
+        self.assertEqual(JobStatus.FAILED, slow.get_status())
+        self.assertEqual(JobStatus.FINISHED, job.get_status())
+
+
+class TestWaitForJob(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.queue = Queue("default", connection=rq_redis_connection)
+        self.queue.empty()
+
+    def tearDown(self):
+        self.queue.empty()
+        super().tearDown()
+
+    def test_times_out_while_the_job_runs(self):
+        queued = self.queue.enqueue("os.getpid")
+
+        self.assertFalse(wait_for_job(queued, 0.1))
+
+    def test_returns_once_notified(self):
+        queued = self.queue.enqueue("os.getpid")
+        timer = threading.Timer(0.1, notify_job_done, [queued])
+        timer.start()
+
+        self.assertTrue(wait_for_job(queued, 5))
+        timer.join()
+
+    def test_returns_when_the_job_is_already_done(self):
+        queued = self.queue.enqueue("os.getpid")
+        queued.cancel()
+
+        self.assertTrue(wait_for_job(queued, 5))
+
+    def test_worker_notifies_when_the_job_is_done(self):
+        queued = self.queue.enqueue("os.getpid")
+        pubsub = rq_redis_connection.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(job_done_channel(queued.id))
+
+        Worker([self.queue], connection=rq_redis_connection).work(burst=True)
+
+        # The first message is the confirmation of the subscription.
+        messages = [pubsub.get_message(timeout=1) for _ in range(2)]
+        pubsub.close()
+        self.assertEqual(b"finished", messages[-1]["data"])
+
+
+class TestWatchJobs(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.queue = Queue("default", connection=rq_redis_connection)
+        self.queue.empty()
+
+    def tearDown(self):
+        self.queue.empty()
+        super().tearDown()
+
+    def test_yields_the_jobs_then_their_changes(self):
+        first = self.queue.enqueue("os.getpid")
+        second = self.queue.enqueue("os.getpid")
+        timers = [
+            threading.Timer(0.1, notify_job_progress, [first, "executing_query"]),
+            threading.Timer(0.2, second.cancel),
+            threading.Timer(0.3, first.cancel),
+        ]
+        for timer in timers:
+            timer.start()
+
+        watched = [job.id for job in watch_jobs([first.id, second.id, "missing"], rq_redis_connection, 5)]
+        for timer in timers:
+            timer.join()
+
+        self.assertEqual(watched, [first.id, second.id, first.id, second.id, first.id])
+
+    def test_stops_at_the_timeout_with_heartbeats(self):
+        queued = self.queue.enqueue("os.getpid")
+
+        watched = list(watch_jobs([queued.id], rq_redis_connection, 0.35, heartbeat=0.1))
+
+        self.assertEqual(watched[0].id, queued.id)
+        self.assertEqual(watched[1:], [None, None, None])
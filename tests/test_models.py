@@ -325,6 +325,27 @@ class QueryOutdatedQueriesTest(BaseTestCase):
         queries = models.Query.outdated_queries()
         self.assertNotIn(query, queries)
 
+    def test_indexes_next_run(self):
+        query = self.create_scheduled_query(interval="3600")
+        self.fake_previous_execution(query, minutes=30)
+        db.session.flush()
+
+        self.assertEqual(query.next_run_at, query.latest_query_data.retrieved_at + datetime.timedelta(hours=1))
+
+        query.schedule["disabled"] = True
+        db.session.flush()
+
+        self.assertIsNone(query.next_run_at)
+
+    def test_reindexes_queries_that_already_started(self):
+        query = self.create_scheduled_query(interval="3600")
+        self.fake_previous_execution(query, hours=2)
+        db.session.flush()
+        models.scheduled_queries_executions.update(query.id)
+
+        self.assertNotIn(query, models.Query.outdated_queries())
+        self.assertGreater(query.next_run_at, utcnow())
+
 
 class QueryArchiveTest(BaseTestCase):
     def test_archive_query_sets_flag(self):
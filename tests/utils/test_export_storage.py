@@ -0,0 +1,40 @@
+import os
+import tempfile
+import time
+from unittest import TestCase
+
+from redash.utils.export_storage import LocalExportStorage
+
+
+class TestLocalExportStorage(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.storage = LocalExportStorage(os.path.join(self.directory.name, "exports"))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def save(self, key, content):
+        fd, filename = tempfile.mkstemp(dir=self.directory.name)
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+        self.storage.save(key, filename)
+        self.assertFalse(os.path.isfile(filename))
+
+    def test_saves_files(self):
+        self.assertFalse(self.storage.exists("a"))
+        self.save("a", b"content")
+        self.assertTrue(self.storage.exists("a"))
+
+    def test_removes_expired_files(self):
+        self.save("old", b"content")
+        self.save("new", b"content")
+        an_hour_ago = time.time() - 3600
+        os.utime(os.path.join(self.storage.path, "old"), (an_hour_ago, an_hour_ago))
+
+        self.assertEqual(self.storage.cleanup(600), 1)
+        self.assertFalse(self.storage.exists("old"))
+        self.assertTrue(self.storage.exists("new"))
+
+    def test_cleanup_without_files(self):
+        self.assertEqual(self.storage.cleanup(600), 0)
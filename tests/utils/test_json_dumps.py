@@ -1,4 +1,14 @@
-from redash.utils import json_dumps, json_loads
+import datetime
+import decimal
+import json
+import math
+import uuid
+from unittest import TestCase
+from unittest.mock import patch
+
+import orjson
+
+from redash.utils import json_dumpb, json_dumps, json_loads
 from tests import BaseTestCase
 
 
@@ -29,3 +39,75 @@ class TestJsonDumps(BaseTestCase):
         json_data = json_dumps(input_data)
         actual_output_data = json_loads(json_data)
         self.assertEqual(actual_output_data, expected_output_data)
+
+
+class TestJsonCodecs(TestCase):
+    data = {
+        "datetime": datetime.datetime(2024, 1, 2, 3, 4, 5, 678901, tzinfo=datetime.timezone.utc),
+        "naive_datetime": datetime.datetime(2024, 1, 2, 3, 4, 5),
+        "date": datetime.date(2024, 1, 2),
+        "time": datetime.time(3, 4, 5, 678901),
+        "timedelta": datetime.timedelta(seconds=90),
+        "decimal": decimal.Decimal("1.5"),
+        "uuid": uuid.UUID("12345678-1234-5678-1234-567812345678"),
+        "bytes": b"test",
+        "nan": float("nan"),
+        "big_int": 2**70,
+        "unicode": "שלום",
+        1: "int key",
+    }
+
+    def dumps(self, codec, *args, **kwargs):
+        with patch("redash.settings.JSON_CODEC", codec):
+            return json_dumps(*args, **kwargs)
+
+    def test_codecs_produce_the_same_values(self):
+        with patch("redash.utils.orjson.dumps", wraps=orjson.dumps) as orjson_dumps:
+            compact = self.dumps("orjson", self.data, separators=(",", ":"))
+        orjson_dumps.assert_called_once()
+
+        self.assertEqual(json.loads(compact), json.loads(self.dumps("json", self.data, separators=(",", ":"))))
+
+    def test_codecs_produce_the_same_output_for_edge_cases(self):
+        cases = [
+            {"nan": float("nan"), "inf": float("inf"), "nested": [float("-inf"), 1.5]},
+            {"big_int": 2**70, "small_int": 1},
+            {1: "int key", "2": "str key"},
+        ]
+        for data in cases:
+            self.assertEqual(
+                self.dumps("orjson", data, separators=(",", ":")), self.dumps("json", data, separators=(",", ":"))
+            )
+
+    def test_orjson_output(self):
+        compact = self.dumps("orjson", {"b": 1, "a": [1.5, None]}, sort_keys=True, separators=(",", ":"))
+        self.assertEqual(compact, '{"a":[1.5,null],"b":1}')
+        self.assertEqual(self.dumps("orjson", {"a": 1}), '{"a": 1}')
+
+    def test_stdlib_only_options_use_stdlib(self):
+        self.assertEqual(self.dumps("orjson", {"a": 1}, indent=2), '{\n  "a": 1\n}')
+
+    def test_json_dumpb(self):
+        self.assertEqual(json_dumpb({"a": "ä"}), json_dumps({"a": "ä"}, separators=(",", ":")).encode("utf-8"))
+
+    def test_json_loads_accepts_nan(self):
+        self.assertTrue(math.isnan(json_loads('{"a": NaN}')["a"]))
+
+    def test_runner_encoders_are_resolved_by_type(self):
+        class Custom:
+            pass
+
+        class Runner:
+            calls = 0
+
+            @classmethod
+            def custom_json_encoder(cls, dec, o):
+                cls.calls += 1
+                return "custom" if isinstance(o, Custom) else None
+
+        with patch.dict("redash.query_runner.query_runners", {"custom": Runner}):
+            self.assertEqual(json_loads(json_dumps([Custom(), Custom()])), ["custom", "custom"])
+            self.assertEqual(json_loads(json_dumps([decimal.Decimal(1), decimal.Decimal(2)])), [1, 2])
+
+        # Once for each Custom instance, and only once for the Decimals.
+        self.assertEqual(Runner.calls, 3)
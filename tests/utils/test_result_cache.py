@@ -0,0 +1,69 @@
+from unittest.mock import patch
+
+from redash.utils import result_cache
+from tests import BaseTestCase
+
+
+@patch("redash.settings.QUERY_RESULTS_CACHE_SIZE", 1)
+class TestResultCache(BaseTestCase):
+    def test_returns_what_was_cached(self):
+        result_cache.put(1, {"query_hash": "abc"}, b"payload")
+
+        self.assertEqual(result_cache.get(1), ({"query_hash": "abc"}, b"payload"))
+        self.assertIsNone(result_cache.get(2))
+
+    def test_counts_hits_and_misses(self):
+        result_cache.put(1, {}, b"payload")
+        result_cache.get(1)
+        result_cache.get(1)
+        result_cache.get(2)
+
+        stats = result_cache.get_stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["entries"]), (2, 1, 1))
+        self.assertAlmostEqual(stats["hit_ratio"], 2 / 3)
+        self.assertEqual(stats["bytes_saved"], 2 * stats["size"])
+
+    @patch("redash.settings.QUERY_RESULTS_CACHE_MAX_ENTRY_SIZE", 100)
+    def test_admits_large_results_on_their_second_miss(self):
+        large = b"x" * (result_cache.ADMIT_AT_ONCE_SIZE + 1)
+
+        result_cache.put(1, {}, large)
+        self.assertIsNone(result_cache.get(1))
+
+        result_cache.put(1, {}, large)
+        self.assertEqual(result_cache.get(1), ({}, large))
+
+    @patch("redash.settings.QUERY_RESULTS_CACHE_MAX_ENTRY_SIZE", 1)
+    def test_skips_results_over_the_entry_size(self):
+        for _ in range(2):
+            result_cache.put(1, {}, b"x" * 1024)
+
+        self.assertIsNone(result_cache.get(1))
+
+    def test_evicts_the_least_recently_read_results(self):
+        payload = b"x" * (result_cache.ADMIT_AT_ONCE_SIZE - 10)
+        for result_id in range(20):
+            result_cache.put(result_id, {}, payload)
+            result_cache.get(0)
+
+        self.assertIsNotNone(result_cache.get(0))
+        self.assertIsNone(result_cache.get(1))
+        self.assertIsNotNone(result_cache.get(19))
+        self.assertLessEqual(result_cache.get_stats()["size"], 1024 * 1024)
+
+    def test_invalidates_results(self):
+        result_cache.put(1, {}, b"payload")
+        result_cache.put(2, {}, b"payload")
+
+        result_cache.invalidate([1])
+
+        self.assertIsNone(result_cache.get(1))
+        self.assertIsNotNone(result_cache.get(2))
+        self.assertEqual(result_cache.get_stats()["entries"], 1)
+
+    def test_does_nothing_when_disabled(self):
+        with patch("redash.settings.QUERY_RESULTS_CACHE_SIZE", 0):
+            result_cache.put(1, {}, b"payload")
+
+            self.assertIsNone(result_cache.get(1))
+            self.assertEqual(result_cache.get_stats(), {"enabled": False})
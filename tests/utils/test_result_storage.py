@@ -0,0 +1,103 @@
+import json
+from unittest import TestCase
+
+from redash.utils import json_dumpb, json_dumps
+from redash.utils.result_storage import (
+    FORMAT_COLUMNAR,
+    FORMAT_JSON,
+    ColumnarResultWriter,
+    ResultPayload,
+    encode_result,
+    is_columnar,
+)
+
+columns = [
+    {"name": "id", "friendly_name": "id", "type": "integer"},
+    {"name": "name", "friendly_name": "name", "type": "string"},
+]
+rows = [{"id": i, "name": "name {}".format(i)} for i in range(25)]
+data = {"columns": columns, "rows": rows}
+
+
+class TestResultStorage(TestCase):
+    def test_columnar_roundtrip(self):
+        raw = encode_result(data, FORMAT_COLUMNAR)
+        self.assertTrue(is_columnar(raw))
+
+        payload = ResultPayload(raw)
+        self.assertEqual(payload.columns, columns)
+        self.assertEqual(payload.row_count, 25)
+        self.assertEqual(payload.to_dict(), data)
+
+    def test_keeps_extra_keys(self):
+        payload = ResultPayload(encode_result(dict(data, truncated=True), FORMAT_COLUMNAR))
+        self.assertEqual(payload.to_dict()["truncated"], True)
+
+    def test_columnar_is_smaller_than_json(self):
+        many_rows = {"columns": columns, "rows": [{"id": i, "name": "same name"} for i in range(10000)]}
+        self.assertLess(len(encode_result(many_rows, FORMAT_COLUMNAR)), len(json_dumps(many_rows)) / 5)
+
+    def test_iter_rows_decodes_ranges_across_row_groups(self):
+        writer = ColumnarResultWriter(columns, row_group_size=10)
+        writer.write_rows(rows)
+        payload = ResultPayload(writer.close())
+
+        self.assertEqual(list(payload.iter_rows(start=8, stop=12)), rows[8:12])
+        self.assertEqual(list(payload.iter_rows(start=20)), rows[20:])
+
+    def test_iter_rows_decodes_selected_columns(self):
+        payload = ResultPayload(encode_result(data, FORMAT_COLUMNAR))
+        self.assertEqual(list(payload.iter_rows(columns=["id"], stop=2)), [{"id": 0}, {"id": 1}])
+
+    def test_ragged_rows_are_stored_row_oriented(self):
+        ragged = {"columns": columns, "rows": [{"id": 1}, {"id": 2, "name": "b", "extra": True}]}
+        payload = ResultPayload(encode_result(ragged, FORMAT_COLUMNAR))
+
+        self.assertTrue(payload.is_columnar)
+        self.assertEqual(payload.to_dict(), ragged)
+        self.assertEqual(list(payload.iter_rows(columns=["name"])), [{}, {"name": "b"}])
+
+    def test_reads_legacy_json(self):
+        payload = ResultPayload(json_dumps(data).encode("utf-8"))
+
+        self.assertFalse(payload.is_columnar)
+        self.assertEqual(payload.row_count, 25)
+        self.assertEqual(list(payload.iter_rows(columns=["id"], stop=1)), [{"id": 0}])
+        self.assertEqual(payload.to_dict(), data)
+
+    def test_uses_json_for_other_shapes(self):
+        raw = encode_result({"a": 1}, FORMAT_COLUMNAR)
+        self.assertFalse(is_columnar(raw))
+        self.assertEqual(encode_result(data, FORMAT_JSON), json_dumpb(data))
+
+    def test_iter_json_matches_to_dict(self):
+        writer = ColumnarResultWriter(columns, row_group_size=10)
+        writer.write_rows(rows)
+        ragged = {"columns": columns, "rows": [{"id": 1}, {"id": 2, "name": "b", "extra": True}]}
+        payloads = [
+            ResultPayload(writer.close(extra={"truncated": True})),
+            ResultPayload(encode_result(ragged, FORMAT_COLUMNAR)),
+            ResultPayload(encode_result({"columns": columns, "rows": []}, FORMAT_COLUMNAR)),
+            ResultPayload(json_dumps(data).encode("utf-8")),
+        ]
+
+        for payload in payloads:
+            self.assertEqual(json.loads(b"".join(payload.iter_json())), payload.to_dict())
+
+    def test_iter_json_columns_matches_rows(self):
+        writer = ColumnarResultWriter(columns, row_group_size=10)
+        writer.write_rows(rows)
+        ragged = {"columns": columns, "rows": [{"id": 1}, {"id": 2, "name": "b", "extra": True}]}
+        payloads = [
+            ResultPayload(writer.close()),
+            ResultPayload(encode_result(ragged, FORMAT_COLUMNAR)),
+            ResultPayload(json_dumps(data).encode("utf-8")),
+        ]
+
+        for payload in payloads:
+            decoded = []
+            for arrays in payload.iter_json_columns():
+                values = [json.loads(array) for array in arrays]
+                decoded.extend(dict(zip(["id", "name"], row)) for row in zip(*values))
+            expected = [{"id": row.get("id"), "name": row.get("name")} for row in payload.iter_rows()]
+            self.assertEqual(decoded, expected)